@@ -15,20 +15,29 @@ py::array_t<int64_t> align_sequences(
 	const int64_t fill_value 						// Fill value for un-aligned data
 	);
 
-std::tuple<std::vector<size_t>, std::vector<size_t>> pair_sequences(
-		int64_t* times1,
-		int64_t* times2,
-		size_t N1,
-		size_t N2,
-		const size_t max_dist
+py::tuple pair_times(
+	py::array_t<int64_t> times1, 				// Sorted times from input sequence 1 
+	py::array_t<int64_t> times2, 				// Sorted times from input sequence 2
+	const size_t max_dist 							// Maximum temporal distance for pairing
 	);
 
-void mergesort_into(
-		std::vector<int64_t>& vals, 	// Implicit 2xN value vector to modify
-		int64_t* times1,
-		int64_t* times2,
-		int64_t* vals1,
-		int64_t* vals2,
+size_t pair_sequences(
+		const int64_t* times1,
+		const int64_t* times2,
+		const size_t N1,
+		const size_t N2,
+		const size_t max_dist,
+		int64_t* idxs1,
+		int64_t* idxs2
+	);
+
+size_t mergesort_into(
+		int64_t* vals, 								// Implicit 2xN value array to write into
+		size_t pos,										// Row of vals to start writing at
+		const int64_t* times1,
+		const int64_t* times2,
+		const int64_t* vals1,
+		const int64_t* vals2,
 		size_t i1,										// Start index for seq 1
 		size_t i2,										// Start index for seq 2
 		const size_t I1,							// Stop index for seq 1
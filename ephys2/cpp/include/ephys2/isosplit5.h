@@ -33,6 +33,7 @@ struct isosplit5_opts {
 	int K_init = 200;
 	bool refine_clusters = false;
 	int max_iterations_per_pass = 500;
+	size_t n_threads = 1; // Threads for the cluster statistics and pair comparisons (0 = hardware concurrency)
 };
 
 bool isosplit5(
@@ -43,7 +44,19 @@ bool isosplit5(
 	const std::optional<int> K_init,
 	const std::optional<bool> refine_clusters,
 	const std::optional<int> max_iterations_per_pass,
-  const std::optional<int> seed       
+  const std::optional<int> seed,
+  const size_t n_threads
+	);
+
+py::array_t<int64_t> isosplit5_pca_branch(
+	py::array_t<float, py::array::c_style> X,
+	const size_t n_components,
+	const std::optional<float> isocut_threshold,
+	const std::optional<int> min_cluster_size,
+	const std::optional<int> K_init,
+	const std::optional<bool> refine_clusters,
+	const std::optional<int> max_iterations_per_pass,
+	const size_t n_threads
 	);
 
 bool isosplit5_rec(
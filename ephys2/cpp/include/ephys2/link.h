@@ -13,6 +13,15 @@ using EVIncidence = std::tuple<
 	std::tuple<int, int> 								// Shape
 >;
 
+std::vector<int64_t> label_components(
+	EVIncidence linkage, 						// Linkage matrix
+	int64_t min_size 								// Minimum number of labels to map
+);
+
+py::array_t<int64_t> link_label_map(
+	EVIncidence linkage 						// Linkage matrix
+);
+
 void link_labels(
 	py::array_t<int64_t> unlinked, 	// Un-linked labels
 	py::array_t<int64_t> linked, 		// Linked labels (written to)
@@ -24,13 +24,41 @@ SPCResult super_paramagnetic_clustering(
 	const size_t cyc,						// Total number of cycles
 	const int K, 								// Maximal number of nearest neighbours (used in the knn algorithm)
 	const bool MSTree, 					// Whether to add the edges of the minimal spanning tree (should default to True)
-	const std::optional<int> seed		// Random seed
+	const std::optional<int> seed,	// Random seed
+	const size_t n_threads			// Number of threads (0 = hardware concurrency)
 	);
 
+SPCResult super_paramagnetic_clustering_sparse(
+	py::array_t<int64_t> indptr, 	// Neighbor graph in CSR format (N_samples + 1,); must be symmetric
+	py::array_t<int64_t> indices, // Neighbors of each sample, in ascending order within each row
+	py::array_t<double> dists, 		// Distances to the neighbors
+	const float Tmin, 						// Minimum temperature
+	const float Tmax, 						// Maximum temperature
+	const float Tstep, 						// Temperature step
+	const size_t cyc,							// Total number of cycles
+	const std::optional<int> seed,	// Random seed
+	const size_t n_threads				// Number of threads (0 = hardware concurrency)
+	);
+
+SPCResult swendsen_wang(
+	UIRaggedArray NK, 					// Ordered neighbors of each sample (freed on return)
+	EdgeDistanceResult edr, 		// Distances along each edge in NK (freed on return)
+	const float Tmin, 					// Minimum temperature
+	const float Tmax, 					// Maximum temperature
+	const float Tstep, 					// Temperature step
+	const size_t cyc,						// Total number of cycles
+	const std::optional<int> seed,	// Random seed
+	const size_t n_threads			// Number of threads (0 = hardware concurrency)
+	);
+
+unsigned int seed_sequence(const unsigned int seed, const size_t index);
+
 UIRaggedArray knn(const size_t N, const size_t K, const bool MSTree, py::array_t<double> dists );
 
 void mstree(const size_t N, py::array_t<double> dists, unsigned int** edg);
 
 EdgeDistanceResult EdgeDistance( UIRaggedArray NK, py::array_t<double> dists );
 
+EdgeDistanceResult EdgeDistanceSparse( UIRaggedArray NK, py::array_t<int64_t> indptr, py::array_t<double> dists );
+
 #endif
\ No newline at end of file
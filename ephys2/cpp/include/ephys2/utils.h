@@ -1,6 +1,14 @@
 #include <pybind11/pybind11.h>
 #include <pybind11/numpy.h>
 #include <stdexcept>
+#include <thread>
+#include <atomic>
+#include <exception>
+#include <mutex>
+#include <condition_variable>
+#include <deque>
+#include <vector>
+#include <algorithm>
 
 #ifndef UTILS_H
 #define UTILS_H
@@ -52,4 +60,105 @@ inline void py_assert(bool cond, const std::string& msg)
 	}
 }
 
+template <typename F>
+void parallel_for(const size_t n, size_t n_threads, F&& f)
+// Call f(i) for i = 0, ..., n-1 on up to n_threads threads (0 = hardware concurrency).
+// Indices are handed out dynamically; the first exception thrown is re-raised in the caller.
+{
+	if (n_threads == 0) {
+		n_threads = std::max(std::thread::hardware_concurrency(), 1u);
+	}
+	n_threads = std::min(n_threads, n);
+	if (n_threads <= 1) {
+		for (size_t i = 0; i < n; i++) {
+			f(i);
+		}
+		return;
+	}
+	std::atomic<size_t> next(0);
+	std::exception_ptr error = nullptr;
+	std::mutex error_mutex;
+	auto worker = [&]() {
+		size_t i;
+		while ((i = next++) < n) {
+			try {
+				f(i);
+			} catch (...) {
+				std::lock_guard<std::mutex> lock(error_mutex);
+				if (! error) {
+					error = std::current_exception();
+				}
+				next = n;
+			}
+		}
+	};
+	std::vector<std::thread> threads;
+	for (size_t t = 1; t < n_threads; t++) {
+		threads.emplace_back(worker);
+	}
+	worker();
+	for (auto& thread : threads) {
+		thread.join();
+	}
+	if (error) {
+		std::rethrow_exception(error);
+	}
+}
+
+template <typename T, typename F>
+void parallel_work_queue(std::vector<T> items, size_t n_threads, F&& f)
+// Process items on up to n_threads threads (0 = hardware concurrency), where f(item, push) may
+// push further items to process, e.g. for recursive branching. Returns once all items are processed;
+// the first exception thrown is re-raised in the caller.
+{
+	if (n_threads == 0) {
+		n_threads = std::max(std::thread::hardware_concurrency(), 1u);
+	}
+	std::deque<T> queue(items.begin(), items.end());
+	size_t n_active = 0;
+	std::exception_ptr error = nullptr;
+	std::mutex mutex;
+	std::condition_variable cv;
+	auto worker = [&]() {
+		std::unique_lock<std::mutex> lock(mutex);
+		while (true) {
+			cv.wait(lock, [&]() { return ! queue.empty() || n_active == 0 || error; });
+			if (queue.empty() || error) {
+				return;
+			}
+			T item = std::move(queue.front());
+			queue.pop_front();
+			n_active++;
+			lock.unlock();
+			std::vector<T> pushed;
+			std::exception_ptr item_error = nullptr;
+			try {
+				f(item, [&](T next) { pushed.push_back(std::move(next)); });
+			} catch (...) {
+				item_error = std::current_exception();
+			}
+			lock.lock();
+			n_active--;
+			if (item_error && ! error) {
+				error = item_error;
+			}
+			for (auto& next : pushed) {
+				queue.push_back(std::move(next));
+			}
+			cv.notify_all();
+		}
+	};
+	std::vector<std::thread> threads;
+	for (size_t t = 1; t < n_threads; t++) {
+		threads.emplace_back(worker);
+	}
+	worker();
+	for (auto& thread : threads) {
+		thread.join();
+	}
+	if (error) {
+		std::rethrow_exception(error);
+	}
+}
+
 #endif
\ No newline at end of file
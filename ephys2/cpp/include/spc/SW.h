@@ -31,10 +31,10 @@ void DistanceToInteraction( EdgeDistanceResult edr, UIRaggedArray NK, UIRaggedAr
 /* aux1.c */
 void InitialSpinConfig(int N, unsigned int *Spin, int Q);
 void NewSpinConfig( int N, unsigned int  *Spin, unsigned int *Block, 
-		    int NBlk, int Q, unsigned int *NewSpinValue);
+		    int NBlk, int Q, unsigned int *NewSpinValue, SeqRandState* rng);
 void DeletionProbabilities( float T, RaggedArray J, RaggedArray P );
 int SetBond( RaggedArray P, unsigned int *Spin, CRaggedArray Bond,
-             UIRaggedArray NK, UIRaggedArray KN);
+             UIRaggedArray NK, UIRaggedArray KN, SeqRandState* rng);
 int  Coarsening(CRaggedArray Bond, unsigned int *Block,
                 UIRaggedArray NK, unsigned int *ClusterSize,
 		unsigned int* Stack );
@@ -49,7 +49,7 @@ void  GlobalCorrelation( UIRaggedArray CorrN, UIRaggedArray NK,
 void  FourPointCorrelation( RARaggedArray FPCorr, UIRaggedArray NK,
 			    unsigned int *Block);
 float Magnetization( int N, int Q, int nc, unsigned int *ClusterSize,
-		     float* mag, unsigned int *N_spin );
+		     float* mag, unsigned int *N_spin, SeqRandState* rng );
 void OrderClusterSize( int nc, unsigned int *ClusterSize );
 void ClusterAverage(int ncy, int N, float *Size1, float *Size2);
 void Susceptibility( int Q, int ncy, float* M1, float* M2, float* xi );
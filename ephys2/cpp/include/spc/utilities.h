@@ -4,8 +4,14 @@
 #define assure(expr,message)                            \
         if      (expr) ;                                \
         else error("at line %d of '%s': %s",__LINE__,__FILE__,message);
-#define RAND(i)   ( (double)(i)*rand() / ((double)RAND_MAX+.01) )
-#define IRAND(i)  ( (int)RAND(i) )
+#define RAND(rng,i)   ( (double)(i)*SeqRand(rng) / ((double)SEQ_RAND_MAX+.01) )
+#define IRAND(rng,i)  ( (int)RAND(rng,i) )
+
+/* Random sequence (SplitMix64) whose state is passed explicitly, so that Monte Carlo chains can run concurrently */
+#define SEQ_RAND_MAX 0x7fffffff
+typedef struct { unsigned long long s; } SeqRandState;
+void SeqSeed( SeqRandState* rng, unsigned long long seed );
+unsigned int SeqRand( SeqRandState* rng );
 
 void error( const char * message, ... );
 unsigned int* InitUIVector( long n );
@@ -23,129 +23,174 @@ py::array_t<int64_t> align_sequences(
 
 	const size_t N1 = times1.shape(0);
 	const size_t N2 = times2.shape(0);
+	py_assert((size_t)vals1.shape(0) == N1 && (size_t)vals2.shape(0) == N2, "Times and values must have the same length");
 
-	int64_t* ts1 = static_cast<int64_t *>(times1.request().ptr);
-	int64_t* ts2 = static_cast<int64_t *>(times2.request().ptr);
-	int64_t* vs1 = static_cast<int64_t *>(vals1.request().ptr);
-	int64_t* vs2 = static_cast<int64_t *>(vals2.request().ptr);
+	const int64_t* ts1 = times1.data();
+	const int64_t* ts2 = times2.data();
+	const int64_t* vs1 = vals1.data();
+	const int64_t* vs2 = vals2.data();
 
 	// Pair the sequences
-	auto paired_indices = pair_sequences(ts1, ts2, N1, N2, max_dist);
-	std::vector<size_t> idxs1 = std::get<0>(paired_indices);
-	std::vector<size_t> idxs2 = std::get<1>(paired_indices);
-	py_assert(idxs1.size() == idxs2.size(), "Index sizes were inconsistent");
-	const size_t K = idxs1.size();
-
-	// Fill in values & missing values
-	std::vector<int64_t> vals; // Values from the full aligned sequence (N x 2)
+	std::vector<int64_t> idxs1(std::min(N1, N2));
+	std::vector<int64_t> idxs2(std::min(N1, N2));
+	const size_t K = pair_sequences(ts1, ts2, N1, N2, max_dist, idxs1.data(), idxs2.data());
+
+	// Fill in values & missing values; every unpaired element occupies one row, and every pair one row
+	const size_t N = N1 + N2 - K;
+	py::array_t<int64_t> result({N, (size_t)2});
+	int64_t* out = result.mutable_data();
 	size_t i1 = 0;
 	size_t i2 = 0;
-	for (int k=0; k<K; k++) {
+	size_t pos = 0;
+	for (size_t k=0; k<K; k++) {
 		size_t I1 = idxs1[k];
 		size_t I2 = idxs2[k];
-		mergesort_into(vals, ts1, ts2, vs1, vs2, i1, i2, I1, I2, fill_value);
-		vals.push_back(vs1[I1]);
-		vals.push_back(vs2[I2]);
+		pos = mergesort_into(out, pos, ts1, ts2, vs1, vs2, i1, i2, I1, I2, fill_value);
+		out[2*pos] = vs1[I1];
+		out[2*pos+1] = vs2[I2];
+		pos++;
 		i1 = I1 + 1;
 		i2 = I2 + 1;
 	}
-	mergesort_into(vals, ts1, ts2, vs1, vs2, i1, i2, N1, N2, fill_value);
+	pos = mergesort_into(out, pos, ts1, ts2, vs1, vs2, i1, i2, N1, N2, fill_value);
+	py_assert(pos == N, "Aligned sequence size was inconsistent");
 
-	// Reshape result
-	size_t N = vals.size() / 2;
-	return seq2numpy(vals, {N, 2});
+	return result;
 }
 
-std::tuple<std::vector<size_t>, std::vector<size_t>> pair_sequences(
-		int64_t* times1,
-		int64_t* times2,
-		size_t N1,
-		size_t N2,
-		const size_t max_dist
+py::tuple pair_times(
+	py::array_t<int64_t> times1, 				// Sorted times from input sequence 1 
+	py::array_t<int64_t> times2, 				// Sorted times from input sequence 2
+	const size_t max_dist 							// Maximum temporal distance for pairing
 	)
-// Find an index pairing between two sequences satisfying the maximum distance criterion.
+// Pair two sorted sequences in time, returning the (K,) indices of paired elements in each.
 {
+	const size_t N1 = times1.shape(0);
+	const size_t N2 = times2.shape(0);
+	py::array_t<int64_t> idxs1(std::min(N1, N2));
+	py::array_t<int64_t> idxs2(std::min(N1, N2));
+	const int64_t* ts1 = times1.data();
+	const int64_t* ts2 = times2.data();
+	int64_t* is1 = idxs1.mutable_data();
+	int64_t* is2 = idxs2.mutable_data();
 	py_assert(max_dist > 0, "Maximum distance must be positive");
 
-	bool reverse_args = false;
-	if (N2 < N1) {
-		// Reverse arguments. WLOG, we assume the first is smaller than the second.
-		std::swap(times1, times2);
-		std::swap(N1, N2);
-		reverse_args = true;
+	size_t K;
+	{
+		py::gil_scoped_release release;
+		K = pair_sequences(ts1, ts2, N1, N2, max_dist, is1, is2);
 	}
+	idxs1.resize({K});
+	idxs2.resize({K});
+	return py::make_tuple(idxs1, idxs2);
+}
 
-	std::vector<size_t> idxs1;
-	std::vector<size_t> idxs2;
+size_t pair_sequences(
+		const int64_t* times1,
+		const int64_t* times2,
+		const size_t N1,
+		const size_t N2,
+		const size_t max_dist,
+		int64_t* idxs1,								// Output paired indices into seq 1 (at least min(N1, N2) long)
+		int64_t* idxs2 								// Output paired indices into seq 2 (at least min(N1, N2) long)
+	)
+// Find an index pairing between two sorted sequences satisfying the maximum distance criterion.
+// Elements are paired greedily in time order, and only with their neighbors in the merged sequence; an element is 
+// passed over only once it has no possible partner. An element is paired with the closer of its two bracketing neighbors
+// (ties to the earlier), so for strictly increasing sequences the pairing is symmetric in its arguments.
+// Returns the number of pairs K <= min(N1, N2).
+{
+	py_assert(max_dist > 0, "Maximum distance must be positive");
 
+	size_t K = 0;
 	size_t i1 = 0;
 	size_t i2 = 0;
 
 	while ((i1 < N1) && (i2 < N2)) {
-		size_t best_dist = std::abs(times1[i1] - times2[i2]);
-		size_t best_i2 = i2;
-
-		while ((i2 < N2) && (times2[i2] <= times1[i1])) {
-			size_t dist = std::abs(times1[i1] - times2[i2]);
-			if (dist < best_dist) {
-				best_dist = dist;
-				best_i2 = i2;
+		if (times1[i1] <= times2[i2]) {
+			// The next element of seq 1 is at least as close to times2[i2]
+			if ((i1 + 1 < N1) && (times1[i1 + 1] <= times2[i2])) {
+				i1++;
+				continue;
+			}
+			// times2[i2] is bracketed by times1[i1] and times1[i1 + 1]; take the closer, ties to the earlier
+			if ((i1 + 1 < N1) && (times1[i1 + 1] - times2[i2] < times2[i2] - times1[i1])) {
+				i1++;
+				continue;
+			}
+		} else {
+			// The next element of seq 2 is closer to times1[i1]
+			if ((i2 + 1 < N2) && (times2[i2 + 1] < times1[i1])) {
+				i2++;
+				continue;
+			}
+			// times1[i1] is bracketed by times2[i2] and times2[i2 + 1]; take the closer, ties to the earlier
+			if ((i2 + 1 < N2) && (times2[i2 + 1] - times1[i1] < times1[i1] - times2[i2])) {
+				i2++;
+				continue;
 			}
-			i2++;
 		}
-
-		if ((best_i2 < N2) && (best_dist <= max_dist)) {
-			idxs1.push_back(i1);
-			idxs2.push_back(best_i2);
+		// times1[i1] and times2[i2] are adjacent in time
+		const size_t dist = std::abs(times1[i1] - times2[i2]);
+		if (dist <= max_dist) {
+			idxs1[K] = i1;
+			idxs2[K] = i2;
+			K++;
+			i1++;
+			i2++;
+		} else if (times1[i1] <= times2[i2]) {
+			i1++;
+		} else {
+			i2++;
 		}
-
-		i1++;
-		i2 = best_i2 + 1;
 	}
 
-	if (reverse_args) return {idxs2, idxs1};
-	else return {idxs1, idxs2};
+	return K;
 }
 
-void mergesort_into(
-		std::vector<int64_t>& vals, 	// Implicit 2xN value vector to modify
-		int64_t* times1,
-		int64_t* times2,
-		int64_t* vals1,
-		int64_t* vals2,
+size_t mergesort_into(
+		int64_t* vals, 								// Implicit 2xN value array to write into
+		size_t pos,										// Row of vals to start writing at
+		const int64_t* times1,
+		const int64_t* times2,
+		const int64_t* vals1,
+		const int64_t* vals2,
 		size_t i1,										// Start index for seq 1
 		size_t i2,										// Start index for seq 2
 		const size_t I1,							// Stop index for seq 1
 		const size_t I2,							// Stop index for seq 2
 		const int64_t fill_value
 	)
-// Merge-sort two timestamped arrays between a pair of indices into an output.
+// Merge-sort two timestamped arrays between a pair of indices into an output; returns the next row.
 {
 	while ((i1 < I1) && (i2 < I2)) {
 		if (times1[i1] <= times2[i2]) {
 			// First won
-			vals.push_back(vals1[i1]);
-			vals.push_back(fill_value);
+			vals[2*pos] = vals1[i1];
+			vals[2*pos+1] = fill_value;
 			i1++;
 		} else {
 			// Second one
-			vals.push_back(fill_value);
-			vals.push_back(vals2[i2]);
+			vals[2*pos] = fill_value;
+			vals[2*pos+1] = vals2[i2];
 			i2++;
 		}
+		pos++;
 	}
 
 	while (i1 < I1) {
-		vals.push_back(vals1[i1]);
-		vals.push_back(fill_value);
+		vals[2*pos] = vals1[i1];
+		vals[2*pos+1] = fill_value;
 		i1++;
+		pos++;
 	}
 
 	while (i2 < I2) {
-		vals.push_back(fill_value);
-		vals.push_back(vals2[i2]);
+		vals[2*pos] = fill_value;
+		vals[2*pos+1] = vals2[i2];
 		i2++;
+		pos++;
 	}
-}
-
 
+	return pos;
+}
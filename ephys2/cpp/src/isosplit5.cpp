@@ -25,6 +25,7 @@
 #include <pybind11/numpy.h>
 
 #include "../include/ephys2/isosplit5.h"
+#include "../include/ephys2/utils.h"
 #include "../include/isosplit5/isocut5.h"
 #include "../include/eigen/Dense"
 
@@ -49,8 +50,9 @@ bigint compute_max(bigint N, bigint* inds);
 void kmeans_multistep(int* labels, bigint M, bigint N, float* X, bigint K1, bigint K2, bigint K3, kmeans_opts opts);
 void kmeans_maxsize(int* labels, bigint M, bigint N, float* X, bigint maxsize, kmeans_opts opts);
 void compare_clusters(double* dip_score, std::vector<bigint>* new_labels1, std::vector<bigint>* new_labels2, bigint M, bigint N1, bigint N2, float* X1, float* X2, float* centroid1, float* centroid2);
-void compute_centroids(float* centroids, bigint M, bigint N, bigint Kmax, float* X, int* labels, std::vector<bigint>& clusters_to_compute_vec);
-void compute_covmats(float* covmats, bigint M, bigint N, bigint Kmax, float* X, int* labels, float* centroids, std::vector<bigint>& clusters_to_compute_vec);
+void compute_centroids(float* centroids, bigint M, bigint N, bigint Kmax, float* X, int* labels, std::vector<bigint>& clusters_to_compute_vec, size_t n_threads = 1);
+void compute_covmats(float* covmats, bigint M, bigint N, bigint Kmax, float* X, int* labels, float* centroids, std::vector<bigint>& clusters_to_compute_vec, size_t n_threads = 1);
+std::vector<std::vector<bigint>> cluster_members(bigint N, bigint Kmax, int* labels, const std::vector<bigint>& clusters_to_compute_vec);
 void get_pairs_to_compare(std::vector<bigint>* inds1, std::vector<bigint>* inds2, bigint M, bigint K, float* active_centroids, const intarray2d& active_comparisons_made);
 void compare_pairs(std::vector<bigint>* clusters_changed, bigint* total_num_label_changes, bigint M, bigint N, float* X, int* labels, const std::vector<bigint>& inds1, const std::vector<bigint>& inds2, const isosplit5_opts& opts, float* centroids, float* covmats); //the labels are updated
 }
@@ -286,7 +288,8 @@ bool isosplit5(
     const std::optional<int> K_init,
     const std::optional<bool> refine_clusters,
     const std::optional<int> max_iterations_per_pass,
-    const std::optional<int> seed       
+    const std::optional<int> seed,
+    const size_t n_threads
     )
 {
     // Initialize arguments
@@ -300,7 +303,9 @@ bool isosplit5(
     if (K_init) { opts.K_init = *K_init; }
     if (refine_clusters) { opts.refine_clusters = *refine_clusters; }
     if (max_iterations_per_pass) { opts.max_iterations_per_pass = *max_iterations_per_pass; }
+    opts.n_threads = n_threads;
     if (seed) { srand(*seed); }
+    py::gil_scoped_release release;
     return isosplit5_rec(y_data, M, N, X_data, opts);
 }
 
@@ -326,8 +331,8 @@ bool isosplit5_rec(int* labels, bigint M, bigint N, float* X, isosplit5_opts opt
     std::vector<bigint> clusters_to_compute_vec;
     for (bigint k = 0; k < Kmax; k++)
         clusters_to_compute_vec.push_back(1);
-    ns_isosplit5::compute_centroids(centroids, M, N, Kmax, X, labels, clusters_to_compute_vec);
-    ns_isosplit5::compute_covmats(covmats, M, N, Kmax, X, labels, centroids, clusters_to_compute_vec);
+    ns_isosplit5::compute_centroids(centroids, M, N, Kmax, X, labels, clusters_to_compute_vec, opts.n_threads);
+    ns_isosplit5::compute_covmats(covmats, M, N, Kmax, X, labels, centroids, clusters_to_compute_vec, opts.n_threads);
 
     // The active labels are those that are still being used -- for now, everything is active
     std::vector<int> active_labels_vec(Kmax, 1);
@@ -392,7 +397,7 @@ bool isosplit5_rec(int* labels, bigint M, bigint N, float* X, isosplit5_opts opt
                     break;
                 }
 
-                // Actually compare the pairs -- in principle this operation could be parallelized
+                // Actually compare the pairs (in parallel)
                 std::vector<bigint> clusters_changed;
                 bigint total_num_label_changes = 0;
                 ns_isosplit5::compare_pairs(&clusters_changed, &total_num_label_changes, M, N, X, labels, inds1b, inds2b, opts, centroids, covmats); //the labels are updated
@@ -408,8 +413,8 @@ bool isosplit5_rec(int* labels, bigint M, bigint N, float* X, isosplit5_opts opt
                 }
 
                 // Recompute the centers for those that have changed in this iteration
-                ns_isosplit5::compute_centroids(centroids, M, N, Kmax, X, labels, clusters_changed_vec_in_iteration);
-                ns_isosplit5::compute_covmats(covmats, M, N, Kmax, X, labels, centroids, clusters_changed_vec_in_iteration);
+                ns_isosplit5::compute_centroids(centroids, M, N, Kmax, X, labels, clusters_changed_vec_in_iteration, opts.n_threads);
+                ns_isosplit5::compute_covmats(covmats, M, N, Kmax, X, labels, centroids, clusters_changed_vec_in_iteration, opts.n_threads);
 
                 // For diagnostics
                 //printf ("total num label changes = %d\n",total_num_label_changes);
@@ -500,6 +505,97 @@ bool isosplit5_rec(int* labels, bigint M, bigint N, float* X, isosplit5_opts opt
     return true;
 }
 
+py::array_t<int64_t> isosplit5_pca_branch(
+    py::array_t<float, py::array::c_style> X,
+    const size_t n_components,
+    const std::optional<float> isocut_threshold,
+    const std::optional<int> min_cluster_size,
+    const std::optional<int> K_init,
+    const std::optional<bool> refine_clusters,
+    const std::optional<int> max_iterations_per_pass,
+    const size_t n_threads
+    )
+// Recursive PCA / ISO-SPLIT "branch" clustering (https://www.ncbi.nlm.nih.gov/pmc/articles/PMC5743236/).
+// Each branch projects its samples onto their principal components, splits them with ISO-SPLIT,
+// and recurses into every resulting cluster until a branch no longer splits.
+// Branches are contiguous ranges of a shared index permutation, and are processed in parallel.
+{
+    const bigint N = X.shape(0);
+    const bigint D = X.shape(1);
+    const float* X_data = X.data();
+    const size_t n_workers = n_threads > 0 ? n_threads : std::max(std::thread::hardware_concurrency(), 1u);
+    isosplit5_opts opts;
+    if (isocut_threshold) { opts.isocut_threshold = *isocut_threshold; }
+    if (min_cluster_size) { opts.min_cluster_size = *min_cluster_size; }
+    if (K_init) { opts.K_init = *K_init; }
+    if (refine_clusters) { opts.refine_clusters = *refine_clusters; }
+    if (max_iterations_per_pass) { opts.max_iterations_per_pass = *max_iterations_per_pass; }
+
+    std::vector<bigint> perm(N);
+    for (bigint i = 0; i < N; i++)
+        perm[i] = i;
+    std::vector<std::pair<bigint, bigint>> leaves; // Unsplittable branches
+    std::mutex leaves_mutex;
+
+    auto branch = [&](std::pair<bigint, bigint> range, auto push) {
+        const bigint begin = range.first;
+        const bigint n = range.second - range.first;
+        const bigint m = std::min(std::min(n, D), (bigint)n_components);
+        std::vector<int> labels(n, 1);
+        bigint K = 1;
+        if (n > 1 && m > 0) {
+            // Project onto the top m principal components
+            Eigen::MatrixXd Xb(D, n);
+            for (bigint i = 0; i < n; i++)
+                for (bigint d = 0; d < D; d++)
+                    Xb(d, i) = X_data[d + D * perm[begin + i]];
+            Xb.colwise() -= Xb.rowwise().mean();
+            Eigen::SelfAdjointEigenSolver<Eigen::MatrixXd> eig(Xb * Xb.transpose());
+            Eigen::MatrixXd V = eig.eigenvectors().rightCols(m).rowwise().reverse(); // Descending variance
+            Eigen::MatrixXf Y = (V.transpose() * Xb).cast<float>();
+            // Concurrent branches are disjoint, so threads are shared among them in proportion to size
+            isosplit5_opts branch_opts = opts;
+            branch_opts.n_threads = std::max((bigint)1, (bigint)(n_workers * n / N));
+            isosplit5_rec(labels.data(), m, n, Y.data(), branch_opts);
+            K = ns_isosplit5::compute_max(n, labels.data());
+        }
+        if (K <= 1) {
+            std::lock_guard<std::mutex> lock(leaves_mutex);
+            leaves.push_back(range);
+            return;
+        }
+        // Stable counting-sort partition of the range by label
+        std::vector<bigint> offsets(K + 1, 0);
+        for (bigint i = 0; i < n; i++)
+            offsets[labels[i]]++;
+        for (bigint k = 1; k <= K; k++)
+            offsets[k] += offsets[k - 1];
+        std::vector<bigint> sub(n);
+        std::vector<bigint> pos(offsets.begin(), offsets.end() - 1);
+        for (bigint i = 0; i < n; i++)
+            sub[pos[labels[i] - 1]++] = perm[begin + i];
+        std::copy(sub.begin(), sub.end(), perm.begin() + begin);
+        for (bigint k = 0; k < K; k++) {
+            if (offsets[k + 1] > offsets[k]) {
+                push({begin + offsets[k], begin + offsets[k + 1]});
+            }
+        }
+    };
+
+    if (N > 0) {
+        py::gil_scoped_release release;
+        parallel_work_queue<std::pair<bigint, bigint>>({{0, N}}, n_workers, branch);
+    }
+
+    // Number the clusters in order of their position in the permutation, independent of scheduling
+    std::sort(leaves.begin(), leaves.end());
+    std::vector<int64_t> result(N);
+    for (bigint k = 0; k < (bigint)leaves.size(); k++)
+        for (bigint i = leaves[k].first; i < leaves[k].second; i++)
+            result[perm[i]] = k;
+    return seq2numpy(result, {(size_t)N});
+}
+
 /*
 
 
@@ -653,11 +749,14 @@ bigint kmeans_assign2(bigint M, bigint K, float* X0, double* centroids)
     }
     return ret;
 }
-void kmeans_assign(int* labels, bigint M, bigint N, bigint K, float* X, double* centroids)
+void kmeans_assign(int* labels, bigint M, bigint N, bigint K, float* X, double* centroids, size_t n_threads = 1)
 {
-    for (bigint i = 0; i < N; i++) {
-        labels[i] = kmeans_assign2(M, K, &X[M * i], centroids);
-    }
+    const bigint chunk_size = 1024;
+    parallel_for((N + chunk_size - 1) / chunk_size, n_threads, [&](size_t c) {
+        for (bigint i = c * chunk_size; i < std::min(N, (bigint)(c + 1) * chunk_size); i++) {
+            labels[i] = kmeans_assign2(M, K, &X[M * i], centroids);
+        }
+    });
 }
 void kmeans_centroids(double* centroids, bigint M, bigint N, bigint K, float* X, int* labels)
 {
@@ -830,79 +929,75 @@ void compare_clusters(double* dip_score, std::vector<bigint>* new_labels1, std::
     free(V);
 }
 
-void compute_centroids(float* centroids, bigint M, bigint N, bigint Kmax, float* X, int* labels, std::vector<bigint>& cluster_to_compute_vec)
+std::vector<std::vector<bigint>> cluster_members(bigint N, bigint Kmax, int* labels, const std::vector<bigint>& clusters_to_compute_vec)
+// Indices of the samples in each cluster (1-based labels) to compute, in ascending order
 {
-    std::vector<double> C(M * Kmax);
-    for (bigint jj = 0; jj < M * Kmax; jj++)
-        C[jj] = 0;
-    std::vector<double> counts(Kmax);
-    for (bigint k = 0; k < Kmax; k++)
-        counts[k] = 0;
+    std::vector<std::vector<bigint>> members(Kmax);
     for (bigint i = 0; i < N; i++) {
-        bigint k0 = labels[i];
-        bigint i0 = k0 - 1;
-        if (cluster_to_compute_vec[i0]) {
-            for (bigint m = 0; m < M; m++) {
-                C[m + M * i0] += X[m + M * i];
-            }
-            counts[i0]++;
-        }
+        bigint i0 = labels[i] - 1;
+        if (clusters_to_compute_vec[i0])
+            members[i0].push_back(i);
     }
-    for (bigint k = 0; k < Kmax; k++) {
-        if (cluster_to_compute_vec[k]) {
-            if (counts[k]) {
-                for (bigint m = 0; m < M; m++) {
-                    C[m + M * k] /= counts[k];
-                }
+    return members;
+}
+
+// Centroids and covariance matrices are reduced per cluster, in parallel over clusters.
+// Each cluster sums its samples in ascending order, so results do not depend on the number of threads.
+void compute_centroids(float* centroids, bigint M, bigint N, bigint Kmax, float* X, int* labels, std::vector<bigint>& cluster_to_compute_vec, size_t n_threads)
+{
+    std::vector<std::vector<bigint>> members = cluster_members(N, Kmax, labels, cluster_to_compute_vec);
+    parallel_for(Kmax, n_threads, [&](size_t k) {
+        if (!cluster_to_compute_vec[k])
+            return;
+        std::vector<double> C(M, 0);
+        for (bigint i : members[k]) {
+            for (bigint m = 0; m < M; m++) {
+                C[m] += X[m + M * i];
             }
         }
-    }
-    for (bigint k = 0; k < Kmax; k++) {
-        if (cluster_to_compute_vec[k]) {
+        double count = members[k].size();
+        if (count) {
             for (bigint m = 0; m < M; m++) {
-                centroids[m + k * M] = C[m + k * M];
+                C[m] /= count;
             }
         }
-    }
+        for (bigint m = 0; m < M; m++) {
+            centroids[m + k * M] = C[m];
+        }
+    });
 }
 
-void compute_covmats(float* covmats, bigint M, bigint N, bigint Kmax, float* X, int* labels, float* centroids, std::vector<bigint>& clusters_to_compute_vec)
+void compute_covmats(float* covmats, bigint M, bigint N, bigint Kmax, float* X, int* labels, float* centroids, std::vector<bigint>& clusters_to_compute_vec, size_t n_threads)
 {
-    std::vector<double> C(M * M * Kmax);
-    for (bigint jj = 0; jj < M * M * Kmax; jj++)
-        C[jj] = 0;
-    std::vector<double> counts(Kmax);
-    for (bigint k = 0; k < Kmax; k++)
-        counts[k] = 0;
-    for (bigint i = 0; i < N; i++) {
-        bigint i0 = labels[i] - 1;
-        if (clusters_to_compute_vec[i0]) {
-            for (bigint m1 = 0; m1 < M; m1++) {
-                for (bigint m2 = 0; m2 < M; m2++) {
-                    C[m1 + M * m2 + M * M * i0] += (X[m1 + M * i] - centroids[m1 + i0 * M]) * (X[m2 + M * i] - centroids[m2 + i0 * M]);
-                }
+    std::vector<std::vector<bigint>> members = cluster_members(N, Kmax, labels, clusters_to_compute_vec);
+    parallel_for(Kmax, n_threads, [&](size_t k) {
+        if (!clusters_to_compute_vec[k])
+            return;
+        std::vector<double> C(M * M, 0);
+        std::vector<float> V(M);
+        for (bigint i : members[k]) {
+            for (bigint m = 0; m < M; m++) {
+                V[m] = X[m + M * i] - centroids[m + k * M];
             }
-            counts[i0]++;
-        }
-    }
-    for (bigint k = 0; k < Kmax; k++) {
-        if (clusters_to_compute_vec[k]) {
-            if (counts[k]) {
-                for (bigint m1 = 0; m1 < M; m1++) {
-                    for (bigint m2 = 0; m2 < M; m2++) {
-                        C[m1 + m2 * M + M * M * k] /= counts[k];
-                    }
+            // Upper triangle only; the matrix is symmetric
+            for (bigint m2 = 0; m2 < M; m2++) {
+                for (bigint m1 = 0; m1 <= m2; m1++) {
+                    C[m1 + M * m2] += V[m1] * V[m2];
                 }
             }
         }
-    }
-    for (bigint k = 0; k < Kmax; k++) {
-        if (clusters_to_compute_vec[k]) {
-            for (bigint mm = 0; mm < M * M; mm++) {
-                covmats[mm + k * M * M] = C[mm + k * M * M];
+        double count = members[k].size();
+        for (bigint m2 = 0; m2 < M; m2++) {
+            for (bigint m1 = 0; m1 <= m2; m1++) {
+                if (count)
+                    C[m1 + M * m2] /= count;
+                C[m2 + M * m1] = C[m1 + M * m2];
             }
         }
-    }
+        for (bigint mm = 0; mm < M * M; mm++) {
+            covmats[mm + k * M * M] = C[mm];
+        }
+    });
 }
 
 void get_pairs_to_compare(std::vector<bigint>* inds1, std::vector<bigint>* inds2, bigint M, bigint K, float* active_centroids, const intarray2d& active_comparisons_made)
@@ -1100,35 +1195,31 @@ bool merge_test(std::vector<bigint>* L12, bigint M, bigint N1, bigint N2, float*
 }
 
 void compare_pairs(std::vector<bigint>* clusters_changed, bigint* total_num_label_changes, bigint M, bigint N, float* X, int* labels, const std::vector<bigint>& k1s, const std::vector<bigint>& k2s, const isosplit5_opts& opts, float* centroids, float* covmats)
+// The pairs are disjoint, so they are compared in parallel: each comparison reads the old labels
+// and writes the new labels of its own two clusters only.
 {
     bigint Kmax = ns_isosplit5::compute_max(N, labels);
     std::vector<bigint> clusters_changed_vec(Kmax);
     for (bigint i = 0; i < Kmax; i++)
         clusters_changed_vec[i] = 0;
-    int* new_labels = (int*)malloc(sizeof(bigint) * N);
+    std::vector<bigint> clusters_to_compare(Kmax, 0);
+    for (bigint i1 = 0; i1 < (bigint)k1s.size(); i1++) {
+        clusters_to_compare[k1s[i1] - 1] = 1;
+        clusters_to_compare[k2s[i1] - 1] = 1;
+    }
+    std::vector<std::vector<bigint>> members = cluster_members(N, Kmax, labels, clusters_to_compare);
+    std::vector<bigint> num_label_changes(k1s.size(), 0);
+    int* new_labels = (int*)malloc(sizeof(int) * N);
     *total_num_label_changes = 0;
     for (bigint i = 0; i < N; i++)
         new_labels[i] = labels[i];
-    for (bigint i1 = 0; i1 < (bigint)k1s.size(); i1++) {
+    parallel_for(k1s.size(), opts.n_threads, [&](size_t i1) {
         int k1 = k1s[i1];
         int k2 = k2s[i1];
-        std::vector<bigint> inds1, inds2;
-        for (bigint i = 0; i < N; i++) {
-            if (labels[i] == k1)
-                inds1.push_back(i);
-            if (labels[i] == k2)
-                inds2.push_back(i);
-        }
+        const std::vector<bigint>& inds1 = members[k1 - 1];
+        const std::vector<bigint>& inds2 = members[k2 - 1];
         if ((inds1.size() > 0) && (inds2.size() > 0)) {
-            std::vector<bigint> inds12;
-            inds12.insert(inds12.end(), inds1.begin(), inds1.end());
-            inds12.insert(inds12.end(), inds2.begin(), inds2.end());
-            std::vector<bigint> L12_old(inds12.size());
-            for (bigint i = 0; i < (bigint)inds1.size(); i++)
-                L12_old[i] = 1;
-            for (bigint i = 0; i < (bigint)inds2.size(); i++)
-                L12_old[inds1.size() + i] = 2;
-            std::vector<bigint> L12(inds12.size());
+            std::vector<bigint> L12(inds1.size() + inds2.size());
 
             bool do_merge;
             if (((bigint)inds1.size() < opts.min_cluster_size) || ((bigint)inds2.size() < opts.min_cluster_size)) {
@@ -1147,7 +1238,7 @@ void compare_pairs(std::vector<bigint>* clusters_changed, bigint* total_num_labe
                 for (bigint i = 0; i < (bigint)inds2.size(); i++) {
                     new_labels[inds2[i]] = k1;
                 }
-                *total_num_label_changes += inds2.size();
+                num_label_changes[i1] += inds2.size();
                 clusters_changed_vec[k1 - 1] = 1;
                 clusters_changed_vec[k2 - 1] = 1;
             }
@@ -1157,14 +1248,14 @@ void compare_pairs(std::vector<bigint>* clusters_changed, bigint* total_num_labe
                 for (bigint i = 0; i < (bigint)inds1.size(); i++) {
                     if (L12[i] == 2) {
                         new_labels[inds1[i]] = k2;
-                        (*total_num_label_changes)++;
+                        num_label_changes[i1]++;
                         something_was_redistributed = true;
                     }
                 }
                 for (bigint i = 0; i < (bigint)inds2.size(); i++) {
                     if (L12[inds1.size() + i] == 1) {
                         new_labels[inds2[i]] = k1;
-                        (*total_num_label_changes)++;
+                        num_label_changes[i1]++;
                         something_was_redistributed = true;
                     }
                 }
@@ -1174,7 +1265,9 @@ void compare_pairs(std::vector<bigint>* clusters_changed, bigint* total_num_labe
                 }
             }
         }
-    }
+    });
+    for (bigint i1 = 0; i1 < (bigint)k1s.size(); i1++)
+        *total_num_label_changes += num_label_changes[i1];
     clusters_changed->clear();
     for (int k = 0; k < Kmax; k++)
         if (clusters_changed_vec[k])
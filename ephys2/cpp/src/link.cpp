@@ -4,12 +4,72 @@
 #include <pybind11/numpy.h>
 #include <pybind11/stl.h>
 #include <queue>
+#include <numeric>
+#include <algorithm>
 
 #include "../include/ephys2/utils.h"
 #include "../include/ephys2/link.h"
 
 namespace py = pybind11;
 
+std::vector<int64_t> label_components(
+	EVIncidence linkage, 						// Linkage matrix
+	int64_t min_size 								// Minimum number of labels to map
+)
+// Map every label to the minimum label of its connected component, using union-find over the edges.
+// Covers at least the label space (columns of the linkage matrix), and any label appearing in an edge.
+{
+	bool* data = static_cast<bool*>(std::get<0>(linkage).request().ptr);
+	int64_t* indices = static_cast<int64_t*>(std::get<1>(linkage).request().ptr);
+	int64_t* indptr = static_cast<int64_t*>(std::get<2>(linkage).request().ptr);
+	const int64_t nrows = std::get<0>(std::get<3>(linkage));
+	const int64_t nnz = nrows > 0 ? indptr[nrows] : 0;
+
+	int64_t size = std::max<int64_t>(std::get<1>(std::get<3>(linkage)), min_size);
+	for (int64_t k = 0; k < nnz; k++) {
+		py_assert(indices[k] >= 0, "Labels must be non-negative");
+		size = std::max(size, indices[k] + 1);
+	}
+	std::vector<int64_t> parent(size);
+	std::iota(parent.begin(), parent.end(), 0);
+
+	auto find = [&](int64_t v) {
+		while (parent[v] != v) {
+			parent[v] = parent[parent[v]]; // Path halving
+			v = parent[v];
+		}
+		return v;
+	};
+
+	for (int64_t j = 0; j < nrows; j++) {
+		int64_t first = -1;
+		for (int64_t k = indptr[j]; k < indptr[j+1]; k++) {
+			if (data[k]) {
+				if (first < 0) {
+					first = indices[k];
+				} else {
+					// Union by minimum label, such that each root is the minimum of its component
+					int64_t a = find(first), b = find(indices[k]);
+					if (a < b) parent[b] = a; else parent[a] = b;
+				}
+			}
+		}
+	}
+	for (int64_t v = 0; v < size; v++) {
+		parent[v] = parent[parent[v]]; // Parents precede their children, so one pass flattens every path
+	}
+	return parent;
+}
+
+py::array_t<int64_t> link_label_map(
+	EVIncidence linkage 						// Linkage matrix
+)
+// Linked label (minimum label of the connected component) of every label in the label space
+{
+	std::vector<int64_t> components = label_components(linkage, 0);
+	return seq2numpy(components, {components.size()});
+}
+
 void link_labels(
 	py::array_t<int64_t> unlinked, 	// Un-linked labels
 	py::array_t<int64_t> linked, 		// Linked labels (written to)
@@ -18,24 +78,18 @@ void link_labels(
 // Link labels using an edge-vertex incidence matrix, returning the minimum label for each connected component
 {
 	py_assert(unlinked.shape(0) == linked.shape(0), "Input arrays must have the same shape");
-	std::unordered_map<int64_t, int64_t> label_map;
 	int64_t* unlinked_data = static_cast<int64_t*>(unlinked.request().ptr);
 	int64_t* linked_data = static_cast<int64_t*>(linked.request().ptr);
+	const int64_t N = unlinked.shape(0);
 
-	const int N = unlinked.shape(0);
-	for (int i = 0; i < N; i++) {
-		int64_t label = unlinked_data[i];
-		if (label_map.find(label) == label_map.end()) {
-			// Label not found; compute and store connected component 
-			std::unordered_set<int64_t> cc = find_connected_component(label, linkage);
-			int64_t min_label = *std::min_element(cc.begin(), cc.end());
-			for (int64_t v : cc) {
-				label_map[v] = min_label;
-			}
-			linked_data[i] = min_label;
-		} else {
-			linked_data[i] = label_map[label];
-		}
+	int64_t max_label = -1;
+	for (int64_t i = 0; i < N; i++) {
+		py_assert(unlinked_data[i] >= 0, "Labels must be non-negative");
+		max_label = std::max(max_label, unlinked_data[i]);
+	}
+	const std::vector<int64_t> components = label_components(linkage, max_label + 1);
+	for (int64_t i = 0; i < N; i++) {
+		linked_data[i] = components[unlinked_data[i]];
 	}
 }
 
@@ -43,53 +97,23 @@ int64_t relabel_by_cc(
 	int64_t label, 							// Label to relabel
 	EVIncidence linkage 				// Linkage matrix
 ) {
-	// Find connected component of label
-	std::unordered_set<int64_t> cc = find_connected_component(label, linkage);
-	// Return minimum label
-	return *std::min_element(cc.begin(), cc.end());
+	return label_components(linkage, label + 1)[label];
 }
 
 std::unordered_set<int64_t> find_connected_component(
 	int64_t node,											// Node
 	EVIncidence linkage								// Linkage matrix
 )
-// Find the connected component for a given node using BFS
+// Find the connected component for a given node
 {
-	bool* data = static_cast<bool*>(std::get<0>(linkage).request().ptr);
-	int64_t* indices = static_cast<int64_t*>(std::get<1>(linkage).request().ptr);
-	int64_t* indptr = static_cast<int64_t*>(std::get<2>(linkage).request().ptr);
-	const int nrows = std::get<0>(std::get<3>(linkage));
-	
-	std::unordered_set<int64_t> seen;
-	std::queue<int64_t> queue;
-	queue.push(node);
-	while (!queue.empty()) {
-		int64_t v = queue.front();
-		queue.pop();
-		if (seen.find(v) == seen.end()) {
-			// Node not seen yet; add to connected component
-			seen.insert(v);
-			// Find neighbors from CSR edge-vertex incidence matrix
-			for (int j = 0; j < nrows; j++) {
-				bool edge_exists = false;
-				for (int k = indptr[j]; k < indptr[j+1]; k++) {
-					if (indices[k] == v && data[k]) {
-						// Edge involving current node exists
-						edge_exists = true;
-					}
-				}
-				if (edge_exists) {
-					// Add neighbors to queue
-					for (int k = indptr[j]; k < indptr[j+1]; k++) {
-						if (indices[k] != v && data[k]) {
-							queue.push(indices[k]);
-						}
-					}
-				}
-			}
+	const std::vector<int64_t> components = label_components(linkage, node + 1);
+	std::unordered_set<int64_t> cc;
+	for (int64_t v = 0; v < (int64_t)components.size(); v++) {
+		if (components[v] == components[node]) {
+			cc.insert(v);
 		}
 	}
-	return seen;
+	return cc;
 }
 
 py::array_t<int64_t> filter_by_cc(
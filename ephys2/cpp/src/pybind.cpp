@@ -90,7 +90,20 @@ PYBIND11_MODULE(_cpp, m) {
 		py::arg(),
 		py::arg(),
 		py::arg(),
-		py::arg()
+		py::arg(),
+		py::arg("n_threads") = 1
+	);
+
+	m.def("super_paramagnetic_clustering_sparse", &super_paramagnetic_clustering_sparse, "Super-paramagnetic clustering over a sparse neighbor graph",
+		py::arg("indptr").noconvert(),
+		py::arg("indices").noconvert(),
+		py::arg("dists").noconvert(),
+		py::arg("Tmin"),
+		py::arg("Tmax"),
+		py::arg("Tstep"),
+		py::arg("cycles"),
+		py::arg("seed"),
+		py::arg("n_threads") = 1
 	);
 
 	m.def("isosplit5", &isosplit5, "ISO-SPLIT clustering",
@@ -101,7 +114,19 @@ PYBIND11_MODULE(_cpp, m) {
 		py::arg("K_init"),
 		py::arg("refine_clusters"),
 		py::arg("max_iterations_per_pass"),
-		py::arg("seed")
+		py::arg("seed"),
+		py::arg("n_threads") = 1
+	);
+
+	m.def("isosplit5_pca_branch", &isosplit5_pca_branch, "Recursive PCA / ISO-SPLIT branch clustering",
+		py::arg("X").noconvert(),
+		py::arg("n_components"),
+		py::arg("isocut_threshold"),
+		py::arg("min_cluster_size"),
+		py::arg("K_init"),
+		py::arg("refine_clusters"),
+		py::arg("max_iterations_per_pass"),
+		py::arg("n_threads") = 1
 	);
 
 	m.def("align_sequences", &align_sequences, "Align sequences",
@@ -113,12 +138,22 @@ PYBIND11_MODULE(_cpp, m) {
 		py::arg("fill_value")
 	);
 
+	m.def("pair_times", &pair_times, "Pair sorted sequences in time",
+		py::arg("times1").noconvert(),
+		py::arg("times2").noconvert(),
+		py::arg("max_dist")
+	);
+
 	m.def("link_labels", &link_labels, "Link labels",
 		py::arg("unlinked").noconvert(),
 		py::arg("linked").noconvert(),
 		py::arg("linkage").noconvert()
 	);
 
+	m.def("link_label_map", &link_label_map, "Linked label of every label",
+		py::arg("linkage").noconvert()
+	);
+
 	m.def("relabel_by_cc", &relabel_by_cc, "Relabel by connected component",
 		py::arg("label"),
 		py::arg("linkage").noconvert()
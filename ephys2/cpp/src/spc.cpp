@@ -3,6 +3,7 @@
 #include <stdlib.h>
 #include <math.h>
 #include <iostream>
+#include <random>
 
 #include "../include/ephys2/spc.h"
 #include "../include/ephys2/utils.h"
@@ -17,7 +18,8 @@ SPCResult super_paramagnetic_clustering(
 	const size_t cyc,						// Total number of cycles
 	const int K, 								// Maximal number of nearest neighbours (used in the knn algorithm)
 	const bool MSTree, 					// Whether to add the edges of the minimal spanning tree (should default to True)
-	const std::optional<int> seed		// Random seed
+	const std::optional<int> seed,	// Random seed
+	const size_t n_threads			// Number of threads (0 = hardware concurrency)
 	)
 // C++ port of Super-paramagnetic clustering implementation by Eytan Domany (https://github.com/eytandomany/SPC)
 // Refactored in the following ways:
@@ -30,9 +32,69 @@ SPCResult super_paramagnetic_clustering(
 	py_assert(K < N, "Number of nearest neighbors can be at most the number of samples"); 
 	py_assert(Tmin <= Tmax, "Tmin must be less than or equal to Tmax");
 
-	if (seed) {
-		srand(*seed);
+	// Neighbors
+	UIRaggedArray NK = knn(N, K, MSTree, dists);
+  OrderEdges( &NK ); /* Edges *must* be ordered when calling SetBond() */
+  EdgeDistanceResult edr = EdgeDistance( NK, dists );
+
+  return swendsen_wang(NK, edr, Tmin, Tmax, Tstep, cyc, seed, n_threads);
+}
+
+SPCResult super_paramagnetic_clustering_sparse(
+	py::array_t<int64_t> indptr, 	// Neighbor graph in CSR format (N_samples + 1,); must be symmetric
+	py::array_t<int64_t> indices, // Neighbors of each sample, in ascending order within each row
+	py::array_t<double> dists, 		// Distances to the neighbors
+	const float Tmin, 						// Minimum temperature
+	const float Tmax, 						// Maximum temperature
+	const float Tstep, 						// Temperature step
+	const size_t cyc,							// Total number of cycles
+	const std::optional<int> seed,	// Random seed
+	const size_t n_threads				// Number of threads (0 = hardware concurrency)
+	)
+// Super-paramagnetic clustering over a precomputed (e.g. mutual-kNN + MST) neighbor graph,
+// avoiding the dense distance matrix.
+{
+	const size_t N = indptr.shape(0) - 1;
+	py_assert(indices.shape(0) == dists.shape(0), "Indices and distances must be the same size");
+	py_assert(Tmin <= Tmax, "Tmin must be less than or equal to Tmax");
+	auto P = indptr.unchecked<1>();
+	auto I = indices.unchecked<1>();
+
+	// Neighbors
+	UIRaggedArray NK;
+	NK.n = N;
+	NK.c = (unsigned int*)calloc(N,sizeof(unsigned int));
+	NK.p = (unsigned int**)calloc(N,sizeof(unsigned int*));
+	for (size_t i = 0; i < N; i++) {
+		NK.c[i] = P(i+1) - P(i);
+		NK.p[i] = (unsigned int*)calloc(NK.c[i],sizeof(unsigned int));
+		for (size_t k = 0; k < NK.c[i]; k++) {
+			NK.p[i][k] = I(P(i) + k);
+		}
 	}
+  EdgeDistanceResult edr = EdgeDistanceSparse( NK, indptr, dists );
+
+  return swendsen_wang(NK, edr, Tmin, Tmax, Tstep, cyc, seed, n_threads);
+}
+
+SPCResult swendsen_wang(
+	UIRaggedArray NK, 					// Ordered neighbors of each sample (freed on return)
+	EdgeDistanceResult edr, 		// Distances along each edge in NK (freed on return)
+	const float Tmin, 					// Minimum temperature
+	const float Tmax, 					// Maximum temperature
+	const float Tstep, 					// Temperature step
+	const size_t cyc,						// Total number of cycles
+	const std::optional<int> seed,	// Random seed
+	const size_t n_threads			// Number of threads (0 = hardware concurrency)
+	)
+// Monte Carlo sweep over temperatures, common to the dense and sparse interfaces.
+// The Monte Carlo chain at each temperature starts from the same initial spins and is seeded
+// from (seed, temperature index), so chains run in parallel and results do not depend on n_threads.
+// Directed growth runs in temperature order, since it conditions on the previous temperature's clusters.
+// Temperatures are processed in waves of n_threads chains, whose correlations are turned into clusters
+// before the next wave, so that at most n_threads correlation arrays are alive.
+{
+	const size_t N = NK.n;
 
 	// Default parameters (expose above if necessary)
 	const size_t Q = 20;				// Number of Potts Spins; Si = 0,...,Q-1
@@ -44,17 +106,13 @@ SPCResult super_paramagnetic_clustering(
 
 	// State initialization
 	float T;              	/* Current temperature                       */
-	unsigned int *Spin; 		/* Spin[i]= 0..Q-1 is the spin of point i    */
-	UIRaggedArray NK;				/* Contains the neighbors of each point.     */
+													/* NK contains the neighbors of each point.  */
 													/* NK.n is the number of points and NK.c[i]  */
 													/* is the number of neighbours of point i.   */
 													/* NK[i][j], j=1..NK.c[i] are the labels of  */
 													/* neighboring points for each i=1..NK.n     */
 	UIRaggedArray KN;				/* KN[i][k] = m, means that point i is the   */
 													/* m-th neighbor of point j = N[i][k]        */
-	RaggedArray P;					/* Deletion Probabilities for a satisfied    */
-													/* bond, i.e. if S[i] = S[j]. For an         */
-													/* unsatisfied bond deletion probability = 1 */
 	CRaggedArray Bond;			/* Bond[i][k] takes value 1 (0) if bond      */
 													/* between spins i and its k-th neighbor is  */
 													/* frozen (deleted).                         */
@@ -72,87 +130,120 @@ SPCResult super_paramagnetic_clustering(
 	unsigned int *thOldBlock;/* OldBlock[i] Is the number of the cluster  */
 													/* to which Spin[i] belonged in the previous */
 	                        /* temperature after thresholding            */
-	UIRaggedArray CorrN;    /* Two Points Correlations comulant          */
+	std::vector<UIRaggedArray> CorrN; /* Two Points Correlations comulant */
+													/* at each temperature of a wave             */
 	int nc;            			/* present number of clusters                */
-	int nb;            			/* present number of frozen bonds            */
-	int ncy;      					/* cyles counter											       */
+	const int ncy = (int)(cyc*SWfract) + 1; /* cycles in the averages     */
 	size_t nT;            	/* Temp. step counter                         */
-	int i;									/* auxiliary loop index                       */
 
-	// Neighbors
-	NK.n = 0;
-	NK = knn(N, K, MSTree, dists);
-  OrderEdges( &NK ); /* Edges *must* be ordered when calling SetBond() */
+	// Interactions
   KN = InvertEdges( NK );
-  EdgeDistanceResult edr = EdgeDistance( NK, dists );
 	assure( edr.nedges > 0, "no edges" );
 
 	DistanceToInteraction( edr, NK, KN );
 
-	// Memory allocations
-  CorrN = InitUIRaggedArray(NK);
-  Bond = InitCRaggedArray(NK);
-  P = InitRaggedArray(NK);
-  ClusterSize = InitUIVector(N);
-  Block = InitUIVector(N);
-  UIWorkSpc = InitUIVector((2*N>Q)?2*N:Q); // bounds on UIWorkSpc size: >=Q for magnetization >=2N for OrderingClusters  
-  Spin = InitUIVector(N);
-  InitialSpinConfig(N,Spin,Q); 
-
-  dgOldBlock = InitUIVector(N);  
-  thOldBlock = InitUIVector(N);
-  memset( dgOldBlock, 0, N*sizeof(unsigned int) );
-  memset( thOldBlock, 0, N*sizeof(unsigned int) );
-
-  // Results
-  std::vector<unsigned int> clusters;
-  std::vector<float> temps;
-
-
-	/*********************** START T LOOP **********************/
-	for(T = Tmin, nT = 0; T <= Tmax; nT++, T=T+Tstep ) { // TODO: infinite loop if Tmin == Tmax
+	// Temperatures & seeds
+	std::vector<float> temps;
+	for(T = Tmin; T <= Tmax; T=T+Tstep ) { // TODO: infinite loop if Tmin == Tmax
+		temps.push_back(T);
+	}
+	nT = temps.size();
+	const unsigned int base_seed = seed ? (unsigned int)*seed : std::random_device{}();
+	const size_t n_wave = std::max<size_t>(std::min<size_t>(
+		(n_threads == 0) ? std::max(std::thread::hardware_concurrency(), 1u) : n_threads, nT
+	), 1);
+	CorrN.resize(n_wave);
+	for (auto& Corr : CorrN) {
+		Corr = InitUIRaggedArray(NK);
+	}
 
-		/* Memory reset: */
-		ResetUIRaggedArray(CorrN);
+	// Monte Carlo chain at temperature index t, accumulating correlations into Corr (thread-safe)
+	auto monte_carlo = [&](const size_t t, UIRaggedArray Corr) {
+		RaggedArray P = InitRaggedArray(NK);	/* Deletion Probabilities for a satisfied    */
+																					/* bond, i.e. if S[i] = S[j]. For an         */
+																					/* unsatisfied bond deletion probability = 1 */
+		CRaggedArray Bond = InitCRaggedArray(NK);
+		unsigned int *ClusterSize = InitUIVector(N);
+		unsigned int *Block = InitUIVector(N);
+		unsigned int *UIWorkSpc = InitUIVector((2*N>Q)?2*N:Q);
+		unsigned int *Spin = InitUIVector(N); /* Spin[i]= 0..Q-1 is the spin of point i */
+		SeqRandState rng;
+		int nc;
+		int i;
+
+		SeqSeed( &rng, seed_sequence(base_seed, t) );
+		InitialSpinConfig(N,Spin,Q);
+		ResetUIRaggedArray(Corr);
 		ResetCRaggedArray(Bond);
 		ResetRaggedArray(P);
 
-		DeletionProbabilities(T,edr.J,P);
+		DeletionProbabilities(temps[t],edr.J,P);
 
 		/* Transient of Monte Carlo (not included in averages) */
 		for( i = 0; i < cyc*(1.-SWfract); i++ ){
-			nb = SetBond(P,Spin,Bond,NK,KN); 
+			SetBond(P,Spin,Bond,NK,KN,&rng); 
 			nc = Coarsening(Bond,Block,NK,ClusterSize,UIWorkSpc);
-			NewSpinConfig(N,Spin,Block,nc,Q,UIWorkSpc);
+			NewSpinConfig(N,Spin,Block,nc,Q,UIWorkSpc,&rng);
 		}
 
 		/***************** START MC LOOP ********************/     
-		for( ncy = 0; ncy <= cyc*SWfract ; ncy++ ){
-
-			nb = SetBond(P,Spin,Bond,NK,KN); 
+		for( i = 0; i < ncy; i++ ){
+			SetBond(P,Spin,Bond,NK,KN,&rng); 
 			nc = Coarsening(Bond,Block,NK,ClusterSize,UIWorkSpc);
-			NewSpinConfig(N,Spin,Block,nc,Q,UIWorkSpc);
+			NewSpinConfig(N,Spin,Block,nc,Q,UIWorkSpc,&rng);
 
-			GlobalCorrelation(CorrN,NK,Block);
+			GlobalCorrelation(Corr,NK,Block);
 		} /********************* END MC LOOP *********************/
 
-		/* threshold + directed growth */
-		nc = DirectedGrowth(ncy,thN,CorrN,NK,KN,Bond,Block,ClusterSize,dgOldBlock,thOldBlock,UIWorkSpc);
-		/* Notice that above thOldBlock is the new thBlocks but */
-		/* it is OK to use them */  
+		FreeCRaggedArray(Bond);
+		FreeRaggedArray(P);
+		free(ClusterSize);
+		free(Block);
+		free(UIWorkSpc);
+		free(Spin);
+	};
 
-		// Write cluster assignments in row-major order
-		clusters.insert(clusters.end(), Block, Block+N);
-		temps.push_back(T);
+	// Memory allocations
+  Bond = InitCRaggedArray(NK);
+  ClusterSize = InitUIVector(N);
+  Block = InitUIVector(N);
+  UIWorkSpc = InitUIVector((2*N>Q)?2*N:Q); // bounds on UIWorkSpc size: >=Q for magnetization >=2N for OrderingClusters  
+  dgOldBlock = InitUIVector(N);  
+  thOldBlock = InitUIVector(N);
+  memset( dgOldBlock, 0, N*sizeof(unsigned int) );
+  memset( thOldBlock, 0, N*sizeof(unsigned int) );
 
-		memcpy( thOldBlock, Block, N*sizeof(unsigned int) );
-		memcpy( dgOldBlock, Block, N*sizeof(unsigned int) );
+  // Results
+  std::vector<unsigned int> clusters;
+  clusters.reserve(nT*N);
+
+	{
+		py::gil_scoped_release release;
+		/*********************** START T LOOP **********************/
+		for(size_t t0 = 0; t0 < nT; t0 += n_wave ) {
+			const size_t nw = std::min(n_wave, nT - t0);
+			parallel_for(nw, n_threads, [&](const size_t j) { monte_carlo(t0 + j, CorrN[j]); });
+
+			for(size_t j = 0; j < nw; j++ ) {
+				/* threshold + directed growth */
+				nc = DirectedGrowth(ncy,thN,CorrN[j],NK,KN,Bond,Block,ClusterSize,dgOldBlock,thOldBlock,UIWorkSpc);
+				/* Notice that above thOldBlock is the new thBlocks but */
+				/* it is OK to use them */  
+
+				// Write cluster assignments in row-major order
+				clusters.insert(clusters.end(), Block, Block+N);
+
+				memcpy( thOldBlock, Block, N*sizeof(unsigned int) );
+				memcpy( dgOldBlock, Block, N*sizeof(unsigned int) );
+			}
+		}   /******************** END OF T LOOP ***********************/
+	}
 
-	}   /******************** END OF T LOOP ***********************/
+	for (auto& Corr : CorrN) {
+		FreeUIRaggedArray(Corr);
+	}
 
-	FreeUIRaggedArray(CorrN);
 	FreeCRaggedArray(Bond);
-	FreeRaggedArray(P);
 	free(ClusterSize);
 	free(Block);
 	free(UIWorkSpc);
@@ -160,7 +251,6 @@ SPCResult super_paramagnetic_clustering(
 	FreeUIRaggedArray(NK);
 	FreeUIRaggedArray(KN);
 	FreeRaggedArray(edr.J);
-	free(Spin);
 	free(dgOldBlock);
 	free(thOldBlock);
 
@@ -170,6 +260,15 @@ SPCResult super_paramagnetic_clustering(
   };
 }
 
+unsigned int seed_sequence(const unsigned int seed, const size_t index)
+// Decorrelated seed for the index-th random sequence (SplitMix64 finalizer)
+{
+	uint64_t z = ((uint64_t)seed << 32) + index + 0x9e3779b97f4a7c15ULL;
+	z = (z ^ (z >> 30)) * 0xbf58476d1ce4e5b9ULL;
+	z = (z ^ (z >> 27)) * 0x94d049bb133111ebULL;
+	return (unsigned int)(z ^ (z >> 31));
+}
+
 // C++ port of edge utility functions
 
 /**
@@ -366,3 +465,28 @@ EdgeDistanceResult EdgeDistance( UIRaggedArray NK, py::array_t<double> dists )
 
 	return edr;
 }
+
+EdgeDistanceResult EdgeDistanceSparse( UIRaggedArray NK, py::array_t<int64_t> indptr, py::array_t<double> dists )
+{
+	int i,k;
+	EdgeDistanceResult edr;
+	auto P = indptr.unchecked<1>();
+	auto D = dists.unchecked<1>();
+
+	edr.chd = 0.0; 
+	edr.nedges = 0;
+	edr.J = InitRaggedArray( NK );
+
+	for(i=0; i < edr.J.n; i++){
+		for(k = 0; k<edr.J.c[i]; k++ ) {
+			edr.J.p[i][k] = D(P(i) + k);
+			if( edr.J.p[i][k] < INFINITY ) edr.chd+=edr.J.p[i][k], edr.nedges++;
+		}
+	}
+	edr.nedges /= 2;
+
+	edr.nn =  2.0 * (float)edr.nedges / (float)edr.J.n;
+	edr.chd = edr.chd / (2.0 * (float)edr.nedges);
+
+	return edr;
+}
@@ -47,12 +47,13 @@ void NewSpinConfig(
    unsigned int *Block, 
    int            NBlk,        
    int            Q,
-   unsigned int *NewSpinValue ) 
+   unsigned int *NewSpinValue,
+   SeqRandState  *rng ) 
 {
    int  nb, i;
 
    for (nb = 0; nb < NBlk; nb++)
-      NewSpinValue[nb] = IRAND(Q);
+      NewSpinValue[nb] = IRAND(rng,Q);
    for(i = 0; i < N; i++) Spin[i] = NewSpinValue[ Block[i] ];
 }
  
@@ -116,13 +117,13 @@ void DeletionProbabilities( float T, RaggedArray J, RaggedArray P )
    aux1.c
 **/
 int SetBond( RaggedArray P, unsigned int *Spin, CRaggedArray Bond,
-             UIRaggedArray NK, UIRaggedArray KN){
+             UIRaggedArray NK, UIRaggedArray KN, SeqRandState* rng){
    int  nb = 0; 
    int  i,k;
 
    for(i = 0; i < Bond.n; i++)
       for( k = Bond.c[i]-1; NK.p[i][k]>i && k>=0; k-- ) {
-	 if( (Spin[i] == Spin[NK.p[i][k]] ) && (RAND(1.) > P.p[i][k]) ) {
+	 if( (Spin[i] == Spin[NK.p[i][k]] ) && (RAND(rng,1.) > P.p[i][k]) ) {
 	    Bond.p[i][k] = 1;
 	    Bond.p[ NK.p[i][k] ][ KN.p[i][k] ] = 1;  
 	    nb ++;
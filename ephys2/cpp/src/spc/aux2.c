@@ -135,13 +135,13 @@ int uicompare(const void *i, const void *j)
    aux2.c
 **/
 float Magnetization( int N, int Q, int nc, unsigned int *ClusterSize,
-		     float* mag, unsigned int *N_q )
+		     float* mag, unsigned int *N_q, SeqRandState* rng )
 {
    int k, q;
 
    memset( N_q, 0, Q*sizeof(unsigned int) );
    for(k = 0; k < nc; k++)
-      N_q[ IRAND(Q) ] += ClusterSize[k];
+      N_q[ IRAND(rng,Q) ] += ClusterSize[k];
    qsort(N_q,Q,sizeof(unsigned int),uicompare);
    for(q = 0; q < Q; q++)
       mag[q] = (float)( (int)(Q * N_q[q] - N) ) / (N*(Q - 1.0));
@@ -5,6 +5,18 @@
 
 #include "../../include/spc/utilities.h"
 
+void SeqSeed( SeqRandState* rng, unsigned long long seed ) {
+  rng->s = seed;
+}
+
+unsigned int SeqRand( SeqRandState* rng ) {
+  /* Uniform in [0, SEQ_RAND_MAX] */
+  unsigned long long z = (rng->s += 0x9e3779b97f4a7c15ULL);
+  z = (z ^ (z >> 30)) * 0xbf58476d1ce4e5b9ULL;
+  z = (z ^ (z >> 27)) * 0x94d049bb133111ebULL;
+  return (unsigned int)((z ^ (z >> 31)) >> 33);
+}
+
 void error(const char * message,...)
 {
   va_list args;
@@ -1,5 +1,7 @@
-# Run this app with `python -m ephys2.benchmark_server FOLDER` and
+# Run this app with `python -m ephys2.benchmark_server PATH` and
 # visit http://127.0.0.1:8050/ in your web browser.
+# PATH is either a folder of JSON benchmark files, or a benchmark store (.h5).
+# Convert a folder into a store with `python -m ephys2.benchmark_server FOLDER --to-store STORE.h5`.
 
 import os
 import glob
@@ -7,34 +9,58 @@ import pdb
 
 from .intrinsic import *
 from .extrinsic import *
+from .store import *
 
 from ephys2.pipeline.benchmark.intrinsic import *
 from ephys2.pipeline.benchmark.extrinsic import *
 
+BENCHMARK_TYPES = {
+	'ExtrinsicBenchmark': ExtrinsicBenchmark,
+	'IntrinsicBenchmark': IntrinsicBenchmark,
+}
+
 if __name__ == '__main__':
 	import argparse
 
 	parser = argparse.ArgumentParser(description='Ephys2 command-line interface')
-	parser.add_argument('folder', type=str, help='Benchmarks folder')
+	parser.add_argument('path', type=str, help='Benchmarks folder (of JSON files) or benchmark store (.h5)')
+	parser.add_argument('--to-store', type=str, help='Append the JSON files of the benchmarks folder to this benchmark store (.h5) and exit', default=None)
 	args = parser.parse_args()
 	varargs = vars(args)
 
-	if not os.path.isdir(varargs['folder']):
-		raise ValueError(f'Folder {varargs["folder"]} does not exist')
+	if os.path.isfile(varargs['path']) and is_benchmark_store(varargs['path']):
+		print('Starting benchmark store server')
+		app = benchmark_store_app(BenchmarkStore(varargs['path']))
+		app.run_server(debug=True)
+		exit(0)
+
+	if not os.path.isdir(varargs['path']):
+		raise ValueError(f'Folder {varargs["path"]} does not exist')
 
-	paths = glob.glob(f'{varargs["folder"]}/*.json')
+	paths = glob.glob(f'{varargs["path"]}/*.json')
 	if len(paths) > 0:
 		benchmarks = []
 		for path in paths:
 			with open(path, 'r') as file:
 				benchmarks.append(file.read())
 
+		if varargs['to_store'] != None:
+			assert is_benchmark_store(varargs['to_store']), 'Benchmark store must be a new .h5 file or an existing benchmark store'
+			store = BenchmarkStore(varargs['to_store'])
+			for bm in benchmarks:
+				tag = next((tag for tag in BENCHMARK_TYPES if tag in bm), None)
+				if tag is None:
+					raise ValueError('Received unrecognized JSON files')
+				store.append(BENCHMARK_TYPES[tag].from_json(bm))
+			print(f'Appended {len(benchmarks)} benchmarks to {varargs["to_store"]}')
+			exit(0)
+
 		if 'ExtrinsicBenchmark' in benchmarks[0]:
 			assert all('ExtrinsicBenchmark' in bm for bm in benchmarks)
 			print('Starting extrinsic benchmarks server')
 			app = extrinsic_benchmarks_app([ExtrinsicBenchmark.from_json(bm) for bm in benchmarks])
 
-		if 'IntrinsicBenchmark' in benchmarks[0]:
+		elif 'IntrinsicBenchmark' in benchmarks[0]:
 			assert all('IntrinsicBenchmark' in bm for bm in benchmarks)
 			print('Starting intrinsic benchmarks server')
 			app = intrinsic_benchmarks_app([IntrinsicBenchmark.from_json(bm) for bm in benchmarks])
@@ -45,4 +71,4 @@ if __name__ == '__main__':
 		app.run_server(debug=True)
 
 	else:
-		print(f'No JSON files found in {varargs["folder"]}, exiting.')
\ No newline at end of file
+		print(f'No JSON files found in {varargs["path"]}, exiting.')
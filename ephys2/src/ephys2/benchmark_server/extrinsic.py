@@ -12,10 +12,13 @@ from typing import List
 from ephys2.pipeline.benchmark.extrinsic import *
 
 def extrinsic_benchmarks_app(benchmarks: List[ExtrinsicBenchmark]) -> Dash:
-	N = len(benchmarks)
-
 	app = Dash(__name__)
+	app.layout = html.Div(children=[
+		html.H1(children='Ephys2 extrinsic benchmarks'),
+	] + extrinsic_benchmarks_layout(benchmarks))
+	return app
 
+def extrinsic_benchmarks_layout(benchmarks: List[ExtrinsicBenchmark]) -> list:
 	pair_CMs_div = make_confmat_row([(np.log10(np.array(bm.pair_CM) + 1e-3), f'Pair confusion matrix ({bm.method}) [log10 scale]') for bm in benchmarks])
 	full_CMs_div = make_confmat_row([(np.log10(np.array(bm.full_CM) + 1e-3), f'Full confusion matrix ({bm.method}) [log10 scale]') for bm in benchmarks])
 	matched_CMs_div = make_confmat_row([(np.log10(np.array(bm.matched_CM) + 1e-3), f'Matched confusion matrix ({bm.method}) [log10 scale]') for bm in benchmarks])
@@ -45,14 +48,12 @@ def extrinsic_benchmarks_app(benchmarks: List[ExtrinsicBenchmark]) -> Dash:
 	precision_gr = make_perunit_fig('Precision', benchmarks, lambda bm: bm.precision)
 	recall_gr = make_perunit_fig('Recall', benchmarks, lambda bm: bm.recall)
 
-	app.layout = html.Div(children=[
-		html.H1(children='Ephys2 extrinsic benchmarks'),
+	return [
 		html.Div(children=f'Dataset: {benchmarks[0].dataset}'),
 		pair_CMs_div,
 		full_CMs_div,
 		matched_CMs_div,
-	] + 
-	[
+	] + [
 		dcc.Graph(
 			id=f'overall_figs_{i}',
 			figure=fig
@@ -61,9 +62,7 @@ def extrinsic_benchmarks_app(benchmarks: List[ExtrinsicBenchmark]) -> Dash:
 	] + [
 		precision_gr,
 		recall_gr
-	])
-
-	return app
+	]
 
 def make_confmat_row(cms_and_titles: List[Tuple[ConfusionMatrix, str]]) -> html.Div:
 	hms_div = []
@@ -12,16 +12,36 @@ from typing import List
 from ephys2.pipeline.benchmark.intrinsic import *
 
 def intrinsic_benchmarks_app(benchmarks: List[IntrinsicBenchmark]) -> Dash:
-	N = len(benchmarks)
-
 	app = Dash(__name__)
 	app.layout = html.Div(children=[
 		html.H1(children='Ephys2 intrinsic benchmarks'),
-		html.Div(children=f'Dataset: {benchmarks[0].dataset}'),
-		dcc.Graph(id='0', figure=go.Figure(go.Indicator(
-			mode = 'number', value = 
-		)))
-	])
-
+	] + intrinsic_benchmarks_layout(benchmarks))
 	return app
 
+def intrinsic_benchmarks_layout(benchmarks: List[IntrinsicBenchmark]) -> list:
+	'''
+	Per-method unit quality, averaged over all units of all channel groups
+	'''
+	def unit_mean(bm: IntrinsicBenchmark, get_data: Callable) -> float:
+		values = [get_data(unit) for chgroup in bm.chgroups.values() for unit in chgroup.units.values()]
+		return float(np.nanmean(values)) if len(values) > 0 else np.nan
+
+	overall_df = pd.DataFrame({
+		'Method': [bm.method for bm in benchmarks],
+		'Units': [sum(len(chgroup.units) for chgroup in bm.chgroups.values()) for bm in benchmarks],
+		'Presence ratio': [unit_mean(bm, lambda unit: unit.presence_ratio) for bm in benchmarks],
+		'ISI violation': [unit_mean(bm, lambda unit: unit.isi_violation) for bm in benchmarks],
+		'Amplitude violation': [unit_mean(bm, lambda unit: unit.amp_violation) for bm in benchmarks],
+		'SNR (median)': [unit_mean(bm, lambda unit: unit.snr_statistics.median) for bm in benchmarks],
+		'Isolation (NN, median)': [unit_mean(bm, lambda unit: np.nan if unit.nn_isolation_statistics is None else unit.nn_isolation_statistics.median) for bm in benchmarks],
+	})
+
+	return [
+		html.Div(children=f'Dataset: {benchmarks[0].dataset}'),
+	] + [
+		dcc.Graph(
+			id=f'intrinsic_overall_figs_{i}',
+			figure=px.bar(overall_df, y='Method', x=col, orientation='h')
+		)
+		for i, col in enumerate(overall_df.columns) if col != 'Method'
+	]
@@ -0,0 +1,40 @@
+'''
+Benchmark store application
+'''
+from dash import Dash, html, dcc, Input, Output
+
+from ephys2.pipeline.benchmark.store import *
+
+from .intrinsic import *
+from .extrinsic import *
+
+LAYOUTS = {
+	'ExtrinsicBenchmark': extrinsic_benchmarks_layout,
+	'IntrinsicBenchmark': intrinsic_benchmarks_layout,
+}
+
+def benchmark_store_app(store: BenchmarkStore) -> Dash:
+	'''
+	Browse a benchmark store by kind and dataset. 
+	Only the key columns are read at startup; the benchmarks of a view are loaded when it is selected.
+	'''
+	tags = [tag for tag in store.categories('tag') if tag in LAYOUTS]
+	datasets = store.categories('dataset')
+	assert len(tags) > 0 and len(datasets) > 0, f'No benchmarks found in {store.path}'
+
+	app = Dash(__name__)
+	app.layout = html.Div(children=[
+		html.H1(children='Ephys2 benchmarks'),
+		dcc.Dropdown(id='tag', options=tags, value=tags[0], clearable=False),
+		dcc.Dropdown(id='dataset', options=datasets, value=datasets[0], clearable=False),
+		html.Div(id='view'),
+	])
+
+	@app.callback(Output('view', 'children'), Input('tag', 'value'), Input('dataset', 'value'))
+	def update_view(tag: str, dataset: str) -> list:
+		rows = store.select(tag=tag, dataset=dataset)
+		if rows.size == 0:
+			return [html.Div(children=f'No {tag} results for dataset {dataset}')]
+		return LAYOUTS[tag](store.load(rows))
+
+	return app
@@ -4,6 +4,7 @@ Ephys2 GUI entry point
 import argparse
 from .run import run_gui
 from ephys2.lib.settings import global_settings
+from ephys2.lib.h5.llvbatch import H5LLVBatchSerializer
 
 def main():
     # Initialize settings
@@ -14,6 +15,7 @@ def main():
     parser.add_argument('-p', '--profile', help='Profile the GUI operation', action='store_true', default=False)
     parser.add_argument('-d', '--debug', help='Run the GUI with debug checks', action='store_true', default=False)
     parser.add_argument('--default-directory', default='.', help='Default directory for file dialog')
+    parser.add_argument('--link-cache', type=int, default=None, help='Memory budget (in MB) for cached linkage matrices')
     args = parser.parse_args()
 
     # Apply settings
@@ -25,6 +27,9 @@ def main():
         print('Running with debug checks enabled.')
         global_settings.debug_on = True
 
+    if args.link_cache is not None:
+        H5LLVBatchSerializer.memoized_links.max_bytes = args.link_cache * 2 ** 20
+
     # Run GUI
     run_gui(default_directory=args.default_directory)
 
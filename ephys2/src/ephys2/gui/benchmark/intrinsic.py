@@ -109,7 +109,8 @@ class IntrinsicBenchmarkWidget(VScrollArea):
 			self._pum_layouts[method].addWidget(
 				SummaryStatsWidget(x=units, y=[bm.units[u].snr_statistics for u in units], title='SNR')
 			)
-			# self._pum_layouts[method].addWidget(
-			# 	SummaryStatsWidget(x=units, y=[bm.units[u].nn_isolation_statistics for u in units], title='Isolation (NN)')
-			# )
+			if all(bm.units[u].nn_isolation_statistics != None for u in units):
+				self._pum_layouts[method].addWidget(
+					SummaryStatsWidget(x=units, y=[bm.units[u].nn_isolation_statistics for u in units], title='Isolation (NN)')
+				)
 
@@ -89,8 +89,9 @@ class LLVMultiBatchStore(LVMultiBatchStore):
 					# H5LLVBatchSerializer.check(item_dir, full=True) # Uncomment to perform consistency check
 				print(f'Finished in {default_timer() - t0} seconds.')	
 				self.current_loader.linkage = linkage
+				self.current_loader.label_map = link_label_map(linkage)
 				self['split_mode'] = False
-				new_units = set(np.unique(link_labels(np.array(list(label_map.values()), dtype=np.int64), linkage))) # Compute new units for isolation & selection
+				new_units = set(np.unique(link_labels(np.array(list(label_map.values()), dtype=np.int64), linkage, self.current_loader.label_map))) # Compute new units for isolation & selection
 				self['selected_units'] = self['selected_units'] | new_units
 				if self['isolated_units'] != None:
 					self['isolated_units'] = self.current_loader.isolated_units = self['isolated_units'] | new_units
@@ -122,7 +123,8 @@ class LLVBatchLoader(LVBatchLoader):
 	def __post_init__(self):
 		assert len(self.filepaths) == 1, 'Cannot load linked data from multiple files currently.'
 		with h5py.File(self.filepaths[0], 'r') as file:
-			self.linkage = H5CSRSerializer.load(file[self.item_id]['linkage']) # Load links matrix
+			self.linkage = H5LLVBatchSerializer.load_links(file[self.item_id]) # Load links matrix (shared with other loaders)
+			self.label_map = H5LLVBatchSerializer.load_label_map(file[self.item_id])
 		super().__post_init__()
 
 	@property
@@ -130,10 +132,11 @@ class LLVBatchLoader(LVBatchLoader):
 		return H5LVBatchSerializer # Since we load the full links matrix from the beginning, use the LVBatch loader to avoid spending time loading sparse matrices
 
 	def render(self, data: LVBatch) -> LVBatch:
-		data.labels = link_labels(data.labels, self.linkage)
+		data.labels = link_labels(data.labels, self.linkage, self.label_map)
 		return data
 
 	def save_edits(self):
 		super().save_edits()
 		with h5py.File(self.filepaths[0], 'a') as file:
-			H5CSRSerializer.replace(file[self.item_id]['linkage'], self.linkage)
\ No newline at end of file
+			H5LLVBatchSerializer.replace_links(file[self.item_id], self.linkage)
+			H5LLVBatchSerializer.save_label_map(file[self.item_id])
\ No newline at end of file
@@ -12,6 +12,7 @@ import math
 
 from ephys2.lib.settings import global_settings
 from ephys2.lib.types import *
+from ephys2.lib.groupby import LabelGroups
 from ephys2.gui.utils import *
 from ephys2.gui.types import *
 import ephys2.gui.colors as gc
@@ -85,7 +86,13 @@ class AverageWaveformsWidget(GUIWidget, QtWidgets.QWidget):
 
 	def updateData(self):
 		self._data = self.store['visible_data']
-		self._labels = np.unique(self._data.labels)
+		groups = LabelGroups(self._data.labels)
+		self._labels = groups.labels
+		self._avgs = groups.mean(self._data.data)
+		if isinstance(self._data, SLVBatch):
+			self._stds = np.sqrt(groups.mean(self._data.variance))
+		else:
+			self._stds = np.sqrt(groups.var(self._data.data, mean=self._avgs))
 		self._label_map = dict(zip(self._labels, np.arange(self._labels.size)))
 		self._render()
 
@@ -96,12 +103,8 @@ class AverageWaveformsWidget(GUIWidget, QtWidgets.QWidget):
 		while i < page_labels.size:
 			lb = page_labels[i]
 			c_i = lb % gc.n_colors
-			X = self._data.data[self._data.labels == lb]
-			avg = np.mean(X, axis=0)
-			if isinstance(self._data, SLVBatch):
-				std = np.sqrt(np.mean(self._data.variance[self._data.labels == lb], axis=0))
-			else:
-				std = np.std(X, axis=0)
+			avg = self._avgs[self._label_map[lb]]
+			std = self._stds[self._label_map[lb]]
 			nstd = self.n_std * std
 			ymax = np.abs(avg).max() + nstd.max()
 			self._plots[i].setYRange(-ymax, ymax)
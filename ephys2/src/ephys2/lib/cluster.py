@@ -7,6 +7,7 @@ import numpy.typing as npt
 import random
 
 from .graph import *
+from .groupby import LabelGroups
 from ephys2 import _cpp
 
 ''' Data structures '''
@@ -66,13 +67,26 @@ def labeling_to_clustering(labeling: Labeling, indices: Optional[npt.NDArray]=No
 def eq_clustering(c1: Clustering, c2: Clustering) -> bool:
 	return all(np.allclose(c1[i], c2[i]) for i in range(len(c1)))
 
-def link_labels(labels: Labeling, linkage: EVIncidence) -> Labeling:
+def link_labels(labels: Labeling, linkage: EVIncidence, label_map: Optional[npt.NDArray[np.int64]]=None) -> Labeling:
 	'''
 	Link labels using an edge-vertex graph, returning the minimum label for each connected component.
+	If the label map of the graph (see link_label_map()) is given, this is a single gather.
+	Labels beyond the label map are not in the graph, and map to themselves.
 	'''
-	result = np.zeros_like(labels, dtype=np.int64)
-	_cpp.link_labels(labels, result, linkage.tuple())
-	return result
+	if label_map is None:
+		result = np.zeros_like(labels, dtype=np.int64)
+		_cpp.link_labels(labels, result, linkage.tuple())
+		return result
+	if labels.size > 0 and labels.max() >= label_map.size:
+		label_map = np.concatenate((label_map, np.arange(label_map.size, labels.max() + 1, dtype=label_map.dtype)))
+	return label_map[labels]
+
+def link_label_map(linkage: EVIncidence) -> npt.NDArray[np.int64]:
+	'''
+	Map from each label of the label space to its linked label (the minimum label of its connected component),
+	computed by union-find in O(edges + labels).
+	'''
+	return _cpp.link_label_map(linkage.tuple())
 
 def link_labels_py(labels: Labeling, linkage: EVIncidence) -> Labeling:
 	'''
@@ -142,4 +156,44 @@ def add_links(linkage: EVIncidence, nodes: List[int]) -> EVIncidence:
 		shape = (linkage.shape[0] + nlinks, linkage.shape[1])
 		linkage = CSRMatrix(data, indices, indptr, shape)
 		# linkage.check_format()
-	return linkage
\ No newline at end of file
+	return linkage
+
+def stratified_subsample(N: int, n: int, random_seed: Optional[int]=None) -> npt.NDArray[np.int64]:
+	'''
+	Draw one index uniformly from each of n (near-)equal strata of 0...N-1, e.g. spread evenly over time.
+	Returns n sorted indices.
+	'''
+	assert 0 < n <= N, 'Subsample size must be in [1, N]'
+	rng = np.random.default_rng(random_seed)
+	edges = (np.arange(n + 1, dtype=np.int64) * N) // n
+	return edges[:-1] + (rng.random(n) * np.diff(edges)).astype(np.int64)
+
+def nearest_centroid_classify(
+		X: npt.NDArray, 						# Labeled samples (N, M)
+		labels: Labeling, 					# Labels of X (N,)
+		Y: npt.NDArray, 						# Samples to classify (L, M)
+		regularization: float=1e-6,	# Ridge added to the covariance, relative to its average variance
+		chunk_size: int=65536 			# Samples of Y classified at once (bounds memory to chunk_size x n_labels)
+	) -> Labeling:
+	'''
+	Assign each sample of Y the label of the nearest label centroid of X in Mahalanobis distance,
+	under the pooled within-label covariance of X.
+	'''
+	assert X.shape[0] == labels.size > 0
+	groups = LabelGroups(labels)
+	X = X.astype(np.float64)
+	centroids = groups.mean(X)
+	R = X - centroids[groups.inverse]
+	M = X.shape[1]
+	cov = R.T @ R / max(1, X.shape[0] - groups.size)
+	scale = np.trace(cov) / M
+	cov[np.diag_indices(M)] += regularization * (scale if scale > 0 else 1)
+	# Whiten, such that Mahalanobis distances become Euclidean
+	W = np.linalg.inv(np.linalg.cholesky(cov)).T
+	C = centroids @ W
+	C_sq = (C ** 2).sum(axis=1)
+	result = np.empty(Y.shape[0], dtype=np.int64)
+	for start in range(0, Y.shape[0], chunk_size):
+		Z = Y[start:start + chunk_size].astype(np.float64) @ W
+		result[start:start + chunk_size] = groups.labels[np.argmin(C_sq - 2 * (Z @ C.T), axis=1)]
+	return result
@@ -0,0 +1,117 @@
+'''
+Per-label (group-by) reductions
+'''
+
+from typing import List, Optional
+from dataclasses import dataclass
+import numpy as np
+import numpy.typing as npt
+
+'''
+Types
+'''
+
+@dataclass
+class GroupStats:
+	labels: npt.NDArray[np.int64] 			# Unique labels in ascending order (K,)
+	count: npt.NDArray[np.int64] 				# Number of samples per label (K,)
+	sum: npt.NDArray[np.float64] 				# Sum of samples per label (K, ...)
+	mean: npt.NDArray[np.float64] 			# Mean of samples per label (K, ...)
+	var: npt.NDArray[np.float64] 				# (Population) variance of samples per label (K, ...)
+	median: Optional[npt.NDArray] = None 	# Median of samples per label (K, ...), if requested
+
+class LabelGroups:
+	'''
+	Sort-based grouping of samples by label.
+	Grouping costs one stable sort, after which every reduction is a single O(N) segmented pass,
+	rather than one boolean mask per label (O(N x K)).
+	'''
+	def __init__(self, labels: npt.NDArray):
+		labels = np.asarray(labels)
+		assert labels.ndim == 1
+		N = labels.size
+		self.order = np.argsort(labels, kind='stable') # Samples of each label, in their original order
+		sorted_labels = labels[self.order]
+		starts = np.flatnonzero(np.concatenate(([N > 0], sorted_labels[1:] != sorted_labels[:-1])))
+		self.labels = sorted_labels[starts]
+		self.offsets = np.append(starts, N) # Group k is order[offsets[k]:offsets[k+1]]
+		self.inverse = np.empty(N, dtype=np.intp) # Group index of each sample
+		self.inverse[self.order] = np.repeat(np.arange(self.size), self.count())
+
+	@property
+	def size(self) -> int:
+		return self.labels.size
+
+	def count(self) -> npt.NDArray[np.int64]:
+		return np.diff(self.offsets)
+
+	def sum(self, X: npt.NDArray) -> npt.NDArray[np.float64]:
+		'''
+		Per-label sums along the first axis, accumulated in double precision.
+		'''
+		X = np.asarray(X)
+		assert X.shape[0] == self.inverse.size
+		if self.size == 0:
+			return np.zeros((0,) + X.shape[1:], dtype=np.float64)
+		return np.add.reduceat(X[self.order], self.offsets[:-1], axis=0, dtype=np.float64)
+
+	def mean(self, X: npt.NDArray) -> npt.NDArray[np.float64]:
+		return self.sum(X) / self._per_sample(self.count(), np.ndim(X))
+
+	def var(self, X: npt.NDArray, mean: Optional[npt.NDArray]=None) -> npt.NDArray[np.float64]:
+		'''
+		Per-label population variance (as np.var), computed about the per-label mean.
+		'''
+		if mean is None:
+			mean = self.mean(X)
+		return self.mean((X - mean[self.inverse]) ** 2)
+
+	def median(self, X: npt.NDArray) -> npt.NDArray:
+		'''
+		Per-label medians along the first axis; O(N log N) overall.
+		'''
+		X = np.asarray(X)
+		if self.size == 0:
+			return np.zeros((0,) + X.shape[1:], dtype=np.float64)
+		return np.stack([np.median(x, axis=0) for x in self.split(X)])
+
+	def split(self, X: npt.NDArray) -> List[npt.NDArray]:
+		'''
+		Samples of each label (in ascending order of label), preserving their original order.
+		'''
+		X = np.asarray(X)
+		assert X.shape[0] == self.inverse.size
+		if self.size == 0:
+			return []
+		return np.split(X[self.order], self.offsets[1:-1])
+
+	def indices(self) -> List[npt.NDArray[np.intp]]:
+		'''
+		Indices of the samples of each label.
+		'''
+		if self.size == 0:
+			return []
+		return np.split(self.order, self.offsets[1:-1])
+
+	def stats(self, X: npt.NDArray, median: bool=False) -> GroupStats:
+		count = self.count()
+		total = self.sum(X)
+		mean = total / self._per_sample(count, np.ndim(X))
+		return GroupStats(
+			labels = self.labels,
+			count = count,
+			sum = total,
+			mean = mean,
+			var = self.var(X, mean=mean),
+			median = self.median(X) if median else None
+		)
+
+	@staticmethod
+	def _per_sample(x: npt.NDArray, ndim: int) -> npt.NDArray:
+		return x.reshape(x.shape + (1,) * (ndim - 1))
+
+def group_stats(labels: npt.NDArray, X: npt.NDArray, median: bool=False) -> GroupStats:
+	'''
+	Count, sum, mean, variance (and optionally median) of samples X along the first axis, per label.
+	'''
+	return LabelGroups(labels).stats(X, median=median)
@@ -9,4 +9,6 @@ from .tbatch import *
 from .ltbatch import *
 from .slvbatch import *
 from .sllvbatch import *
-from .utils import *
\ No newline at end of file
+from .utils import *
+from .cache import *
+from .writer import *
\ No newline at end of file
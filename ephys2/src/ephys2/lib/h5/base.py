@@ -17,6 +17,7 @@ from abc import ABC, abstractmethod
 import os
 import shutil
 import itertools
+import threading
 import shortuuid
 
 from ephys2.lib.types import *
@@ -180,12 +181,15 @@ class H5Serializer(ABC):
 		# Update last path
 		global_state.last_h5 = self.out_path
 
-	def cleanup(self):
+	def cleanup(self, background: bool=False):
 		'''
-		Delete temporary files
+		Delete temporary files, optionally in a background thread (which the process waits for before exiting).
 		'''
 		if self.rank == 0:
-			shutil.rmtree(self.tmp_path)
+			if background:
+				threading.Thread(target=shutil.rmtree, args=(self.tmp_path,), name='ephys2-cleanup').start()
+			else:
+				shutil.rmtree(self.tmp_path)
 
 	'''
 	Data type information
@@ -0,0 +1,123 @@
+'''
+Size-bounded LRU cache for data loaded from HDF5 files
+'''
+from typing import Any, Callable, Hashable, Optional, Tuple
+from collections import OrderedDict
+import threading
+import os
+
+from .utils import *
+
+'''
+Types
+'''
+H5CacheKey = Tuple[str, str, Hashable] # (file, item, generation)
+
+'''
+Functions
+'''
+
+def h5_generation(h5dir: H5Dir) -> Tuple[Hashable, int]:
+	'''
+	Generation of the data stored at a directory: changes whenever the file is re-written or the directory is edited in place.
+	Files written by a checkpoint carry a generation token; otherwise the modification time of the file is used.
+	'''
+	file_gen = h5dir.file.attrs.get('generation', None)
+	if file_gen is None:
+		file_gen = os.stat(h5dir.file.filename).st_mtime_ns
+	return (file_gen, int(h5dir.attrs.get('generation', 0)))
+
+def h5_cache_key(h5dir: H5Dir) -> H5CacheKey:
+	return (os.path.realpath(h5dir.file.filename), h5dir.name, h5_generation(h5dir))
+
+def bump_generation(h5dir: H5Dir):
+	'''
+	Mark a directory as edited in place.
+	'''
+	h5dir.attrs['generation'] = int(h5dir.attrs.get('generation', 0)) + 1
+
+'''
+Cache
+'''
+
+class H5Cache:
+	'''
+	Least-recently-used cache of values keyed on (file, item, generation), evicting beyond a memory budget.
+	Thread-safe, and shared by all readers in a process.
+	'''
+	def __init__(self, max_bytes: int):
+		self._entries: OrderedDict[H5CacheKey, Tuple[Any, int]] = OrderedDict()
+		self._lock = threading.Lock()
+		self._max_bytes = max_bytes
+		self.nbytes = 0
+		self.hits = 0
+		self.misses = 0
+
+	@property
+	def max_bytes(self) -> int:
+		return self._max_bytes
+
+	@max_bytes.setter
+	def max_bytes(self, n: int):
+		with self._lock:
+			self._max_bytes = n
+			self._evict()
+
+	def __len__(self) -> int:
+		return len(self._entries)
+
+	def __contains__(self, key: H5CacheKey) -> bool:
+		with self._lock:
+			return key in self._entries
+
+	def get(self, key: H5CacheKey) -> Optional[Any]:
+		with self._lock:
+			if key in self._entries:
+				self._entries.move_to_end(key)
+				self.hits += 1
+				return self._entries[key][0]
+			self.misses += 1
+			return None
+
+	def put(self, key: H5CacheKey, value: Any, nbytes: int):
+		'''
+		Insert a value; values larger than the entire budget are not cached.
+		'''
+		with self._lock:
+			self._pop(key)
+			if nbytes <= self._max_bytes:
+				self._entries[key] = (value, nbytes)
+				self.nbytes += nbytes
+				self._evict()
+
+	def get_or_load(self, key: H5CacheKey, load: Callable[[], Any], nbytes: Callable[[Any], int]) -> Any:
+		value = self.get(key)
+		if value is None:
+			value = load()
+			self.put(key, value, nbytes(value))
+		return value
+
+	def invalidate(self, file: str, item: Optional[str]=None):
+		'''
+		Drop all generations of an item, or of all items in a file if none is given.
+		'''
+		file = os.path.realpath(file)
+		with self._lock:
+			for key in [k for k in self._entries if k[0] == file and (item is None or k[1] == item)]:
+				self._pop(key)
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+			self.nbytes = 0
+
+	def _pop(self, key: H5CacheKey):
+		if key in self._entries:
+			self.nbytes -= self._entries.pop(key)[1]
+
+	def _evict(self):
+		while self.nbytes > self._max_bytes:
+			_, (_, nbytes) = self._entries.popitem(last=False)
+			self.nbytes -= nbytes
+
+time_index_cache: H5Cache = H5Cache(64 * 2 ** 20) # Sparse time indices (see read_time_index()), shared in the process
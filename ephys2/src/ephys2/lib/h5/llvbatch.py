@@ -6,13 +6,16 @@ from .utils import *
 from .array import *
 from .sparse import *
 from .lvbatch import *
+from .cache import *
 
 from ephys2.lib.types.llvbatch import *
+from ephys2.lib.settings import global_settings
 from ephys2.lib.graph import *
+from ephys2.lib.cluster import link_label_map
 from ephys2 import _cpp
 
 class H5LLVBatchSerializer(H5Serializer):
-	memoized_links: Dict[H5ID, EVIncidence] = dict()
+	memoized_links: H5Cache = H5Cache(global_settings.link_cache_bytes) # Shared by all loaders in the process
 
 	@classmethod
 	def data_type(cls: type) -> type:
@@ -65,6 +68,8 @@ class H5LLVBatchSerializer(H5Serializer):
 	def init_serialize(self, out_dir: H5Dir):
 		self.labels_serializer.init_serialize(out_dir)
 		self.linkage_serializer.init_serialize(create_overwrite_group(out_dir, 'linkage'))
+		if 'label_map' in out_dir:
+			del out_dir['label_map'] # Stale with respect to the new links
 		out_dir.attrs['block_size'] = self.block_size
 
 	def start_serialize(self) -> MultiIndex:
@@ -87,6 +92,8 @@ class H5LLVBatchSerializer(H5Serializer):
 		H5CSRSerializer.check(h5dir['linkage'], full)
 		assert 'block_size' in h5dir.attrs
 		assert h5dir['linkage'].attrs['shape'][1] in [0, h5dir['labels'].shape[0]] # Check consistency of the label space
+		if 'label_map' in h5dir:
+			assert h5dir['label_map'].shape[0] >= h5dir['linkage'].attrs['shape'][1]
 		if full:
 			# Check consistency of the edge-vertex incidence matrix
 			indptr = h5dir['linkage']['indptr'][:]
@@ -139,10 +146,49 @@ class H5LLVBatchSerializer(H5Serializer):
 		'''
 		Load the links matrix with memoization.
 		'''
-		li_id = h5dir_id(h5dir['linkage'])
-		if li_id not in cls.memoized_links:
-			cls.memoized_links[li_id] = H5CSRSerializer.load(h5dir['linkage'])
-		return cls.memoized_links[li_id]
+		return cls.memoized_links.get_or_load(
+			h5_cache_key(h5dir['linkage']),
+			lambda: H5CSRSerializer.load(h5dir['linkage']),
+			lambda linkage: linkage.nbytes
+		)
+
+	@classmethod
+	def load_label_map(cls: type, h5dir: H5Dir) -> npt.NDArray[np.int64]:
+		'''
+		Load the linked label of every label (see link_label_map()) with memoization,
+		reading the persisted map if present (see save_label_map()), and otherwise computing it from the links.
+		'''
+		li_dir = h5dir['linkage']
+		file, name, generation = h5_cache_key(li_dir)
+		return cls.memoized_links.get_or_load(
+			(file, name + '/label_map', generation),
+			lambda: h5dir['label_map'][:] if 'label_map' in h5dir else link_label_map(cls.load_links(h5dir)),
+			lambda label_map: label_map.nbytes
+		)
+
+	@classmethod
+	def save_label_map(cls: type, h5dir: H5Dir):
+		'''
+		Persist the label map next to the links matrix, such that readers can link labels with a single gather.
+		'''
+		label_map = link_label_map(cls.load_links(h5dir))
+		if 'label_map' in h5dir:
+			del h5dir['label_map']
+		h5dir.create_dataset('label_map', data=label_map)
+
+	@classmethod
+	def replace_links(cls: type, h5dir: H5Dir, linkage: EVIncidence):
+		'''
+		Overwrite the links matrix, invalidating only the memoized links of this item.
+		A persisted label map is removed, since it no longer matches the links.
+		'''
+		li_dir = h5dir['linkage']
+		cls.memoized_links.invalidate(li_dir.file.filename, li_dir.name)
+		cls.memoized_links.invalidate(li_dir.file.filename, li_dir.name + '/label_map')
+		if 'label_map' in h5dir:
+			del h5dir['label_map']
+		H5CSRSerializer.replace(li_dir, linkage)
+		cls.memoized_links.put(h5_cache_key(li_dir), linkage, linkage.nbytes)
 
 	@classmethod
 	def load_links_multi(cls: type, h5dirs: List[H5Dir]) -> EVIncidence:
@@ -168,9 +214,11 @@ class H5LLVBatchSerializer(H5Serializer):
 		assert block_start <= index <= block_end
 
 		# Load the labels & links and perform the split
+		# (on a copy of the links, since the memoized links must only change once the new ones are persisted)
 		block_labels = h5dir['labels'][block_start:block_end]
 		if linkage is None:
-			linkage = H5CSRSerializer.load(h5dir['linkage'])
+			linkage = cls.load_links(h5dir)
+		linkage = linkage.copy()
 		label_map = _cpp.split_block_1d(
 			block_labels,
 			block_start, 
@@ -183,7 +231,7 @@ class H5LLVBatchSerializer(H5Serializer):
 
 		# Save the new labels & links
 		h5dir['labels'][block_start:block_end] = block_labels
-		H5CSRSerializer.replace(h5dir['linkage'], linkage)
+		cls.replace_links(h5dir, linkage)
 
 		return linkage, label_map
 
@@ -202,7 +250,8 @@ class H5LLVBatchSerializer(H5Serializer):
 			return linkage
 
 		if linkage is None:
-			linkage = H5CSRSerializer.load(h5dir['linkage'])
+			linkage = cls.load_links(h5dir)
+		linkage = linkage.copy() # The memoized links must only change once the new ones are persisted
 			
 		# Find the blocks which are being split
 		B = int(h5dir.attrs['block_size'])
@@ -229,7 +278,7 @@ class H5LLVBatchSerializer(H5Serializer):
 
 		# Save the new labels & links
 		h5dir['labels'][blocks_start:blocks_end] = labels
-		H5CSRSerializer.replace(h5dir['linkage'], linkage)
+		cls.replace_links(h5dir, linkage)
 
 		return linkage, label_map
 
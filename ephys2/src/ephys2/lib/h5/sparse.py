@@ -11,6 +11,7 @@ import pdb
 
 from .base import *
 from .array import *
+from .cache import *
 from ephys2.lib.sparse import *
 from ephys2.lib.array import *
 
@@ -202,6 +203,7 @@ class H5CSRSerializer(H5Serializer):
 
 	@classmethod
 	def replace(cls: type, h5dir: H5Dir, mat: CSRMatrix):
+		bump_generation(h5dir) # Invalidates cached copies (see cache.py)
 		del h5dir['data']
 		del h5dir['indices']
 		del h5dir['indptr']
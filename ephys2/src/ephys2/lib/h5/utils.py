@@ -1,12 +1,14 @@
 '''
 HDF5 utilities
 '''
-from typing import Any, List, Tuple, Union
+from typing import Any, List, Optional, Tuple, Union
 from datetime import datetime
 import warnings
+import bisect
 import h5py 
 import math
 import json
+import numpy as np
 
 from ephys2.lib.singletons import logger
 
@@ -22,28 +24,127 @@ Functions
 
 def binary_search_interval(ds: h5py.Dataset, elem: Any) -> Tuple[int, int]:
 	'''
-	Find the indices of the smallest containing interval in a sorted, monotone increasing dataset.
+	Find the indices of the smallest containing interval in a sorted, monotone increasing dataset (see search_interval()).
+	Uses the sparse time index of the dataset if one was written (see write_time_index()).
 	'''
-	if ds.shape[0] == 0:
+	index = read_time_index(ds)
+	if index is not None:
+		return indexed_search_interval(ds, index, elem)
+	N = ds.shape[0]
+	if N == 0:
 		warnings.warn('Empty dataset; returning (0, 0)')
 		return 0, 0
-	lo, hi = 0, ds.shape[0] - 1
-	prev_lo, prev_hi = None, None
-	while (lo != prev_lo) or (hi != prev_hi):
-		prev_lo, prev_hi = lo, hi
-		mid = (lo + hi) // 2
-		res = (lo + hi) % 2
-		val1, val2 = ds[mid], ds[mid+res]
-
-		if val2 <= elem:
-			lo = mid + res
-		elif val1 <= elem:
-			lo = mid
-		if val1 >= elem:
-			hi = mid
-		elif val2 >= elem:
-			hi = mid + res
-	return lo, hi
+	s = bisect.bisect_left(ds, elem)
+	return interval_from_left(s, ds[s] if s < N else None, elem, N)
+
+def search_interval(arr: np.ndarray, elem: Any) -> Tuple[int, int]:
+	'''
+	Find the indices (lo, hi) of the smallest containing interval in a sorted in-memory array, clamped to the array.
+	If elem occurs (possibly repeatedly), lo = hi is its first occurrence; otherwise arr[lo] < elem < arr[hi] with hi = lo + 1.
+	'''
+	N = arr.shape[0]
+	if N == 0:
+		warnings.warn('Empty dataset; returning (0, 0)')
+		return 0, 0
+	s = int(np.searchsorted(arr, elem, side='left'))
+	return interval_from_left(s, arr[s] if s < N else None, elem, N)
+
+def interval_from_left(s: int, val: Any, elem: Any, N: int) -> Tuple[int, int]:
+	'''
+	Containing interval given the first index s whose value (val, if s < N) is >= elem.
+	'''
+	if s < N and val == elem:
+		return s, s
+	return max(s - 1, 0), min(s, N - 1)
+
+'''
+Sparse time indices
+
+A time index is a small (n_blocks, 2) dataset stored next to a sorted 1-D dataset `<name>`, under `<name>_index`.
+Row i holds the first and last values of rows [i * block_size, (i + 1) * block_size) of the indexed dataset,
+so that range lookups need a single in-memory search followed by a single contiguous read.
+'''
+
+TIME_INDEX_BLOCK_SIZE = 4096 # Used for contiguous datasets; chunked datasets are indexed per chunk
+
+def time_index_name(ds: h5py.Dataset) -> str:
+	return ds.name.rsplit('/', 1)[-1] + '_index'
+
+def write_time_index(ds: h5py.Dataset, block_size: Optional[int]=None):
+	'''
+	Write (or overwrite) the sparse index of a sorted 1-D dataset, along with its min/max values.
+	Reads the dataset in contiguous multiples of the block size.
+	'''
+	assert ds.ndim == 1, 'Only 1-dimensional datasets can be indexed'
+	if block_size is None:
+		block_size = ds.chunks[0] if ds.chunks is not None else TIME_INDEX_BLOCK_SIZE
+	N = ds.shape[0]
+	n_blocks = math.ceil(N / block_size)
+	index = np.empty((n_blocks, 2), dtype=ds.dtype)
+	read_size = block_size * max(1, TIME_INDEX_BLOCK_SIZE * 64 // block_size)
+	for start in range(0, N, read_size):
+		vals = ds[start:start + read_size]
+		b0 = start // block_size
+		nb = math.ceil(vals.shape[0] / block_size)
+		index[b0:b0 + nb, 0] = vals[::block_size]
+		index[b0:b0 + nb, 1] = vals[np.minimum(np.arange(1, nb + 1) * block_size, vals.shape[0]) - 1]
+	index_ds = create_overwrite_dataset(ds.parent, time_index_name(ds), index.shape, dtype=index.dtype, data=index)
+	index_ds.attrs['block_size'] = block_size
+	index_ds.attrs['size'] = N
+	if N > 0:
+		index_ds.attrs['min'] = index[0, 0]
+		index_ds.attrs['max'] = index[-1, 1]
+
+def write_time_indices(h5dir: H5Dir, name: str='time'):
+	'''
+	Index all 1-D datasets with the given name under a directory.
+	'''
+	datasets = []
+	h5dir.visititems(lambda path, obj: datasets.append(obj) if (
+		isinstance(obj, h5py.Dataset) and path.rsplit('/', 1)[-1] == name and obj.ndim == 1
+	) else None)
+	for ds in datasets:
+		write_time_index(ds)
+
+def read_time_index(ds: h5py.Dataset) -> Optional[Tuple[np.ndarray, int]]:
+	'''
+	Read the sparse index of a dataset, if a valid one exists; indices are cached per file generation (see h5_cache_key()).
+	Returns the index and its block size.
+	'''
+	from .cache import time_index_cache, h5_cache_key # Depends on this module
+
+	name = time_index_name(ds)
+	if ds.ndim != 1 or not (name in ds.parent):
+		return None
+	index_ds = ds.parent[name]
+	N = ds.shape[0]
+	# Stale index (the dataset was rewritten without it)
+	if index_ds.attrs.get('size', -1) != N:
+		return None
+	if N > 0 and (index_ds.attrs.get('min') != ds[0] or index_ds.attrs.get('max') != ds[N - 1]):
+		return None
+	return time_index_cache.get_or_load(
+		h5_cache_key(index_ds),
+		lambda: (index_ds[:], int(index_ds.attrs['block_size'])),
+		lambda index: index[0].nbytes
+	)
+
+def indexed_search_interval(ds: h5py.Dataset, index: Tuple[np.ndarray, int], elem: Any) -> Tuple[int, int]:
+	'''
+	Equivalent of binary_search_interval() using a sparse time index; reads a single block of the dataset.
+	'''
+	blocks, block_size = index
+	N = ds.shape[0]
+	if N == 0:
+		warnings.warn('Empty dataset; returning (0, 0)')
+		return 0, 0
+	b = int(np.searchsorted(blocks[:, 1], elem, side='left')) # Block containing the first element >= elem
+	if b == blocks.shape[0]:
+		return interval_from_left(N, None, elem, N)
+	start = b * block_size
+	vals = ds[start:min(start + block_size, N)]
+	j = int(np.searchsorted(vals, elem, side='left'))
+	return interval_from_left(start + j, vals[j], elem, N)
 
 class open_h5s:
 	def __init__(self, filepaths: List[str], mode: str):
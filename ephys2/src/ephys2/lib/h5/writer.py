@@ -0,0 +1,52 @@
+'''
+Background writing of worker files
+'''
+from typing import Any, Optional
+import threading
+import queue
+
+from .base import *
+
+class H5AsyncWriter:
+	'''
+	Hands batches to a dedicated writer thread (one per worker) through a bounded queue.
+	Writing blocks while the queue is full, so that compute never runs more than `max_queued` batches ahead of the disk.
+	Errors in the writer thread are re-raised in the calling thread by the next write() or close().
+
+	Batches must not be modified after they are written.
+	'''
+	def __init__(self, serializer: H5Serializer, max_queued: int):
+		assert max_queued > 0, 'Writer queue must hold at least one batch'
+		self.serializer = serializer
+		self.queue = queue.Queue(maxsize=max_queued)
+		self.error: Optional[BaseException] = None
+		self.thread = threading.Thread(target=self.run, name=f'ephys2-writer-{serializer.rank}', daemon=True)
+		self.thread.start()
+
+	def run(self):
+		while True:
+			data = self.queue.get()
+			if data is None:
+				return
+			if self.error is None: # Discard all remaining batches after an error
+				try:
+					self.serializer.write(data)
+				except BaseException as e:
+					self.error = e
+
+	def write(self, data: Any):
+		self.raise_error()
+		self.queue.put(data)
+
+	def close(self):
+		'''
+		Wait for all queued batches to be written.
+		'''
+		if self.thread.is_alive():
+			self.queue.put(None)
+			self.thread.join()
+		self.raise_error()
+
+	def raise_error(self):
+		if self.error is not None:
+			raise RuntimeError(f'Worker {self.serializer.rank}: error writing {self.serializer.filepath}') from self.error
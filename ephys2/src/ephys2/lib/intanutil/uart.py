@@ -1,5 +1,81 @@
 import numpy as np
 
+def ttl_transitions(binary_data: np.ndarray) -> np.ndarray:
+    """Sample indices at which a TTL signal (0/1) changes level, i.e. where binary_data[i] != binary_data[i-1]."""
+    sig = np.asarray(binary_data) != 0
+    return np.flatnonzero(sig[1:] != sig[:-1]) + 1
+
+
+def ttl_levels(first_level: int, transitions: np.ndarray, idxs: np.ndarray) -> np.ndarray:
+    """Levels (0/1) at sample indices of a TTL signal given by its first level and its transitions."""
+    return first_level ^ (np.searchsorted(transitions, idxs, side="right") & 1)
+
+
+def greedy_chain(next_idxs: np.ndarray) -> np.ndarray:
+    """Indices visited by following i -> next_idxs[i] from 0, where next_idxs[i] > i.
+
+    This is the selection made by a sequential scan which accepts a candidate and then
+    skips all candidates it overlaps (next_idxs[i] being the first one it does not).
+    """
+    N = next_idxs.size
+    if np.all(next_idxs == np.arange(1, N + 1)):  # No overlaps
+        return np.arange(N)
+    next_idxs = next_idxs.tolist()
+    chain = []
+    i = 0
+    while i < N:
+        chain.append(i)
+        i = next_idxs[i]
+    return np.array(chain, dtype=np.int64)
+
+
+def decode_uart_from_transitions(
+    first_level: int, transitions: np.ndarray, n_samples: int, fs: float, baud_rate: float
+):
+    """Decode UART bytes from a TTL waveform of n_samples given by its level transitions.
+
+    Identical to decode_uart_from_ttl(), but only touches the samples at bit centers, so the
+    waveform need not be materialized; see ttl_transitions().
+
+    Returns:
+        decoded_bytes: np.ndarray of decoded UART bytes (dtype uint8)
+        byte_times:   np.ndarray of sample indices for each decoded byte
+    """
+    transitions = np.asarray(transitions, dtype=np.int64)
+    bit_samples = fs / baud_rate
+
+    # Falling edges (diff == -1) are the transitions to level 0
+    new_levels = first_level ^ ((np.arange(transitions.size) + 1) & 1)
+    idx = transitions[new_levels == 0] - 1
+    # Need 10 bit periods available
+    idx = idx[idx + 10 * bit_samples <= n_samples]
+
+    # Centers of start & stop bits
+    start_idx = idx + 1
+    sb_idx = np.rint(start_idx + 0.5 * bit_samples).astype(np.int64)
+    stop_idx = np.rint(start_idx + 9.5 * bit_samples).astype(np.int64)
+
+    # Data bit centers, accumulated bit by bit (as in a sequential scan) for identical rounding
+    steps = np.full((idx.size, 9), bit_samples)
+    steps[:, 0] += start_idx
+    centers = np.add.accumulate(steps, axis=1)
+    n_bits = (centers <= (stop_idx - bit_samples)[:, np.newaxis] + 1e-6).sum(axis=1)
+    bits = ttl_levels(first_level, transitions, np.rint(centers[:, :8]).astype(np.int64))
+    decoded = (bits << np.arange(8)).sum(axis=1)  # LSB first
+
+    # Verify start and stop bits, and that there are exactly 8 data bits
+    valid = (
+        (ttl_levels(first_level, transitions, sb_idx) == 0)
+        & (ttl_levels(first_level, transitions, stop_idx) == 1)
+        & (n_bits == 8)
+    )
+    idx, start_idx, stop_idx, decoded = idx[valid], start_idx[valid], stop_idx[valid], decoded[valid]
+
+    # Each decoded frame skips over any start bits inside it
+    frames = greedy_chain(np.searchsorted(idx, stop_idx, side="right"))
+    return decoded[frames].astype(np.uint8), start_idx[frames].astype(int)
+
+
 def decode_uart_from_ttl(binary_data: np.ndarray, fs: float, baud_rate: float):
     """Decode UART bytes from a TTL waveform.
 
@@ -8,6 +84,7 @@ def decode_uart_from_ttl(binary_data: np.ndarray, fs: float, baud_rate: float):
       2. Verify start and stop bits
       3. Extract 8 data bits at their midpoints
       4. Convert bits to bytes (LSB-first)
+    Frames are checked for all candidate start bits at once, from the level transitions of the signal.
 
     Args:
         binary_data: TTL signal (0/1) as a NumPy array
@@ -18,102 +95,50 @@ def decode_uart_from_ttl(binary_data: np.ndarray, fs: float, baud_rate: float):
         decoded_bytes: np.ndarray of decoded UART bytes (dtype uint8)
         byte_times:   np.ndarray of sample indices for each decoded byte
     """
-    # Work with ints throughout
-    binary_int = binary_data.astype(int)
-    bit_samples = fs / baud_rate
-    decoded_bytes = []
-    byte_times = []
+    binary_data = np.asarray(binary_data)
+    if binary_data.size == 0:
+        return np.array([], dtype=np.uint8), np.array([], dtype=int)
+    return decode_uart_from_transitions(
+        int(binary_data[0] != 0), ttl_transitions(binary_data), binary_data.size, fs, baud_rate
+    )
 
-    # Find falling edges (MATLAB: find(diff(binaryData)==-1))
-    start_bit_queue = np.where(np.diff(binary_int) == -1)[0]
 
-    i = 0
-    while i < len(start_bit_queue):
-        idx = start_bit_queue[i]
-        # Need 10 bit periods available
-        if idx + 10 * bit_samples > len(binary_int):
-            break
-
-        # Center of start bit
-        start_idx = idx + 1
-        sb_idx = int(round(start_idx + 0.5 * bit_samples))
-        if binary_int[sb_idx] != 0:
-            i += 1
-            continue
+SERIAL_PACKET_LEN = 11
 
-        # Center of stop bit
-        stop_idx = int(round(start_idx + 9.5 * bit_samples))
-        if binary_int[stop_idx] != 1:
-            i += 1
-            continue
 
-        # Gather data‐bit sample indices
-        data_bit_indices = []
-        cur = start_idx + bit_samples
-        end_limit = stop_idx - bit_samples
-        while cur <= end_limit + 1e-6:
-            data_bit_indices.append(int(round(cur)))
-            cur += bit_samples
-
-        # Must have exactly 8 bits
-        if len(data_bit_indices) == 8:
-            bits = binary_int[data_bit_indices]
-            byte = 0
-            for b_i, b in enumerate(bits):
-                byte |= (b << b_i)  # LSB first
-            decoded_bytes.append(byte)
-            byte_times.append(start_idx)
-
-            # Skip over any start bits inside this frame
-            next_i = i + 1
-            while next_i < len(start_bit_queue) and start_bit_queue[next_i] <= stop_idx:
-                next_i += 1
-            i = next_i
-        else:
-            i += 1
-
-    return (
-        np.array(decoded_bytes, dtype=np.uint8),
-        np.array(byte_times, dtype=int),
-    )
+def serial_packet_arrays(byte_vec: np.ndarray, byte_times: np.ndarray) -> dict:
+    """Group a stream of UART bytes into fixed-length packets; fields as arrays (see decode_serial_packets())."""
+    byte_vec = np.asarray(byte_vec, dtype=np.uint8)
+    byte_times = np.asarray(byte_times)
+
+    # Packets start at 0xAA markers, and a packet skips any markers inside it
+    cands = np.flatnonzero(byte_vec[: max(byte_vec.size - SERIAL_PACKET_LEN + 1, 0)] == 0xAA)
+    starts = cands[greedy_chain(np.searchsorted(cands, cands + SERIAL_PACKET_LEN, side="left"))]
+    pkts = byte_vec[starts[:, np.newaxis] + np.arange(SERIAL_PACKET_LEN)]
+
+    # Bytes 3–6 and 7–10 are raw durations in microseconds
+    le_shifts = np.arange(0, 32, 8, dtype=np.int64)  # Little-endian
+    pulse_width_raw = (pkts[:, 2:6].astype(np.int64) << le_shifts).sum(axis=1)
+    wait_time_raw = (pkts[:, 6:10].astype(np.int64) << le_shifts).sum(axis=1)
+
+    return {
+        "startMarker": pkts[:, 0].astype(int),
+        "channelID": pkts[:, 1].astype(int),
+        "detectionTime": byte_times[starts].astype(int),
+        "waitTime": wait_time_raw / 1_000.0,  # ms
+        "pulseWidth": pulse_width_raw / 1_000.0,  # ms
+        "valid": pkts[:, 10].astype(int) == pkts[:, 1:6].astype(int).sum(axis=1) % 256,
+    }
 
 
 def decode_serial_packets(byte_vec: np.ndarray, byte_times: np.ndarray):
     """Group a stream of UART bytes into fixed-length packets."""
-    packet_len = 11
-    packets = []
-    i = 0
-
-    while i <= len(byte_vec) - packet_len:
-        if byte_vec[i] == 0xAA:
-            pkt = byte_vec[i : i + packet_len]
-            channel_id = int(pkt[1])
-
-            # Bytes 3–6 and 7–10 are raw durations in microseconds
-            pulse_width_raw = int.from_bytes(pkt[2:6].tobytes(), "little")
-            wait_time_raw   = int.from_bytes(pkt[6:10].tobytes(), "little")
-
-            # Directly convert µs → ms with one divide-by-1000
-            pulse_width_ms = pulse_width_raw / 1_000.0
-            wait_time_ms   = wait_time_raw   / 1_000.0
-
-            checksum = int(pkt[10])
-            expected = sum(int(b) for b in pkt[1:6]) % 256
-            valid = (checksum == expected)
-
-            packets.append({
-                "startMarker":  int(pkt[0]),
-                "channelID":    channel_id,
-                "detectionTime": int(byte_times[i]),
-                "waitTime":      wait_time_ms,    # ms
-                "pulseWidth":    pulse_width_ms,  # ms
-                "valid":         valid,
-            })
-            i += packet_len
-        else:
-            i += 1
-
-    return packets
+    arrays = serial_packet_arrays(byte_vec, byte_times)
+    keys = list(arrays.keys())
+    return [
+        dict(zip(keys, values))
+        for values in zip(*(arrays[k].tolist() for k in keys))
+    ]
 
 
 def deserialize_teensy(data_serial: dict, chunk_start: int = None, chunk_end: int = None):
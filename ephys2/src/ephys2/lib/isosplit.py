@@ -10,7 +10,7 @@ import pdb
 from sklearn.decomposition import PCA
 
 from ephys2.lib.cluster import *
-from ephys2.lib.singletons import logger
+from ephys2.lib.singletons import logger, global_state
 import ephys2._cpp as _cpp
 
 def isosplit5(
@@ -24,7 +24,10 @@ def isosplit5(
 		random_seed: Optional[int]=None, # Random seed
 		jitter: float=0, # Random jitter to apply to suppress matrix inversion errors
 		model: Optional[PCA]=None,
+		n_threads: Optional[int]=None, # Threads for the cluster statistics and pair comparisons (0 = all cores, None = global setting)
 	) -> Labeling:
+	if n_threads is None:
+		n_threads = global_state.n_threads
 	# Add independent noise to stabilize matrix inversion in iso-split
 	if jitter > 0:
 		rng = np.random.default_rng(seed=random_seed)
@@ -36,7 +39,7 @@ def isosplit5(
 	Y = model.fit_transform(X)
 	Y = Y.T.astype(np.float32, order='F') # cpp lib requires Fortran order
 	labels = np.zeros(Y.shape[1]).astype(np.int32)
-	_cpp.isosplit5(Y, labels, isocut_threshold, min_cluster_size, K_init, refine_clusters, max_iterations_per_pass, random_seed)
+	_cpp.isosplit5(Y, labels, isocut_threshold, min_cluster_size, K_init, refine_clusters, max_iterations_per_pass, random_seed, n_threads)
 	return labels
 
 def isosplit5_pca_branch(
@@ -48,42 +51,21 @@ def isosplit5_pca_branch(
 		refine_clusters: Optional[bool]=False,
 		max_iterations_per_pass: Optional[int]=500,
 		jitter: float=0, # Random jitter to apply to suppress matrix inversion errors
-		random_seed: Optional[int]=None # Random seed
+		random_seed: Optional[int]=None, # Random seed
+		n_threads: Optional[int]=None # Threads for independent branches (0 = all cores, None = global setting)
 	) -> Labeling:
 	'''
 	Computes a "stable" clustering by recursively applying PCA / ISOSPLIT 
 	in the manner described in https://www.ncbi.nlm.nih.gov/pmc/articles/PMC5743236/
+	The recursion runs natively on an index permutation; independent branches run in parallel.
 	'''
-	model = PCA(n_components=n_components, svd_solver='randomized', random_state=random_seed)
-	N = X.shape[0]
-
-	clusters_queue = [np.arange(N)]
-	final_clustering = []
-
-	# Recursively cluster using the "branch" method
-	while len(clusters_queue) > 0:
-		cluster = clusters_queue.pop()
-		if cluster.size <= 1:
-			final_clustering.append(cluster)
-		else:
-			lb = isosplit5(
-				X[cluster],
-				n_components = n_components,
-				isocut_threshold = isocut_threshold,
-				min_cluster_size = min_cluster_size,
-				K_init = K_init,
-				refine_clusters = refine_clusters,
-				max_iterations_per_pass = max_iterations_per_pass,
-				jitter = jitter, 
-				random_seed = random_seed,
-				model = model
-			)
-			clustering = labeling_to_clustering(lb, indices=cluster)
-			if len(clustering) == 1:
-				final_clustering.append(clustering[0])
-			else:
-				clusters_queue.extend(clustering)
-
-	labeling, _ = clustering_to_labeling(final_clustering, N)
-	return labeling
-
+	if n_threads is None:
+		n_threads = global_state.n_threads
+	X = np.ascontiguousarray(X, dtype=np.float32)
+	# Add independent noise to stabilize matrix inversion in iso-split
+	if jitter > 0:
+		rng = np.random.default_rng(seed=random_seed)
+		X = X + rng.normal(loc=0, scale=jitter, size=X.shape).astype(np.float32)
+	return _cpp.isosplit5_pca_branch(
+		X, n_components, isocut_threshold, min_cluster_size, K_init, refine_clusters, max_iterations_per_pass, n_threads
+	)
@@ -7,6 +7,7 @@ import time
 import warnings
 import pdb
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, List, Union, Dict
 
 from ephys2.lib.utils import ext_mul
@@ -15,6 +16,8 @@ from ephys2.lib.types import *
 from ephys2.lib.singletons import global_state, logger
 from ephys2.lib.distribution import WorkerDistribution
 
+READ_AHEAD_CACHE_BYTES = 64 * 2 ** 20 # HDF5 chunk cache size of the read-ahead file handles
+
 class BatchLoader(ABC):
 	'''
 	Base class for loading in ordered chunks.
@@ -43,6 +46,9 @@ class BatchLoader(ABC):
 		self.load_index = self.start + ext_mul(self.rank, self.batch_size - self.batch_overlap)
 		self.load_params_set = False
 		self.validated_data_distribution = False
+		self.read_ahead = None # ((start, stop), Future) of the next block
+		self.read_ahead_executor = None
+		self.read_ahead_files = dict()
 
 	@property
 	@abstractmethod
@@ -131,16 +137,15 @@ class BatchLoader(ABC):
 			next_stop = min(self.load_index + self.batch_size, self.stop)
 			data = None
 			if self.load_index < np.inf and self.load_index < next_stop:
-				next_stop = None if next_stop == np.inf else next_stop
-				if type(files) is list:
-					if len(files) == 1: # Avoid unnecessary concatenation
-						data = self.loader.load(files[0], start=self.load_index, stop=next_stop, overlap=self.batch_overlap)
-					else:
-						data = self.loader.load_multi(files, start=self.load_index, stop=next_stop, overlap=self.batch_overlap, time_offsets=time_offsets)
-				else:
-					data = self.loader.load(files, start=self.load_index, stop=next_stop, overlap=self.batch_overlap)
+				data = self.read(files, self.load_index, next_stop, time_offsets)
 				data = None if self.is_empty(data) else data
 			self.load_index += self.n_workers * (self.batch_size - self.batch_overlap) # Advance to next block for this worker 
+
+			# Start reading the next block for this worker while the current one is processed
+			if data is None:
+				self.stop_read_ahead()
+			else:
+				self.start_read_ahead(files, time_offsets)
 			
 			# Validate distribution after loading if we didn't already validate from metadata
 			if not self.validated_data_distribution and data is not None and self.rank == 0:
@@ -150,6 +155,61 @@ class BatchLoader(ABC):
 				self.validate_distribution(estimated_total_size)
 				
 			return data
+		else:
+			self.stop_read_ahead()
+
+	def read(self, files: Union[h5py.File, List[h5py.File]], start: int, stop: int, time_offsets: Optional[List[int]]) -> Batch:
+		'''
+		Read the block [start, stop), using the read-ahead result if it is for the same block.
+		'''
+		read_ahead, self.read_ahead = self.read_ahead, None
+		if read_ahead is not None and read_ahead[0] == (start, stop):
+			return read_ahead[1].result()
+		return self.read_files(files, start, stop, time_offsets)
+
+	def read_files(self, files: Union[h5py.File, List[h5py.File]], start: int, stop: int, time_offsets: Optional[List[int]]) -> Batch:
+		stop = None if stop == np.inf else stop
+		if type(files) is list:
+			if len(files) == 1: # Avoid unnecessary concatenation
+				return self.loader.load(files[0], start=start, stop=stop, overlap=self.batch_overlap)
+			else:
+				return self.loader.load_multi(files, start=start, stop=stop, overlap=self.batch_overlap, time_offsets=time_offsets)
+		else:
+			return self.loader.load(files, start=start, stop=stop, overlap=self.batch_overlap)
+
+	def start_read_ahead(self, files: Union[h5py.File, List[h5py.File]], time_offsets: Optional[List[int]]):
+		'''
+		Read the next block in a background thread, through file handles which stay open (keeping their chunk caches warm) until the last block.
+		'''
+		start, stop = self.load_index, min(self.load_index + self.batch_size, self.stop)
+		if not (global_state.read_ahead and start + self.batch_overlap < self.stop and start < stop):
+			return
+		if self.read_ahead_executor is None:
+			self.read_ahead_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'ephys2-reader-{self.rank}')
+		paths = [f.filename for f in files] if type(files) is list else files.filename
+		self.read_ahead = ((start, stop), self.read_ahead_executor.submit(self.read_paths, paths, start, stop, time_offsets))
+
+	def read_paths(self, paths: Union[str, List[str]], start: int, stop: int, time_offsets: Optional[List[int]]) -> Batch:
+		'''
+		Read a block by file path (only called from the read-ahead thread)
+		'''
+		for path in (paths if type(paths) is list else [paths]):
+			if path not in self.read_ahead_files:
+				self.read_ahead_files[path] = h5py.File(path, 'r', rdcc_nbytes=READ_AHEAD_CACHE_BYTES)
+		files = [self.read_ahead_files[p] for p in paths] if type(paths) is list else self.read_ahead_files[paths]
+		return self.read_files(files, start, stop, time_offsets)
+
+	def stop_read_ahead(self):
+		'''
+		Wait for any outstanding read and release the read-ahead file handles, so that the files may be re-opened for writing.
+		'''
+		self.read_ahead = None
+		if self.read_ahead_executor is not None:
+			self.read_ahead_executor.shutdown(wait=True)
+			self.read_ahead_executor = None
+		for f in self.read_ahead_files.values():
+			f.close()
+		self.read_ahead_files = dict()
 
 	def compute_load_size(self, files: Union[h5py.File, List[h5py.File]]) -> Union[int, Dict[str, int]]:
 		if not (type(files) is list):
@@ -1,43 +1,66 @@
 '''
-Python prototype for seq alignment.
+Sequence alignment: native pairing of sorted timestamps, and the Python prototype of the C++ kernels.
 '''
+from typing import Tuple
 import numpy as np
-import pdb
+import numpy.typing as npt
+
+from ephys2 import _cpp
+
+def pair_times(times1: npt.NDArray[np.int64], times2: npt.NDArray[np.int64], max_dist: int) -> Tuple[npt.NDArray[np.int64], npt.NDArray[np.int64], npt.NDArray[bool], npt.NDArray[bool]]:
+	'''
+	Pair two sorted time arrays within a tolerance of max_dist (> 0) samples, in one native pass.
+	Returns the (K,) indices of the paired elements in each array, and the unmatched masks of each array.
+	Pairing is identical to pair() / _cpp.align_sequences().
+	'''
+	times1 = np.ascontiguousarray(times1, dtype=np.int64)
+	times2 = np.ascontiguousarray(times2, dtype=np.int64)
+	idxs1, idxs2 = _cpp.pair_times(times1, times2, max_dist)
+	unmatched1 = np.ones(times1.size, dtype=bool)
+	unmatched1[idxs1] = False
+	unmatched2 = np.ones(times2.size, dtype=bool)
+	unmatched2[idxs2] = False
+	return idxs1, idxs2, unmatched1, unmatched2
+
+'''
+Python prototypes
+'''
 
 def pair(times1, times2, max_dist):
 
 	N1, N2 = len(times1), len(times2)
-
-	reverse = False
-	if N2 < N1:
-		times1, times2 = times2, times1
-		N1, N2 = N2, N1
-		reverse = True
-
-	assert N1 <= N2
-
 	idxs1, idxs2 = [], []
 
 	i1, i2 = 0, 0
 	while (i1 < N1 and i2 < N2):
-		best_dist = np.abs(times1[i1] - times2[i2])
-		best_i2 = i2
-
-		while (i2 < N2 and times2[i2] <= times1[i1]):
-			dist = np.abs(times1[i1] - times2[i2])
-			if dist < best_dist:
-				best_dist = dist
-				best_i2 = i2
-			i2 += 1
-
-		if best_i2 < N2 and best_dist <= max_dist:
+		if times1[i1] <= times2[i2]:
+			if i1 + 1 < N1 and times1[i1 + 1] <= times2[i2]:
+				i1 += 1
+				continue
+			# times2[i2] is bracketed by times1[i1] and times1[i1 + 1]; take the closer, ties to the earlier
+			if i1 + 1 < N1 and times1[i1 + 1] - times2[i2] < times2[i2] - times1[i1]:
+				i1 += 1
+				continue
+		else:
+			if i2 + 1 < N2 and times2[i2 + 1] < times1[i1]:
+				i2 += 1
+				continue
+			# times1[i1] is bracketed by times2[i2] and times2[i2 + 1]; take the closer, ties to the earlier
+			if i2 + 1 < N2 and times2[i2 + 1] - times1[i1] < times1[i1] - times2[i2]:
+				i2 += 1
+				continue
+
+		if np.abs(times1[i1] - times2[i2]) <= max_dist:
 			idxs1.append(i1)
-			idxs2.append(best_i2)
-
-		i1 += 1
-		i2 = best_i2 + 1
+			idxs2.append(i2)
+			i1 += 1
+			i2 += 1
+		elif times1[i1] <= times2[i2]:
+			i1 += 1
+		else:
+			i2 += 1
 
-	return (idxs2, idxs1) if reverse else (idxs1, idxs2)
+	return idxs1, idxs2
 
 def mergesort_into(arr, times1, vals1, times2, vals2, i1, i2, I1, I2):
 	while (i1 < I1 and i2 < I2):
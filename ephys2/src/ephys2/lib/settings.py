@@ -13,5 +13,6 @@ class Settings:
 	gui_tag: Optional[str] = None
 	# Both
 	debug_on: bool = False
+	link_cache_bytes: int = 2 ** 30 # Memory budget for memoized linkage matrices (see H5LLVBatchSerializer)
 
 global_settings = Settings()
\ No newline at end of file
@@ -16,6 +16,10 @@ class State:
 		self.load_overlap = 0
 		self.load_batch_size = 0
 		self._debug = False
+		self.use_cache = True # Whether to resume pipelines from up-to-date checkpoints
+		self.read_ahead = True # Whether loaders read the next batch in the background
+		self.write_queue_size = 1 # Maximum number of batches queued for background checkpoint writes (0 = synchronous)
+		self.n_threads = 1 # Number of threads used by multithreaded kernels (0 = all cores)
 
 	@property
 	def last_h5(self) -> Optional[str]:
@@ -40,11 +40,15 @@ class CSRMatrix:
 	def toarray(self) -> np.ndarray:
 		return self.to_sp().toarray()
 
+	@property
+	def nbytes(self) -> int:
+		return self.data.nbytes + self.indices.nbytes + self.indptr.nbytes
+
 	def get_row_indices(self, row: int) -> npt.NDArray[np.int64]:
 		return self.indices[self.indptr[row]:self.indptr[row + 1]]
 
 	def copy(self) -> 'CSRMatrix':
-		return CSRMatrix(self.data.copy(), self.indices.copy(), self.indptr.copy(), self.shape)
+		return type(self)(self.data.copy(), self.indices.copy(), self.indptr.copy(), self.shape)
 
 	def tuple(self) -> Tuple[np.ndarray, npt.NDArray[np.int64], npt.NDArray[np.int64], Tuple[int, int]]:
 		return (self.data, self.indices, self.indptr, self.shape)
@@ -7,13 +7,19 @@ Other references:
 '''
 
 import pdb
-from typing import Tuple, Optional, Iterator
+from typing import Tuple, Optional, Iterator, Callable
 from dataclasses import dataclass
 import numpy as np
 import numpy.typing as npt
+import scipy.sparse as sp
+from scipy.sparse.csgraph import minimum_spanning_tree, connected_components
+from scipy.spatial import cKDTree
 from scipy.spatial.distance import cdist
 
 from ephys2.lib.types import *
+from ephys2.lib.sparse import CSRMatrix
+from ephys2.lib.groupby import LabelGroups
+from ephys2.lib.singletons import global_state
 import ephys2._cpp
 
 
@@ -21,6 +27,8 @@ import ephys2._cpp
 class SPCTree:
 	cluster: Cluster
 	children: List['SPCTree']
+	count: int = 0 													# Sufficient statistics of the cluster's samples (see summarize())
+	sum: Optional[npt.NDArray[np.float64]] = None
 
 	def __len__(self) -> int:
 		n = 0
@@ -41,11 +49,8 @@ class SPCTree:
 		if labelings.shape[0] == 0:
 			return SPCTree(children=[], cluster=indices)
 		else:
-			labeling = labelings[0]
-			labels = np.unique(labeling)
 			children = []
-			for label in labels:
-				where = labeling == label
+			for where in LabelGroups(labelings[0]).indices():
 				children.append(SPCTree.construct(
 					labelings[1:, where],
 					indices[where]
@@ -55,12 +60,31 @@ class SPCTree:
 				children=children
 			)
 
+	def summarize(self, samples: npt.NDArray):
+		'''
+		Compute the sufficient statistics (count & sum of samples) of every node, bottom-up.
+		Children are assumed to partition their parent's indices.
+		'''
+		for child in self.children:
+			child.summarize(samples)
+		self.count = self.cluster.size
+		if self.is_leaf():
+			self.sum = samples[self.cluster].sum(axis=0, dtype=np.float64)
+		else:
+			self.sum = np.sum([child.sum for child in self.children], axis=0)
+
+	def mean(self) -> npt.NDArray[np.float64]:
+		return self.sum / self.count
+
 	def merge(self, other: 'SPCTree'):
 		'''
 		Merges another tree; assumes the indices are disjoint.
 		'''
 		self.children.extend(other.children)
 		self.cluster = np.concatenate((self.cluster, other.cluster))
+		if not (self.sum is None or other.sum is None):
+			self.count += other.count
+			self.sum = self.sum + other.sum
 
 	def is_leaf(self) -> bool:
 		return self.children == []
@@ -94,15 +118,14 @@ def collapse_tree(tree: SPCTree, cluster_dist_threshold: float, samples: npt.NDA
 	Collapse into a list of clusters. Should be called from the root (temperature=0) node. Mutates the tree.
 	'''
 
-	def cluster_dist(approximator: Cluster, approximatee: Cluster) -> float:
+	def cluster_dist(approximator: SPCTree, approximatee: SPCTree) -> float:
 		'''
 		cluster_dist between a cluster and its proposed approximator; not necessarily symmetric.
 		(lower indicates more similar)
+		For the approximatee's samples xs, |xs - mean(approximator)|^2 - |xs - mean(xs)|^2 = |xs| * |mean(xs) - mean(approximator)|^2,
+		so the distance only depends on the nodes' sufficient statistics.
 		'''
-		xs = samples[approximatee]
-		ys = xs - (samples[approximator].mean(axis=0)) # Distance from approximator average
-		zs = xs - (xs.mean(axis=0)) # Distance from own average
-		return np.sqrt(max(0, np.linalg.norm(ys)**2 - np.linalg.norm(zs)**2)) / samples.shape[1]
+		return np.sqrt(approximatee.count) * np.linalg.norm(approximatee.mean() - approximator.mean()) / M
 
 	def repartition(node: SPCTree) -> List[SPCTree]:
 		'''
@@ -118,7 +141,7 @@ def collapse_tree(tree: SPCTree, cluster_dist_threshold: float, samples: npt.NDA
 		# Extract well-separated clusters
 		for child in node.children:
 			assert child.is_leaf()
-			parent_dist = cluster_dist(node.cluster, child.cluster)
+			parent_dist = cluster_dist(node, child)
 			if parent_dist > cluster_dist_threshold:
 				separated.append(child)
 			else:
@@ -132,7 +155,7 @@ def collapse_tree(tree: SPCTree, cluster_dist_threshold: float, samples: npt.NDA
 		for i, node in enumerate(remaining): # Indexes L_i in step (3b)
 
 			for j, other in enumerate(separated): # Indexes L_j in step (3b)
-				cross_dist = cluster_dist(other.cluster, node.cluster)
+				cross_dist = cluster_dist(other, node)
 				if cross_dist < cross_distances[i]:
 					cross_distances[i] = cross_dist
 					cross_indices[i] = j
@@ -168,6 +191,8 @@ def collapse_tree(tree: SPCTree, cluster_dist_threshold: float, samples: npt.NDA
 		node.children = leaves
 		return repartition(node)
 
+	M = samples.shape[1]
+	tree.summarize(samples)
 	return [node.cluster for node in collapse(tree)]
 
 def cluster_spc_multiround(
@@ -240,11 +265,15 @@ def run_spc(
 		Knn: int, 										# K nearest neighbors to include in neighborhood
 		MSTree: bool=True, 						# Whether to include minimum spanning tree edges 
 		metric: str='euclidean', 			# Metric space (see scipy.spatial.distance.cdist for options)
-		random_seed: Optional[int]=None # Random seed
+		random_seed: Optional[int]=None, # Random seed
+		n_threads: Optional[int]=None # Threads for the temperature sweep (0 = all cores, None = global setting)
 	) -> Tuple[npt.NDArray[float], Labeling]:
 	'''
 	Run super-paramagnetic clustering at a range of temperatures and report the cluster labels.
+	Temperatures are simulated in parallel; the result for a given seed does not depend on n_threads.
 	'''
+	if n_threads is None:
+		n_threads = global_state.n_threads
 	assert Ntemps >= 1
 	assert Tmax >= Tmin
 	if Tmax == Tmin:
@@ -260,18 +289,153 @@ def run_spc(
 	elif N == 1:
 		return np.linspace(Tmin, Tmax, Ntemps), np.array([[0] for _ in range(Ntemps)], dtype=np.int64)
 	else:
-		# Ensure that Knn <= N (otherwise causes invalid array access in SPC)
-		Knn = min(Knn, N)
-		dists = cdist(X, X, metric=metric)
-		(temps, labelings) = ephys2._cpp.super_paramagnetic_clustering(
-			dists,
-			Tmin,
-			Tmax,
-			Tstep,
-			cycles,
-			Knn,
-			MSTree,
-			random_seed
-		)
+		# Ensure that Knn < N (otherwise causes invalid array access in SPC)
+		Knn = min(Knn, N - 1)
+		if metric in TREE_METRICS:
+			graph = neighbor_graph(X, Knn, MSTree, metric)
+			(temps, labelings) = ephys2._cpp.super_paramagnetic_clustering_sparse(
+				graph.indptr,
+				graph.indices,
+				graph.data,
+				Tmin,
+				Tmax,
+				Tstep,
+				cycles,
+				random_seed,
+				n_threads
+			)
+		else:
+			dists = cdist(X, X, metric=metric)
+			(temps, labelings) = ephys2._cpp.super_paramagnetic_clustering(
+				dists,
+				Tmin,
+				Tmax,
+				Tstep,
+				cycles,
+				Knn,
+				MSTree,
+				random_seed,
+				n_threads
+			)
 
 		return (temps, labelings)
+
+'''
+Neighbor graphs
+'''
+
+# Metrics for which neighbors are found by a k-d tree search; others use a dense distance matrix
+TREE_METRICS = ['euclidean', 'cityblock', 'chebyshev', 'cosine', 'correlation', 'mahalanobis']
+SPANNING_TREE_QUERY_SIZE = 256 # Components up to this size are searched in the tree of all samples, larger ones in the tree of their complement
+
+def neighbor_graph(
+		X: npt.NDArray[np.float64], 	# Input data (N_samples, M_features)
+		Knn: int, 										# K nearest neighbors to include in neighborhood
+		MSTree: bool=True, 						# Whether to include minimum spanning tree edges 
+		metric: str='euclidean', 			# Metric space (one of TREE_METRICS)
+	) -> CSRMatrix:
+	'''
+	Construct the SPC neighbor graph (mutual K-nearest neighbors, joined with a minimum spanning tree) without pairwise distances.
+	Returns a symmetric (N, N) matrix of distances between neighbors, with sorted indices.
+	'''
+	N = X.shape[0]
+	assert 0 < Knn < N
+	Y, p, to_metric = tree_metric(X, metric)
+
+	# K nearest neighbors
+	tree = cKDTree(Y)
+	dists, nbrs = tree.query(Y, k=Knn + 1, p=p)
+	keep = nbrs != np.arange(N)[:, None] # Remove samples from their own neighbors (not necessarily first, in case of duplicate samples)
+	keep[keep.all(axis=1), -1] = False
+	nbrs = nbrs[keep].reshape(N, Knn).astype(np.int64)
+	dists = dists[keep].reshape(N, Knn)
+	rows = np.repeat(np.arange(N, dtype=np.int64), Knn)
+	cols = nbrs.ravel()
+
+	# Mutual K nearest neighbors
+	mutual = np.isin(rows * N + cols, cols * N + rows)
+	edges = [(rows[mutual], cols[mutual], dists.ravel()[mutual])]
+
+	if MSTree:
+		u, v, w = spanning_tree(Y, p, tree, nbrs, dists)
+		edges += [(u, v, w), (v, u, w)]
+
+	# Assemble in CSR format
+	rows, cols, dists = (np.concatenate(e) for e in zip(*edges))
+	keys, where = np.unique(rows * N + cols, return_index=True) # Sorts by row, then column
+	indptr = np.searchsorted(keys, np.arange(N + 1, dtype=np.int64) * N).astype(np.int64)
+	return CSRMatrix(to_metric(dists[where]).astype(np.float64), cols[where], indptr, (N, N))
+
+def tree_metric(X: npt.NDArray[np.float64], metric: str) -> Tuple[npt.NDArray[np.float64], float, Callable]:
+	'''
+	Transform samples such that the given metric is (a monotone function of) a Minkowski p-norm.
+	Returns the transformed samples, p, and the map from p-norm distances to metric distances.
+	'''
+	X = X.astype(np.float64)
+	if metric == 'euclidean':
+		return X, 2, lambda d: d
+	elif metric == 'cityblock':
+		return X, 1, lambda d: d
+	elif metric == 'chebyshev':
+		return X, np.inf, lambda d: d
+	elif metric in ['cosine', 'correlation']:
+		Y = X - X.mean(axis=1, keepdims=True) if metric == 'correlation' else X
+		Y = Y / np.linalg.norm(Y, axis=1, keepdims=True)
+		return Y, 2, lambda d: d ** 2 / 2 # |u - v|^2 = 2(1 - u.v) for unit vectors
+	elif metric == 'mahalanobis':
+		VI = np.linalg.inv(np.atleast_2d(np.cov(np.vstack((X, X)).T))) # Same default as scipy.spatial.distance.cdist(X, X)
+		return X @ np.linalg.cholesky(VI), 2, lambda d: d
+	else:
+		raise ValueError(f'Metric {metric} is not supported by tree-based neighbor search')
+
+def spanning_tree(
+		Y: npt.NDArray[np.float64], 
+		p: float, 
+		tree: cKDTree, 
+		nbrs: npt.NDArray[np.int64], 
+		dists: npt.NDArray[np.float64]
+	) -> Tuple[npt.NDArray[np.int64], npt.NDArray[np.int64], npt.NDArray[np.float64]]:
+	'''
+	Minimum spanning tree of the samples (in p-norm) using Boruvka's algorithm. Nearest samples outside of each component 
+	are found in the (N, K) nearest-neighbor lists (nbrs, dists) where possible, falling back to tree queries otherwise.
+	'''
+	N = Y.shape[0]
+	idx = np.arange(N)
+	comps, n_comps = idx.copy(), N
+	u, v, w = [], [], []
+	while n_comps > 1:
+		# Nearest sample outside of each sample's component
+		outside = comps[nbrs] != comps[:, None]
+		found = outside.any(axis=1)
+		first = outside.argmax(axis=1)
+		near_d = np.where(found, dists[idx, first], np.inf)
+		near_j = nbrs[idx, first]
+		best = np.full(n_comps, np.inf)
+		np.minimum.at(best, comps, near_d)
+
+		# Samples whose nearest outside sample lies beyond their K nearest neighbors, yet may be nearer than their component's best
+		missing = np.flatnonzero(~found & (dists[:, -1] < best[comps]))
+		sizes = np.bincount(comps, minlength=n_comps)
+		for size in np.unique(sizes[comps[missing]]):
+			pts = missing[sizes[comps[missing]] == size]
+			if size < SPANNING_TREE_QUERY_SIZE:
+				# At least one of the (size + 1) nearest neighbors lies outside of the component
+				d, j = tree.query(Y[pts], k=size + 1, p=p)
+				first = (comps[j] != comps[pts][:, None]).argmax(axis=1)
+				near_d[pts], near_j[pts] = d[np.arange(pts.size), first], j[np.arange(pts.size), first]
+			else:
+				for c in np.unique(comps[pts]):
+					c_pts = pts[comps[pts] == c]
+					others = np.flatnonzero(comps != c)
+					d, j = cKDTree(Y[others]).query(Y[c_pts], k=1, p=p)
+					near_d[c_pts], near_j[c_pts] = d, others[j]
+
+		# Join each component to its nearest neighboring component
+		order = np.lexsort((near_d, comps))
+		heads = order[np.r_[0, np.flatnonzero(np.diff(comps[order])) + 1]]
+		u.append(heads)
+		v.append(near_j[heads])
+		w.append(near_d[heads])
+		forest = sp.coo_matrix((np.ones(sum(x.size for x in u)), (np.concatenate(u), np.concatenate(v))), shape=(N, N))
+		n_comps, comps = connected_components(forest, directed=False)
+	return np.concatenate(u), np.concatenate(v), np.concatenate(w)
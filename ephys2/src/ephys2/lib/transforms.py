@@ -7,7 +7,8 @@ import numpy as np
 import numpy.typing as npt
 import scipy.stats as stats
 import pywt
-from typing import Optional
+from typing import Optional, Callable
+from functools import lru_cache
 # from cr.sparse import lop
 
 
@@ -78,3 +79,24 @@ def beta_truncated_dwt(X: npt.NDArray[np.float32], wavelet: Optional[str], beta:
 	if wavelet != None:
 		X = truncated_dwt(X, wavelet)
 	return X
+
+'''
+Explicit operators of the linear transforms, for fixed input dimension M.
+Each is an (M, M') matrix A such that transform(X) == X @ A.
+'''
+
+def linear_operator(transform: Callable[[npt.NDArray], npt.NDArray], M: int) -> npt.NDArray[np.float64]:
+	'''
+	Materialize a linear transform of M-dimensional feature vectors by applying it to the identity
+	'''
+	A = transform(np.eye(M, dtype=np.float64))
+	assert A.ndim == 2 and A.shape[0] == M
+	return A
+
+@lru_cache(maxsize=None)
+def beta_weighted_operator(M: int, beta: float) -> npt.NDArray[np.float64]:
+	return linear_operator(lambda X: beta_weighted(X, beta), M)
+
+@lru_cache(maxsize=None)
+def truncated_dwt_operator(M: int, wavelet: str, mode='zero') -> npt.NDArray[np.float64]:
+	return linear_operator(lambda X: truncated_dwt(X, wavelet, mode=mode), M)
@@ -6,9 +6,14 @@ from ast import Assert
 from typing import Dict, List, Callable, Any, Union, NewType, Optional, Tuple
 from abc import ABC, abstractmethod
 import pandas as pd
+import hashlib
+import json
+import math
+import os
 
 from ephys2.lib.mpi import MPI
 from ephys2.lib.singletons import logger
+from ephys2.lib.utils import ephys2_version
 from .batch import *
 from .config import *
 
@@ -67,6 +72,15 @@ class Stage(ABC):
 		'''
 		return '(none)'
 
+	def fingerprint(self) -> JSON:
+		'''
+		Canonical form of the stage configuration, used to detect whether a stage has changed between runs.
+		'''
+		return {
+			key: fingerprint_value(param, self.cfg.get(key))
+			for key, param in sorted(self.parameters().items())
+		}
+
 	@abstractmethod
 	def typecheck(self, input_type: Optional[type]=None) -> Optional[type]:
 		'''
@@ -169,6 +183,21 @@ class Pipeline:
 			) for stage in self.stages
 		]
 
+	def cache_keys(self) -> List[str]:
+		'''
+		Content hash of each stage, chained through all upstream stages:
+			key_i = H(key_{i-1}, name_i, parameters_i, ephys2 version)
+		Two stages with equal keys compute the same result, so e.g. a checkpoint
+		whose key is unchanged since the last run does not need to be recomputed.
+		'''
+		keys = []
+		key = ''
+		for stage in self.stages:
+			content = json.dumps([key, stage.name(), stage.fingerprint(), ephys2_version()], sort_keys=True, default=str)
+			key = hashlib.sha256(content.encode('utf-8')).hexdigest()
+			keys.append(key)
+		return keys
+
 	def typecheck(self, input_type: Optional[type] = None) -> Optional[type]:
 		self._input_type = input_type
 		ty = input_type
@@ -219,6 +248,32 @@ class Pipeline:
 		pipeline.typecheck(input_type)
 		return pipeline
 
+def fingerprint_value(param: Optional[Parameter], val: Any) -> JSON:
+	'''
+	JSON-serializable fingerprint of a validated configuration value.
+	Readable input files contribute their size & modification time, so that replacing them invalidates any cached results.
+	'''
+	if isinstance(val, Pipeline):
+		return [[stage.name(), stage.fingerprint()] for stage in val.stages]
+	elif isinstance(val, Stage):
+		return [val.name(), val.fingerprint()]
+	elif isinstance(val, (list, tuple)):
+		element = param.element if isinstance(param, ListParameter) else param
+		return [fingerprint_value(element, x) for x in val]
+	elif isinstance(val, dict):
+		fields = param.fields if isinstance(param, DictParameter) else dict()
+		return {str(k): fingerprint_value(fields.get(k), v) for k, v in sorted(val.items(), key=lambda kv: str(kv[0]))}
+	elif isinstance(val, (RORangedFilePath, RangedDirectory)):
+		return [fingerprint_value(param, val.path), fingerprint_value(None, val.start), fingerprint_value(None, val.stop)]
+	elif isinstance(val, str) and isinstance(param, ROFileParameter) and os.path.isfile(val):
+		st = os.stat(val)
+		return [val, st.st_size, st.st_mtime_ns]
+	elif isinstance(val, np.generic):
+		return fingerprint_value(param, val.item())
+	elif isinstance(val, float) and not math.isfinite(val):
+		return str(val)
+	return val
+
 '''
 Validation functions
 '''
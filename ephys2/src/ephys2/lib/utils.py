@@ -9,6 +9,10 @@ import numpy.typing as npt
 import uuid
 from itertools import cycle, islice, chain
 import dataclasses
+import importlib.metadata
+import functools
+import hashlib
+import json
 import pdb
 
 def abs_path(fpath: str) -> str:
@@ -17,6 +21,39 @@ def abs_path(fpath: str) -> str:
 	'''
 	return str(Path(fpath).absolute())
 
+@functools.lru_cache(maxsize=None)
+def ephys2_version() -> str:
+	'''
+	Version identifying the code of ephys2: the installed version, suffixed with a hash of the package sources
+	when running from a source tree or an editable install (where the code changes without the version).
+	'''
+	try:
+		dist = importlib.metadata.distribution('ephys2')
+		version = dist.version
+		direct_url = json.loads(dist.read_text('direct_url.json') or '{}')
+		editable = direct_url.get('dir_info', {}).get('editable', False)
+	except importlib.metadata.PackageNotFoundError:
+		version, editable = 'unknown', True
+	if editable:
+		version += '+' + package_source_hash()
+	return version
+
+def package_source_hash() -> str:
+	'''
+	Hash of the Python sources and native extensions of the ephys2 package.
+	'''
+	root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+	h = hashlib.sha256()
+	for dirpath, dirnames, filenames in os.walk(root):
+		dirnames[:] = sorted(d for d in dirnames if d != '__pycache__')
+		for filename in sorted(filenames):
+			if filename.endswith(('.py', '.so', '.pyd')):
+				path = os.path.join(dirpath, filename)
+				h.update(os.path.relpath(path, root).encode('utf-8'))
+				with open(path, 'rb') as file:
+					h.update(file.read())
+	return h.hexdigest()[:16]
+
 def ext_mul(x: float, y: float) -> float:
 	'''
 	Multiply the extended real numbers. (convention: 0 x inf = 0)
@@ -2,11 +2,13 @@
 Base benchmarking stage
 '''
 from typing import Any
+import os
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
 from dataclasses_json import dataclass_json
 
 from ephys2.lib.types import *
+from ephys2.lib.singletons import logger
 
 
 @dataclass_json
@@ -22,7 +24,7 @@ class BenchmarksStage(ReductionStage, ABC):
 		return {
 			'output_file': RWFileParameter(
 				units = None,
-				description = 'Filepath where benchmark results will be written to in JSON format'
+				description = 'Filepath where benchmark results will be written to in JSON format, or appended to if it is a benchmark store (an .h5 path with no file yet, or an existing store; other existing files are written as JSON)'
 			),
 			'method_name': StringParameter(
 				units = None,
@@ -38,11 +40,22 @@ class BenchmarksStage(ReductionStage, ABC):
 		'''
 		Run the benchmark; rank 0 must return the result.
 		'''
+		from .store import BenchmarkStore, is_benchmark_store # Depends on Benchmark
+
 		bd = self.run_benchmark()
 		if self.rank == 0:
-			with open(self.cfg['output_file'], 'w') as file:
+			output_file = self.cfg['output_file']
+			try:
+				if is_benchmark_store(output_file):
+					BenchmarkStore(output_file).append(bd)
+					return
+			except OSError as e: # Includes BlockingIOError when the lock times out
+				# Do not lose the result of a full pipeline run
+				output_file = f'{os.path.splitext(output_file)[0]}.{os.getpid()}.json'
+				logger.warn(f'Could not append to benchmark store ({e}), writing {output_file} instead')
+			with open(output_file, 'w') as file:
 				file.write(bd.to_json())
 				
 	@abstractmethod
 	def run_benchmark(self) -> Benchmark:
-		pass
\ No newline at end of file
+		pass
@@ -10,11 +10,10 @@ from dataclasses import dataclass
 from dataclasses_json import dataclass_json
 import pdb
 
-from ephys2 import _cpp
 from ephys2.lib.types import *
 from ephys2.lib.cluster import *
 from ephys2.lib.singletons import global_metadata, global_state
-from ephys2.lib.h5.utils import binary_search_interval
+from ephys2.lib.seq_align import pair_times
 from ephys2.lib.h5 import *
 from ephys2.lib.utils import safe_divide
 from ephys2.lib.array import *
@@ -41,6 +40,30 @@ class ExtrinsicBenchmark(Benchmark):
 	false_negative_rate: int
 	tag: str = 'ExtrinsicBenchmark'
 
+def add_contingencies(CT: ContingencyTable, gt_labels: npt.NDArray[np.int64], est_labels: npt.NDArray[np.int64]):
+	'''
+	Count the (ground-truth, estimated) label pairs of aligned sequences into a contingency table
+	'''
+	assert gt_labels.shape == est_labels.shape
+	gt_space, gt_inverse = np.unique(gt_labels, return_inverse=True)
+	est_space, est_inverse = np.unique(est_labels, return_inverse=True)
+	counts = np.bincount(gt_inverse * est_space.size + est_inverse, minlength=gt_space.size * est_space.size)
+	for idx in np.flatnonzero(counts):
+		key = (gt_space[idx // est_space.size], est_space[idx % est_space.size])
+		CT[key] = CT.get(key, 0) + counts[idx]
+
+def merge_contingency_tables(CTs1: Dict[str, ContingencyTable], CTs2: Dict[str, ContingencyTable]) -> Dict[str, ContingencyTable]:
+	'''
+	Sum per-channel group contingency tables (an MPI reduction operator)
+	'''
+	CTs = {chgroup: dict(CT) for chgroup, CT in CTs1.items()}
+	for chgroup, CT in CTs2.items():
+		if not (chgroup in CTs):
+			CTs[chgroup] = dict()
+		for key, count in CT.items():
+			CTs[chgroup][key] = CTs[chgroup].get(key, 0) + count
+	return CTs
+
 class ExtrinsicBenchmarksStage(BenchmarksStage):
 	fp_label = -1 # False positive label
 
@@ -72,6 +95,7 @@ class ExtrinsicBenchmarksStage(BenchmarksStage):
 
 	def initialize(self):
 		self.CTs = dict() # Entries of contingency tables - access by [chgroup][(GT unit, est unit)]
+		self.ground_truth = dict() # Ground-truth (time, labels) per chgroup
 
 	def process(self, data: Batch) -> Batch:
 		'''
@@ -83,53 +107,59 @@ class ExtrinsicBenchmarksStage(BenchmarksStage):
 		'''
 		max_dt_samples = math.ceil(self.cfg['max_dt_ground_truth'] * global_metadata['sampling_rate'] / 1000)
 
-		with h5py.File(self.cfg['ground_truth_data'], 'r') as gt_file:
-			assert gt_file.attrs['tag'] == 'LTMultiBatch'
-			for item_id, est_item in data.items.items():
-
-				# Map labels into the linked domain, if needed
-				est_labels = est_item.labels
-				if issubclass(self.input_type(), LLVMultiBatch):
-					est_labels = link_labels(est_labels, est_item.linkage)
+		for item_id, est_item in data.items.items():
+
+			# Map labels into the linked domain, if needed
+			est_labels = est_item.labels
+			if issubclass(self._input_type, LLVMultiBatch):
+				est_labels = link_labels(est_labels, est_item.linkage)
+
+			# Initialize local state
+			if not (item_id in self.CTs):
+				self.CTs[item_id] = dict()
+
+			# Pair the ground-truth and estimated sequences in one merge
+			gt_times, gt_labels = self.ground_truth_interval(item_id, est_item.time)
+			gt_idxs, est_idxs, gt_unmatched, est_unmatched = pair_times(gt_times, est_item.time, max_dt_samples)
+			gt_aligned = np.concatenate((
+				gt_labels[gt_idxs], 
+				gt_labels[gt_unmatched], 
+				np.full(np.count_nonzero(est_unmatched), self.fp_label, dtype=np.int64), # Label for missing data in ground-truth
+			))
+			est_aligned = np.concatenate((
+				est_labels[est_idxs], 
+				np.full(np.count_nonzero(gt_unmatched), self.fp_label, dtype=np.int64), # Label for missing data in estimated
+				est_labels[est_unmatched],
+			))
+			# Update pairwise contingency entries
+			add_contingencies(self.CTs[item_id], gt_aligned, est_aligned)
 
-				# Initialize local state
-				if not (item_id in self.CTs):
-					self.CTs[item_id] = dict()
+		return data
 
-				# Compute aligned ground-truth interval
+	def ground_truth_interval(self, item_id: str, time: npt.NDArray[np.int64]) -> Tuple[npt.NDArray[np.int64], npt.NDArray[np.int64]]:
+		'''
+		Ground-truth spikes aligned to a batch spanning `time`.
+		The ground-truth of a channel group is read once per worker; spike trains are small compared to the data.
+		'''
+		if not (item_id in self.ground_truth):
+			with h5py.File(self.cfg['ground_truth_data'], 'r') as gt_file:
+				assert gt_file.attrs['tag'] == 'LTMultiBatch'
 				gt_chdir = gt_file[item_id]
-				if (gt_chdir['time'].shape[0] > 0) and (est_item.size > 0):
-					start_idx, _  = binary_search_interval(gt_chdir['time'], est_item.time[0])
-					_, stop_idx = binary_search_interval(gt_chdir['time'], est_item.time[-1])
-					gt_times = gt_chdir['time'][start_idx:stop_idx]
-					gt_labels = gt_chdir['labels'][start_idx:stop_idx]
-				else:
-					gt_times = np.array([], dtype=np.int64)
-					gt_labels = np.array([], dtype=np.int64)
-				# Align the ground-truth and estimated sequences
-				aligned_labels = _cpp.align_sequences(
-					gt_times,
-					est_item.time,
-					gt_labels,
-					est_labels,
-					max_dt_samples,
-					self.fp_label, # Label for missing data in ground-truth or estimated
-				)
-				pairs, counts = np.unique(aligned_labels, axis=0, return_counts=True)
-				# Update pairwise contingency entries
-				for (gt_lbl, est_lbl), count in zip(pairs, counts):
-					key = (gt_lbl, est_lbl)
-					if not (key in self.CTs[item_id]):
-						self.CTs[item_id][key] = 0
-					self.CTs[item_id][key] += count
+				self.ground_truth[item_id] = (gt_chdir['time'][:], gt_chdir['labels'][:])
+		gt_times, gt_labels = self.ground_truth[item_id]
 
-		return data
+		if (gt_times.size > 0) and (time.size > 0):
+			# Same convention as binary_search_interval() on the ground-truth file
+			start_idx, _ = search_interval(gt_times, time[0])
+			_, stop_idx = search_interval(gt_times, time[-1])
+			return gt_times[start_idx:stop_idx], gt_labels[start_idx:stop_idx]
+		else:
+			return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
 
 	def run_benchmark(self) -> ExtrinsicBenchmark:
-		all_CTs = self.comm.gather(self.CTs, root=0)
+		CTs = self.comm.reduce(self.CTs, op=merge_contingency_tables, root=0) # Contingency tables
 
 		if self.rank == 0:
-			CTs = all_CTs[0]  # Contingency tables
 			CMs = dict()      # Confusion matrices
 			MCMs = dict()     # Matched confusion matrices
 			N_fp = 0
@@ -137,14 +167,7 @@ class ExtrinsicBenchmarksStage(BenchmarksStage):
 			N_gt = 0
 			N_est = 0
 
-			# All CTs have the same outer structure; merge them
 			for chgroup in CTs:
-				for CTs_ in all_CTs[1:]:
-					for key in CTs_[chgroup]:
-						if not (key in CTs[chgroup]):
-							CTs[chgroup][key] = 0
-						CTs[chgroup][key] += CTs_[chgroup][key]
-
 				# Convert to confusion matrices
 				CMs[chgroup], MCMs[chgroup], fps, fns, gts, ests = optimal_confusion_matrix(CTs[chgroup], self.fp_label)
 				N_fp += fps
@@ -1,11 +1,11 @@
 '''
 Intrinsic benchmarking metrics (without ground-truth data)
 '''
-from dataclasses import dataclass
+from typing import Optional
 import numpy as np
 from sklearn.decomposition import PCA
 from sklearn.neighbors import NearestNeighbors
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from dataclasses_json import dataclass_json
 import h5py
 
@@ -16,6 +16,7 @@ from ephys2.lib.utils import *
 from ephys2.lib.transforms import *
 from ephys2.lib.singletons import global_metadata, global_state
 from ephys2.lib.metrics import *
+from ephys2.lib.groupby import LabelGroups
 
 from .base import *
 
@@ -28,7 +29,7 @@ class UnitBenchmark:
 	firing_rate_statistics: SummaryStats
 	peak_statistics: SummaryStats
 	snr_statistics: SummaryStats
-	# nn_isolation_statistics: SummaryStats
+	nn_isolation_statistics: Optional[SummaryStats] = None # Absent in benchmarks from earlier versions
 
 @dataclass_json
 @dataclass
@@ -44,6 +45,41 @@ class IntrinsicBenchmark(Benchmark):
 	chgroups: Dict[str, ChGroupBenchmark]
 	tag: str = 'IntrinsicBenchmark'
 
+@dataclass
+class UnitStats:
+	'''
+	Per-unit statistics accumulated over blocks; mergeable across workers.
+	'''
+	n_blocks_present: int = 0
+	n_samples: int = 0
+	n_isi_violations: int = 0
+	n_amp_violations: int = 0
+	firing_rate: List[float] = field(default_factory=list) # Per-block values
+	peak: List[float] = field(default_factory=list)
+	snr: List[float] = field(default_factory=list)
+	nn_isolation: List[float] = field(default_factory=list)
+
+	def merge(self, other: 'UnitStats'):
+		self.n_blocks_present += other.n_blocks_present
+		self.n_samples += other.n_samples
+		self.n_isi_violations += other.n_isi_violations
+		self.n_amp_violations += other.n_amp_violations
+		self.firing_rate.extend(other.firing_rate)
+		self.peak.extend(other.peak)
+		self.snr.extend(other.snr)
+		self.nn_isolation.extend(other.nn_isolation)
+
+	def benchmark(self, n_blocks: int) -> UnitBenchmark:
+		return UnitBenchmark(
+			presence_ratio = safe_divide(self.n_blocks_present, n_blocks, 0),
+			isi_violation = safe_divide(self.n_isi_violations, self.n_samples, 0),
+			amp_violation = safe_divide(self.n_amp_violations, self.n_samples, 0),
+			firing_rate_statistics = SummaryStats.from_array(self.firing_rate),
+			peak_statistics = SummaryStats.from_array(self.peak),
+			snr_statistics = SummaryStats.from_array(self.snr),
+			nn_isolation_statistics = SummaryStats.from_array(self.nn_isolation)
+		)
+
 
 class IntrinsicBenchmarksStage(BenchmarksStage):
 	full_check: bool = False
@@ -104,18 +140,25 @@ class IntrinsicBenchmarksStage(BenchmarksStage):
 				stop = np.inf,
 				units = 'samples',
 				description = 'Maximum number of nearest-neighbors to use in isolation quality calculation. Higher means lower scores.'
-			)
+			),
+			'max_unit_samples': IntParameter(
+				start = 2,
+				stop = np.inf,
+				units = 'samples',
+				description = 'Maximum number of samples per unit (per batch) among which nearest-neighbors are searched in the isolation quality calculation. Higher is more accurate but slower.'
+			),
 		}
 
 	def initialize(self):
 		self.chgroups = dict() # Per-channel group benchmark info
-		self.PCA = PCA(n_components=self.cfg['n_components'], svd_solver='randomized', random_state=self.random_seed)
-		self.KNN = NearestNeighbors(algorithm='ball_tree')
+		self.feature_operators = dict() # Fused linear feature transform per waveform length
+		self.rng = np.random.default_rng(self.random_seed)
 
 	def process(self, data: Batch) -> Batch:
 		'''
 		Compute benchmark data per-block
 		'''
+		fs = global_metadata['sampling_rate']
 		for item_id, item in data.items.items():
 			assert item.overlap == 0, 'Do not pass overlapping data to benchmarking stage'
 
@@ -131,42 +174,51 @@ class IntrinsicBenchmarksStage(BenchmarksStage):
 					'n_units': [],
 					'units': dict(),
 				}
-			self.chgroups[item_id]['n_blocks'] += 1
-			self.chgroups[item_id]['n_units'].append(np.unique(labels).size)
-
-			# Compute per-block metrics
-			X = self.feature_transform(item.data)
-			assert X.shape[0] == item.data.shape[0]
-			if X.shape[0] > 0:
-				self.KNN.fit(X)
+			chgroup = self.chgroups[item_id]
+			groups = LabelGroups(labels)
+			chgroup['n_blocks'] += 1
+			chgroup['n_units'].append(groups.size)
+			isolation = self.nn_isolation(item.data, groups)
 
 			# Compute per-unit metrics
-			for label in np.unique(labels):
-				if not label in self.chgroups[item_id]['units']:
-					self.chgroups[item_id]['units'][label] = {
-						'n_blocks_present': 0,
-						'n_samples': 0,
-						'n_isi_violations': 0,
-						'n_amp_violations': 0,
-						'firing_rate': [],
-						'peak': [],
-						'snr': [],
-						# 'nn_isolation': [],
-					}
-				unit_time = item.time[labels == label]
-				unit_data = item.data[labels == label]
-				self.chgroups[item_id]['units'][label]['n_blocks_present'] += 1
-				self.chgroups[item_id]['units'][label]['n_samples'] += unit_time.size
-				self.chgroups[item_id]['units'][label]['n_isi_violations'] += n_isi_violations(unit_time, global_metadata['sampling_rate'], self.cfg['refractory_period'])
-				self.chgroups[item_id]['units'][label]['n_amp_violations'] += n_amp_violations(unit_data, self.cfg['amplitude_cutoff'])
-				self.chgroups[item_id]['units'][label]['firing_rate'].append(firing_rate(unit_time, global_metadata['sampling_rate']))
+			for k, (label, unit_time, unit_data) in enumerate(zip(groups.labels, groups.split(item.time), groups.split(item.data))):
+				if not label in chgroup['units']:
+					chgroup['units'][label] = UnitStats()
+				unit = chgroup['units'][label]
+				unit.n_blocks_present += 1
+				unit.n_samples += unit_time.size
+				unit.n_isi_violations += n_isi_violations(unit_time, fs, self.cfg['refractory_period'])
+				unit.n_amp_violations += n_amp_violations(unit_data, self.cfg['amplitude_cutoff'])
+				unit.firing_rate.append(firing_rate(unit_time, fs))
 				peak, snr = avg_peak_amplitude_and_snr(unit_data)
-				self.chgroups[item_id]['units'][label]['peak'].append(peak)
-				self.chgroups[item_id]['units'][label]['snr'].append(snr)
-				# self.chgroups[item_id]['units'][label]['nn_isolation'].append(knn_isolation(self.KNN, X[labels == label], label, labels, self.cfg['knn']))
+				unit.peak.append(peak)
+				unit.snr.append(snr)
+				if not (isolation is None):
+					unit.nn_isolation.append(isolation[k])
 
 		return data
 
+	def nn_isolation(self, X: npt.NDArray[np.float32], groups: LabelGroups) -> Optional[npt.NDArray[np.float64]]:
+		'''
+		Per-unit nearest-neighbor isolation (see knn_isolation()): the fraction of each sample's k nearest neighbors in the block
+		sharing its label, averaged per unit. Neighbors are searched among at most max_unit_samples random samples of each unit, 
+		so the cost per block is bounded by the number of units rather than the number of samples.
+		'''
+		# Subsample each unit by a random ranking within the unit
+		order = np.lexsort((self.rng.random(groups.inverse.size), groups.inverse))
+		rank = np.arange(order.size) - groups.offsets[groups.inverse[order]]
+		sample = np.sort(order[rank < self.cfg['max_unit_samples']])
+		k = min(self.cfg['knn'], sample.size - 1)
+		if k < 1:
+			return None
+
+		sample_groups = groups.inverse[sample]
+		X = self.feature_transform(X[sample])
+		KNN = NearestNeighbors(n_neighbors=k + 1, n_jobs=global_state.n_threads or -1).fit(X)
+		neighbors = KNN.kneighbors(X, return_distance=False)[:, 1:] # Exclude the sample itself
+		same = (sample_groups[neighbors] == sample_groups[:, np.newaxis]).mean(axis=1)
+		return np.bincount(sample_groups, weights=same, minlength=groups.size) / np.bincount(sample_groups, minlength=groups.size)
+
 	def run_benchmark(self) -> IntrinsicBenchmark:
 		'''
 		Summarize per-block benchmarks into statistics
@@ -196,28 +248,12 @@ class IntrinsicBenchmarksStage(BenchmarksStage):
 					chgroups[item_id]['n_blocks'] += chgroup['n_blocks']
 					chgroups[item_id]['n_units'].extend(chgroup['n_units'])
 
-					for unit, unit_data in chgroup['units'].items():
+					for unit, unit_stats in chgroup['units'].items():
 						# Do not compute benchmarks for excluded units
 						if not (unit in exc_units[item_id]):
 							if not (unit in chgroups[item_id]['units']):
-								chgroups[item_id]['units'][unit] = {
-									'n_blocks_present': 0,
-									'n_samples': 0,
-									'n_isi_violations': 0,
-									'n_amp_violations': 0,
-									'firing_rate': [],
-									'peak': [],
-									'snr': [],
-									# 'nn_isolation': [],
-								}
-							chgroups[item_id]['units'][unit]['n_blocks_present'] += unit_data['n_blocks_present']
-							chgroups[item_id]['units'][unit]['n_samples'] += unit_data['n_samples']
-							chgroups[item_id]['units'][unit]['n_isi_violations'] += unit_data['n_isi_violations']
-							chgroups[item_id]['units'][unit]['n_amp_violations'] += unit_data['n_amp_violations']
-							chgroups[item_id]['units'][unit]['firing_rate'].extend(unit_data['firing_rate'])
-							chgroups[item_id]['units'][unit]['peak'].extend(unit_data['peak'])
-							chgroups[item_id]['units'][unit]['snr'].extend(unit_data['snr'])
-							# chgroups[item_id]['units'][unit]['nn_isolation'].extend(unit_data['nn_isolation'])
+								chgroups[item_id]['units'][unit] = UnitStats()
+							chgroups[item_id]['units'][unit].merge(unit_stats)
 
 			return IntrinsicBenchmark(
 				method = self.cfg['method_name'],
@@ -225,25 +261,30 @@ class IntrinsicBenchmarksStage(BenchmarksStage):
 				chgroups = {
 					item_id: ChGroupBenchmark(
 						n_blocks = chgroup['n_blocks'],
-						presence_ratio_statistics = SummaryStats.from_array([safe_divide(unit_data['n_blocks_present'], chgroup['n_blocks'], 0) for unit_data in chgroup['units'].values()]),
+						presence_ratio_statistics = SummaryStats.from_array([safe_divide(unit_stats.n_blocks_present, chgroup['n_blocks'], 0) for unit_stats in chgroup['units'].values()]),
 						n_units_statistics = SummaryStats.from_array(chgroup['n_units']),
 						units = {
-							int(unit): UnitBenchmark(
-								presence_ratio = safe_divide(unit_data['n_blocks_present'], chgroup['n_blocks'], 0),
-								isi_violation = safe_divide(unit_data['n_isi_violations'], unit_data['n_samples'], 0),
-								amp_violation = safe_divide(unit_data['n_amp_violations'], unit_data['n_samples'], 0),
-								firing_rate_statistics = SummaryStats.from_array(unit_data['firing_rate']),
-								peak_statistics = SummaryStats.from_array(unit_data['peak']),
-								snr_statistics = SummaryStats.from_array(unit_data['snr']),
-								# nn_isolation_statistics = SummaryStats.from_array(unit_data['nn_isolation'])
-							)
-							for unit, unit_data in chgroup['units'].items()
+							int(unit): unit_stats.benchmark(chgroup['n_blocks'])
+							for unit, unit_stats in chgroup['units'].items()
 						}
 					)
 					for item_id, chgroup in chgroups.items()
 				}
 			)
 
+	def feature_operator(self, M: int) -> npt.NDArray[np.float32]:
+		'''
+		Beta weighting and truncated DWT of individual waveforms fused into a single (M, M') projection
+		'''
+		if not (M in self.feature_operators):
+			A = np.eye(M)
+			if self.cfg['beta'] > 1:
+				A = beta_weighted_operator(M, self.cfg['beta'])
+			if self.cfg['wavelet'] != 'none':
+				A = A @ truncated_dwt_operator(M, self.cfg['wavelet'])
+			self.feature_operators[M] = A.astype(np.float32)
+		return self.feature_operators[M]
+
 	def feature_transform(self, X: npt.NDArray[np.float32]) -> npt.NDArray[np.float32]:
 		'''
 		Apply same feature transform to data used in isosplit_segfuse
@@ -251,16 +292,8 @@ class IntrinsicBenchmarksStage(BenchmarksStage):
 		C = self.cfg['n_channels']
 		N = X.shape[0]
 		M = X.shape[1] // C
-		X = X.reshape((N, C, M)).reshape((N * C, M)) # Reshape to individual waveforms
-		wvt = None if self.cfg['wavelet'] == 'none' else self.cfg['wavelet']
-		X = beta_truncated_dwt(X, wvt, self.cfg['beta'])
-		M = X.shape[1] # Account for possible dimensionality reduction
-		X = X.reshape((N, C, M)).reshape((N, C * M)) # Reshape back to concatenated form
-		k = min(X.shape)
+		X = (X.reshape((N * C, M)) @ self.feature_operator(M)).reshape((N, -1)) # Transform individual waveforms
+		k = min(min(X.shape), self.cfg['n_components'])
 		if k == 0:
-			return X[:, :C * M]
-		elif k < self.cfg['n_components']:
-			return PCA(n_components=k, svd_solver='randomized', random_state=self.random_seed).fit_transform(X)
-		else:
-			return self.PCA.fit_transform(X)
-
+			return X
+		return PCA(n_components=k, svd_solver='randomized', random_state=self.random_seed).fit_transform(X)
@@ -0,0 +1,195 @@
+'''
+Columnar store of benchmark results
+
+A single HDF5 file holding one row per benchmark run, so that sweeps append to one file rather than writing
+thousands of JSON files, and viewers read only the rows and columns they display:
+
+	/keys/<tag|dataset|method>/categories 	(K,) strings 		Distinct values of a key column
+	/keys/<tag|dataset|method>/codes 				(N,) int32 			Index into categories, per row
+	/metrics/<name> 												(N,) float64 		Scalar fields of the benchmark (NaN where absent)
+	/json 																	(N,) strings 		The full serialized benchmark
+
+N is the attribute n_rows, which an append writes last; anything beyond row N (or beyond the last category referenced
+by a code) was left by an interrupted append, and is ignored by readers and overwritten by the next append.
+Concurrent appends are serialized by an exclusive lock file next to the store.
+'''
+from typing import Callable, Dict, List, Optional
+from contextlib import contextmanager
+import os
+import time
+import numpy as np
+import numpy.typing as npt
+import h5py
+
+from .base import *
+
+KEY_COLUMNS = ['tag', 'dataset', 'method']
+STR_DTYPE = h5py.string_dtype()
+LOCK_TIMEOUT = 120 	# Seconds to wait for the store to become available
+LOCK_RETRY = 0.1 		# Seconds between attempts
+HDF5_SIGNATURE = b'\x89HDF\r\n\x1a\n'
+
+def is_benchmark_store(path: str) -> bool:
+	'''
+	Whether path is a benchmark store: an .h5 file tagged 'BenchmarkStore', or an .h5 path with no file yet (which the first append creates).
+	Other existing files, such as JSON results previously written under an .h5 name, are not stores.
+	'''
+	if not path.endswith('.h5'):
+		return False
+	if not os.path.isfile(path) or os.path.getsize(path) == 0:
+		return True
+	with open(path, 'rb') as file:
+		if file.read(len(HDF5_SIGNATURE)) != HDF5_SIGNATURE:
+			return False
+	with BenchmarkStore(path).open('r') as file:
+		# A store whose first append was interrupted may be empty and untagged
+		return file.attrs.get('tag', 'BenchmarkStore' if len(file) == 0 else None) == 'BenchmarkStore'
+
+class BenchmarkStore:
+
+	def __init__(self, path: str, timeout: float=LOCK_TIMEOUT):
+		self.path = path
+		self.timeout = timeout
+
+	def append(self, benchmark: Benchmark):
+		'''
+		Append one benchmark as a new row; the row is committed only once all of its columns are written.
+		'''
+		row = benchmark.to_dict()
+		metrics = {
+			name: float(value) for name, value in row.items()
+			if isinstance(value, (int, float)) and not isinstance(value, bool)
+		}
+		with self.lock(), self.open('a') as file:
+			file.attrs['tag'] = 'BenchmarkStore'
+			N = file.attrs.get('n_rows', 0)
+			for key in KEY_COLUMNS:
+				kdir = file.require_group(f'keys/{key}')
+				categories = read_categories(kdir, N)
+				if not (row[key] in categories):
+					append_column(kdir, 'categories', len(categories), np.array([row[key]], dtype=object), STR_DTYPE, None)
+					categories.append(row[key])
+				append_column(kdir, 'codes', N, np.array([categories.index(row[key])], dtype=np.int32), np.int32, -1)
+			mdir = file.require_group('metrics')
+			for name in set(mdir.keys()) | set(metrics.keys()):
+				append_column(mdir, name, N, np.array([metrics.get(name, np.nan)]), np.float64, np.nan)
+			append_column(file, 'json', N, np.array([benchmark.to_json()], dtype=object), STR_DTYPE, None)
+			file.attrs['n_rows'] = N + 1
+
+	@property
+	def size(self) -> int:
+		with self.open('r') as file:
+			return int(file.attrs.get('n_rows', 0))
+
+	def categories(self, key: str) -> List[str]:
+		'''
+		Distinct values of a key column (tag, dataset or method), in order of appearance.
+		'''
+		assert key in KEY_COLUMNS
+		with self.open('r') as file:
+			if f'keys/{key}' in file:
+				return read_categories(file[f'keys/{key}'], file.attrs.get('n_rows', 0))
+			return []
+
+	def select(self, **keys: str) -> npt.NDArray[np.int64]:
+		'''
+		Rows (in ascending order) matching all of the given key column values, e.g. select(dataset='d1', tag='ExtrinsicBenchmark').
+		'''
+		with self.open('r') as file:
+			N = file.attrs.get('n_rows', 0)
+			mask = np.ones(N, dtype=bool)
+			for key, value in keys.items():
+				assert key in KEY_COLUMNS
+				if mask.size > 0:
+					categories = read_categories(file[f'keys/{key}'], N)
+					code = categories.index(value) if value in categories else -1
+					mask &= file[f'keys/{key}/codes'][:N] == code
+		return np.flatnonzero(mask)
+
+	def metrics(self, rows: npt.NDArray[np.int64], names: Optional[List[str]]=None) -> Dict[str, npt.NDArray[np.float64]]:
+		'''
+		Read scalar metric columns for the given rows.
+		'''
+		with self.open('r') as file:
+			if not ('metrics' in file):
+				return dict()
+			N = file.attrs.get('n_rows', 0)
+			names = list(file['metrics'].keys()) if names is None else names
+			return {name: file[f'metrics/{name}'][:N][rows] for name in names}
+
+	def load(self, rows: npt.NDArray[np.int64]) -> List[Benchmark]:
+		'''
+		Deserialize the full benchmarks of the given rows.
+		'''
+		types = {cls.__name__: cls for cls in Benchmark.__subclasses__()}
+		rows = np.sort(np.asarray(rows, dtype=np.int64))
+		with self.open('r') as file:
+			if rows.size == 0:
+				return []
+			tags = file['keys/tag/categories'].asstr()[:]
+			codes = file['keys/tag/codes'][rows]
+			jsons = file['json'].asstr()[rows]
+		return [types[tags[code]].from_json(js) for code, js in zip(codes, jsons)]
+
+	def open(self, mode: str) -> h5py.File:
+		'''
+		Open the store, retrying while another process holds HDF5's file lock.
+		'''
+		return retry_until(lambda: h5py.File(self.path, mode), OSError, self.timeout)
+
+	@contextmanager
+	def lock(self):
+		'''
+		Exclusive lock on the store between processes, for the duration of a write.
+		'''
+		with open(self.path + '.lock', 'a') as lockfile:
+			try:
+				import fcntl
+				acquire = lambda: fcntl.flock(lockfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+				release = lambda: fcntl.flock(lockfile, fcntl.LOCK_UN)
+				busy = BlockingIOError
+			except ImportError: # Windows: lock the first byte of the lock file
+				import msvcrt
+				lockfile.seek(0)
+				acquire = lambda: msvcrt.locking(lockfile.fileno(), msvcrt.LK_NBLCK, 1)
+				release = lambda: msvcrt.locking(lockfile.fileno(), msvcrt.LK_UNLCK, 1)
+				busy = OSError
+			retry_until(acquire, busy, self.timeout)
+			try:
+				yield
+			finally:
+				release()
+
+def retry_until(fn: Callable, exc_type: type, timeout: float):
+	'''
+	Call fn until it does not raise exc_type, for at most timeout seconds.
+	'''
+	deadline = time.monotonic() + timeout
+	while True:
+		try:
+			return fn()
+		except exc_type:
+			if time.monotonic() > deadline:
+				raise
+			time.sleep(LOCK_RETRY)
+
+def read_categories(kdir: h5py.Group, N: int) -> List[str]:
+	'''
+	Categories of a key column referenced by its first N codes (categories are appended in order of first appearance).
+	'''
+	if not ('categories' in kdir) or N == 0:
+		return []
+	K = kdir['codes'][:N].max() + 1
+	return kdir['categories'].asstr()[:K].tolist()
+
+def append_column(h5dir: h5py.Group, name: str, N: int, values: npt.NDArray, dtype: type, fill_value):
+	'''
+	Append values to a resizable 1-D column at row N, creating it (filled with fill_value up to N) if absent.
+	Rows beyond N (from an interrupted append) are overwritten.
+	'''
+	if not (name in h5dir):
+		h5dir.create_dataset(name, shape=(N,), maxshape=(None,), chunks=(1024,), dtype=dtype, fillvalue=fill_value)
+	ds = h5dir[name]
+	assert ds.shape[0] >= N, f'Column {name} has {ds.shape[0]} rows, expected at least {N}'
+	ds.resize(N + values.size, axis=0)
+	ds[N:] = values
@@ -16,11 +16,12 @@ import math
 import time
 from typing import Union, Dict
 import json
+import shortuuid
 
 from ephys2.lib.mpi import MPI
 from ephys2.lib.types import *
 from ephys2.lib.utils import ext_mul
-from ephys2.lib.singletons import logger, global_state
+from ephys2.lib.singletons import logger, global_state, global_metadata
 from ephys2.lib.loader import *
 from ephys2.lib.h5 import *
 from ephys2.lib.distribution import WorkerDistribution
@@ -29,6 +30,12 @@ class CheckpointStage(ProcessingStage, ProducerStage):
 	'''
 	Enforces a barrier-like serialization mechanism
 	'''
+	# Content hash of the computation producing this checkpoint, and those of the checkpoints before it (see Pipeline.cache_keys())
+	cache_key: Optional[str] = None
+	upstream_cache_keys: Tuple[str, ...] = ()
+	# Whether this checkpoint is read from an existing up-to-date file rather than recomputed
+	resumed: bool = False
+
 	@staticmethod
 	def name() -> str:
 		return 'checkpoint'
@@ -76,20 +83,14 @@ class CheckpointStage(ProcessingStage, ProducerStage):
 		if self.cfg['batch_overlap'] >= self.cfg['batch_size']:
 			raise ValueError(f"Batch overlap ({self.cfg['batch_overlap']}) must be less than batch size ({self.cfg['batch_size']})")
 
-		# Serializer 
-		self.serializer = {
-			SBatch: H5SBatchSerializer,
-			VMultiBatch: H5VMultiBatchSerializer,
-			LVMultiBatch: H5LVMultiBatchSerializer,
-			LLVMultiBatch: H5LLVMultiBatchSerializer,
-			SLLVMultiBatch: H5SLLVMultiBatchSerializer,
-			LTMultiBatch: H5LTMultiBatchSerializer,
-		}[self._input_type](
-			full_check=global_state.debug, 
-			rank=self.rank, 
-			n_workers=self.n_workers
-		)
-		self.serializer.initialize(self.cfg['file'])
+		if self.resumed:
+			# The file already holds our results; recover the state which serialize() would have left behind
+			global_state.last_h5 = self.cfg['file']
+			with h5py.File(self.cfg['file'], 'r') as h5file:
+				if 'metadata' in h5file.attrs:
+					global_metadata.read_from_string(h5file.attrs['metadata'])
+		else:
+			self.initialize_serializer()
 
 		# Loader
 		self.loader = {
@@ -113,6 +114,39 @@ class CheckpointStage(ProcessingStage, ProducerStage):
 		self.has_written = False
 		self.checked_worker_distribution = False
 		self.checked_data_file = None  # Track which file we've already checked
+
+	def initialize_serializer(self):
+		self.serializer = {
+			SBatch: H5SBatchSerializer,
+			VMultiBatch: H5VMultiBatchSerializer,
+			LVMultiBatch: H5LVMultiBatchSerializer,
+			LLVMultiBatch: H5LLVMultiBatchSerializer,
+			SLLVMultiBatch: H5SLLVMultiBatchSerializer,
+			LTMultiBatch: H5LTMultiBatchSerializer,
+		}[self._input_type](
+			full_check=global_state.debug, 
+			rank=self.rank, 
+			n_workers=self.n_workers
+		)
+		self.serializer.initialize(self.cfg['file'])
+
+		# Writes are handed to a background thread, overlapping them with the computation of subsequent batches
+		if global_state.write_queue_size > 0:
+			self.writer = H5AsyncWriter(self.serializer, global_state.write_queue_size)
+		else:
+			self.writer = self.serializer
+
+	def is_up_to_date(self) -> bool:
+		'''
+		Whether the checkpoint file already contains the result of the computation identified by self.cache_key.
+		'''
+		if self.cache_key is None or not os.path.isfile(self.cfg['file']):
+			return False
+		try:
+			with h5py.File(self.cfg['file'], 'r') as h5file:
+				return self.cache_key in json.loads(h5file.attrs.get('cache_keys', '[]'))
+		except OSError:
+			return False # Unreadable (e.g. partially written) files are recomputed
 		
 	def get_batch_size(self, data: Batch) -> Union[int, Dict[str, int]]:
 		"""
@@ -168,7 +202,7 @@ class CheckpointStage(ProcessingStage, ProducerStage):
 			self.total_data_size += batch_size
 			
 		# Write the data
-		self.serializer.write(data)
+		self.writer.write(data)
 	
 	def check_all_workers_got_data(self):
 		"""
@@ -208,6 +242,10 @@ class CheckpointStage(ProcessingStage, ProducerStage):
 		'''
 		Workers serialize the results from the temporary files using Parallel HDF5. Makes two calls to MPI Barrier to isolate writes and subsequent reads.
 		'''	
+		# Drain any queued writes
+		if isinstance(self.writer, H5AsyncWriter):
+			self.writer.close()
+
 		# Before serializing, make sure temp files exist for all workers who have written data
 		all_has_written = self.comm.gather(self.has_written, root=0)
 		all_sizes = self.comm.gather(self.total_data_size, root=0)
@@ -272,6 +310,16 @@ class CheckpointStage(ProcessingStage, ProducerStage):
 						
 						h5file.attrs['batch_size'] = self.cfg['batch_size'] 
 						h5file.attrs['batch_overlap'] = self.cfg['batch_overlap']
+						h5file.attrs['generation'] = shortuuid.uuid() # Invalidates data cached from previous versions of this file (see H5Cache)
+
+						# Sparse per-item time indices for fast range lookups (see binary_search_interval())
+						write_time_indices(h5file)
+
+						# Record the content hash last, so that only completely written checkpoints are reused.
+						# Checkpoints written into the same file upstream of this one remain valid.
+						if self.cache_key is not None:
+							cache_keys = [k for k in json.loads(h5file.attrs.get('cache_keys', '[]')) if k in self.upstream_cache_keys]
+							h5file.attrs['cache_keys'] = json.dumps(cache_keys + [self.cache_key])
 						logger.debug(f"Saved metadata: total_size={self.total_size_to_save}")
 				except Exception as e:
 					logger.warn(f"Error saving total_size metadata: {str(e)}")
@@ -280,6 +328,7 @@ class CheckpointStage(ProcessingStage, ProducerStage):
 			
 			# Ensure all processes have finished writing before any start reading
 			self.comm.Barrier()
+			H5LLVBatchSerializer.memoized_links.invalidate(self.cfg['file'])
 			
 			# Add a small delay to ensure file handles are fully released
 			time.sleep(0.1)
@@ -290,7 +339,7 @@ class CheckpointStage(ProcessingStage, ProducerStage):
 		finally:
 			# Always attempt to clean up temporary files
 			try:
-				self.serializer.cleanup()
+				self.serializer.cleanup(background=True) # Subsequent stages never read the temporary files
 				logger.debug(f"Worker {self.rank}: Cleanup complete")
 			except Exception as e:
 				logger.error(f"Worker {self.rank}: Error during cleanup: {str(e)}")
@@ -8,7 +8,7 @@ import numpy as np
 import yaml
 
 from ephys2.lib.types import *
-from ephys2.lib.singletons import global_timer, logger, profiler
+from ephys2.lib.singletons import global_timer, logger, profiler, global_state
 from ephys2.lib.mpi import MPI
 
 from .stages import ALL_STAGES
@@ -33,6 +33,8 @@ def eval_pipeline(pipeline: Pipeline):
 	logger.print(pipeline)
 	global_timer.start()
 
+	pipeline = skip_up_to_date_stages(pipeline)
+
 	pipeline.initialize() 
 	comm.Barrier() # Wait for all processes to finish initialization
 	logger.print('Finished initialization.')
@@ -126,3 +128,37 @@ def eval_pipeline(pipeline: Pipeline):
 	global_timer.print()
 	profiler.print()
 		
+
+def skip_up_to_date_stages(pipeline: Pipeline) -> Pipeline:
+	'''
+	Tag each checkpoint with the content hash of the computation producing it. If a checkpoint
+	file already holds the result of an identical computation (from a previous run), return the
+	pipeline starting from the last such checkpoint, which then serves as the input.
+	'''
+	comm = MPI.COMM_WORLD
+	keys = pipeline.cache_keys()
+	checkpoints = [i for i, stage in enumerate(pipeline.stages) if isinstance(stage, CheckpointStage)]
+	for n, i in enumerate(checkpoints):
+		pipeline.stages[i].cache_key = keys[i]
+		pipeline.stages[i].upstream_cache_keys = tuple(keys[j] for j in checkpoints[:n])
+
+	start = 0
+	if global_state.use_cache:
+		if comm.Get_rank() == 0:
+			for i in reversed(checkpoints):
+				if pipeline.stages[i].is_up_to_date():
+					start = i
+					break
+		start = comm.bcast(start, root=0)
+
+	if start == 0:
+		return pipeline
+
+	checkpoint = pipeline.stages[start]
+	checkpoint.resumed = True
+	if start == len(pipeline.stages) - 1:
+		logger.print(f'Checkpoint {checkpoint.cfg["file"]} is up to date; nothing to do.')
+		global_state.last_h5 = checkpoint.cfg['file']
+		return Pipeline(stages=[])
+	logger.print(f'Checkpoint {checkpoint.cfg["file"]} is up to date; skipping {[stage.name() for stage in pipeline.stages[:start]]}.')
+	return Pipeline(stages=pipeline.stages[start:])
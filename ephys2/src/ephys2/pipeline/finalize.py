@@ -9,6 +9,7 @@ from ephys2.lib.types import *
 from ephys2.lib.cluster import *
 from ephys2.lib.singletons import global_state
 from ephys2.lib.h5.sparse import *
+from ephys2.lib.h5.llvbatch import H5LLVBatchSerializer
 
 class FinalizeStage(ProcessingStage):
 
@@ -20,38 +21,46 @@ class FinalizeStage(ProcessingStage):
     return {LLVMultiBatch: LVMultiBatch}
 
   def initialize(self):
-    self.excluded_units = dict() # Per-channel group excluded units
+    self.label_maps = None # Per-channel group linked label of every label
+    self.keep_maps = None # Per-channel group inclusion of every (unlinked) label, following unit exclusion
+
+  def load_metadata(self):
+    '''
+    Read the metadata of all channel groups (label map of the links & excluded units) in a single pass over the file.
+    '''
+    assert global_state.last_h5 != None, 'finalize requires an HDF5 data source'
+    self.label_maps = dict()
+    self.keep_maps = dict()
+    with h5py.File(global_state.last_h5, 'r') as file:
+      for item_id in file.keys():
+        label_map = H5LLVBatchSerializer.load_label_map(file[item_id])
+        self.label_maps[item_id] = label_map
+        if 'excluded_units' in file[item_id] and file[item_id]['excluded_units'].size > 0:
+          self.keep_maps[item_id] = ~np.isin(label_map, file[item_id]['excluded_units'][:])
 
   def process(self, data: Batch) -> Batch:
+    if self.label_maps is None:
+      self.load_metadata()
     items = dict()
 
     for item_id, item in data.items.items():
 
-      # Read metadata (links matrix & excluded units)
-      if not (item_id in self.excluded_units):
-        assert global_state.last_h5 != None, 'finalize requires an HDF5 data source'
-        self.excluded_units[item_id] = np.array([], dtype=np.int64)
-        with h5py.File(global_state.last_h5, 'r') as file:
-          if 'excluded_units' in file[item_id]:
-            self.excluded_units[item_id] = file[item_id]['excluded_units'][:]
-
       # Since unit exclusion produces a dynamically-sized result, we must remove any possible `overlap` parameter, as it will be inconsistent with the actual data.
       # TODO: Declare fixed- vs. dynamic-output stages at the type level, and throw errors (or warnings at the least) when users provide nonzero `overlap` to dynamically sized stages.
       item.remove_overlap()
-      
-      # Map labels into linked domain
+
+      # Apply unit exclusion (by lookup of the unlinked labels) & compact
       linked_time = item.time
       linked_data = item.data
-      linked_labels = link_labels(item.labels, item.linkage)
-
-      # Apply unit exclusion
-      if self.excluded_units[item_id].size > 0:
-        mask = np.full(linked_labels.size, True)
-        for exc_label in self.excluded_units[item_id]:
-          mask[linked_labels == exc_label] = False
-        linked_time = linked_time[mask]
-        linked_data = linked_data[mask]
-        linked_labels = linked_labels[mask]
+      labels = item.labels
+      if item_id in self.keep_maps:
+        keep = np.flatnonzero(self.keep_maps[item_id][labels])
+        linked_time = linked_time[keep]
+        linked_data = linked_data[keep]
+        labels = labels[keep]
+
+      # Map labels into linked domain
+      linked_labels = link_labels(labels, item.linkage, self.label_maps[item_id])
 
       items[item_id] = LVBatch(
         time=linked_time, data=linked_data, labels=linked_labels, overlap=0
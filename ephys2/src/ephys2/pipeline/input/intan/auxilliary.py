@@ -4,14 +4,18 @@ Utility class and methods for reading auxiliary data from Intan RHD2000 datasets
 
 import gc
 import os
+from dataclasses import dataclass
+from typing import Dict, List
 
 import h5py
 import numpy as np
 
 from ephys2.lib.h5 import *
-from ephys2.lib.intanutil.uart import (decode_serial_packets,
-                                       decode_uart_from_ttl,
-                                       deserialize_teensy)
+from ephys2.lib.groupby import LabelGroups
+from ephys2.lib.intanutil.uart import (decode_uart_from_transitions,
+                                       deserialize_teensy,
+                                       serial_packet_arrays,
+                                       ttl_transitions)
 from ephys2.lib.singletons import global_metadata, global_state, logger
 from ephys2.lib.types import *
 from ephys2.pipeline.input.base import *
@@ -199,14 +203,10 @@ class RHDAuxStage(ProcessingStage):
                     s.initialize(os.path.join(output_path, f'session_{i}_{aux_decl["name"]}'))
                     self.analog_serializers.append(s)
 
-        # Initialize full-session TTL buffers if any UART decode is enabled
+        # Initialize full-session TTL accumulators if any UART decode is enabled
         if self.has_teensy_decode:
-            # prepare raw TTL signal and time accumulators per (config_idx, session)
-            self.ttl_signal_accum = {}
-            self.ttl_time_accum = {}
-            for (config_idx, session_idx) in self.uart_serializers.keys():
-                self.ttl_signal_accum[(config_idx, session_idx)] = np.array([], dtype=int)
-                self.ttl_time_accum[(config_idx, session_idx)] = np.array([], dtype=int)
+            # TTL segments (see TTLSegment) per (config_idx, session)
+            self.ttl_segments = {key: [] for key in self.uart_serializers.keys()}
 
     def validate_aux_metadata(self, header: Optional[dict] = None):
         for aux_decl in self.cfg["aux_channels"]:
@@ -239,62 +239,32 @@ class RHDAuxStage(ProcessingStage):
         # Save digital in for each configuration
         if digital_data.size > 0:
             for config_idx, digital_config in enumerate(self.digital_configs):
-                items = dict()
-                
-                for ch in digital_config['channels']:
-                    # Map requested channel number to actual native_order from header
-                    native_ch = None
-                    if hasattr(md, 'header') and 'board_dig_in_channels' in md.header:
-                        for header_ch in md.header['board_dig_in_channels']:
-                            if header_ch['native_order'] == ch:
-                                native_ch = ch
-                                break
-                    
-                    # If no mapping found, use the requested channel number directly
-                    if native_ch is None:
-                        native_ch = ch
-                    
-                    # Indices of lo -> hi
-                    # Convention is that any leading 1 is ignored.
-                    # Build boolean signal then detect 0->1 transitions across chunk boundary
-                    sig = (digital_data & (1 << native_ch)) > 0
-                    mask = (~sig[:-1]) & (sig[1:])
-                    
-                    items[str(ch)] = TBatch(
-                        time=time[(1 - start_offset) :][mask], overlap=0  # Change times
-                    )
-                
+                chs = digital_config['channels']
+
+                # Indices of lo -> hi, for all channels at once
+                # Convention is that any leading 1 is ignored.
+                # Build boolean signal then detect 0->1 transitions across chunk boundary
+                sig = (digital_data[:, np.newaxis] & (1 << chs)) > 0
+                mask = (~sig[:-1]) & (sig[1:])
+                edge_chs, edge_idxs = np.nonzero(mask.T)
+                edge_times = time[(1 - start_offset) :][edge_idxs]  # Change times
+                splits = np.cumsum(np.bincount(edge_chs, minlength=len(chs)))[:-1]
+                items = {
+                    str(ch): TBatch(time=ch_times, overlap=0)
+                    for ch, ch_times in zip(chs, np.split(edge_times, splits))
+                }
+
                 # Get the corresponding serializer index
                 serializer_idx = config_idx
                 self.digital_batches[serializer_idx].append(TMultiBatch(items=items))
-                
-                # optional: accumulate raw TTL for full-session UART decoding
+
+                # optional: accumulate the TTL for full-session UART decoding
                 if digital_config['decode_teensy']:
-                    ch = int(digital_config['channels'][0])
-                    # Use the same native_order mapping for UART decoding
-                    native_ch = None
-                    if hasattr(md, 'header') and 'board_dig_in_channels' in md.header:
-                        for header_ch in md.header['board_dig_in_channels']:
-                            if header_ch['native_order'] == ch:
-                                native_ch = ch
-                                break
-                    
-                    if native_ch is None:
-                        native_ch = ch
-                    
-                    raw_ttl = ((digital_data & (1 << native_ch)) > 0).astype(int)
-                    aligned_signal = raw_ttl[start_offset:]
-                    aligned_times = time
-                    
-                    key = (config_idx, md.session)
-                    self.ttl_signal_accum[key] = np.concatenate(
-                        [self.ttl_signal_accum[key], aligned_signal]
-                    )
-                    self.ttl_time_accum[key] = np.concatenate(
-                        [self.ttl_time_accum[key], aligned_times]
-                    )
-        else:
-            pass
+                    aligned_signal = sig[start_offset:, 0]
+                    if aligned_signal.size > 0:
+                        self.ttl_segments[(config_idx, md.session)].append(
+                            TTLSegment.from_ttl(aligned_signal, time)
+                        )
 
     def capture_aio(
         self,
@@ -379,43 +349,17 @@ class RHDAuxStage(ProcessingStage):
                 # Get the configuration for this UART serializer
                 digital_config = self.digital_configs[config_idx]
                 
-                local_signal = self.ttl_signal_accum.get((config_idx, session_idx), np.array([], dtype=int))
-                local_times  = self.ttl_time_accum.get((config_idx, session_idx), np.array([], dtype=int))
-                all_signals  = comm.gather(local_signal, root=0)
-                all_times    = comm.gather(local_times, root=0)
+                local_segments = self.ttl_segments.get((config_idx, session_idx), [])
+                all_segments = comm.gather(local_segments, root=0)
                 if comm.Get_rank() == 0:
-                    if len(all_signals) > 0:
-                        ts_signal = np.concatenate(all_signals)
-                        ts_times  = np.concatenate(all_times)
-                        order     = np.argsort(ts_times)
-                        ts_signal = ts_signal[order]
-                        ts_times  = ts_times[order]
-                    else:
-                        ts_signal = np.array([], dtype=int)
-                        ts_times  = np.array([], dtype=int)
-                    if ts_signal.size == 0:
-                        events = {}
-                    else:
-                        decoded_bytes, rel_times = decode_uart_from_ttl(ts_signal, fs, digital_config['baud_rate'])
-                        abs_times = ts_times[rel_times]
-                        packets   = decode_serial_packets(decoded_bytes, abs_times)
-                        events    = {}
-                        cf_ms = 0.36  # constant offset in ms
-                        for p in packets:
-                            if not p.get("valid", True):
-                                continue
-                            wait_ms = p["waitTime"]
-                            # subtract wait time plus constant factor (in samples)
-                            offset = int(round(((wait_ms + cf_ms) / 1000.0) * fs))
-                            event_time = p["detectionTime"] - offset
-                            cid = str(p["channelID"])
-                            events.setdefault(cid, []).append(event_time)
+                    segments = [seg for segs in all_segments for seg in segs]
+                    events = decode_teensy_events(segments, fs, digital_config['baud_rate'])
                 else:
                     events = None
                 # Broadcast decoded events to all ranks
                 events = comm.bcast(events, root=0)
                 # Assemble TMultiBatch of event times
-                items = {cid: TBatch(time=np.array(times), overlap=0) for cid, times in events.items()}
+                items = {cid: TBatch(time=times, overlap=0) for cid, times in events.items()}
                 mm    = TMultiBatch(items=items)
                 # Only the root rank writes the batch
                 if comm.Get_rank() == 0:
@@ -434,3 +378,82 @@ class RHDAuxStage(ProcessingStage):
             + list(self.uart_serializers.values())
         ):
             s.cleanup()
+
+
+@dataclass
+class TTLSegment:
+    """
+    A contiguous piece of a TTL signal, stored by its level transitions rather than per sample.
+    Segments from any batches (and ranks) are joined in merge_ttl_segments(), which completes
+    UART frames straddling their boundaries.
+    """
+    n_samples: int
+    first_level: int
+    transitions: np.ndarray  # Sample indices (within the segment) of level changes
+    times: np.ndarray  # Timestamps of the first sample and of each transition
+
+    @staticmethod
+    def from_ttl(signal: np.ndarray, time: np.ndarray) -> "TTLSegment":
+        transitions = ttl_transitions(signal)
+        return TTLSegment(
+            n_samples=signal.size,
+            first_level=int(signal[0]),
+            transitions=transitions,
+            times=time[np.concatenate(([0], transitions))],
+        )
+
+    @property
+    def last_level(self) -> int:
+        return self.first_level ^ (self.transitions.size & 1)
+
+
+def merge_ttl_segments(segments: List[TTLSegment]) -> TTLSegment:
+    """
+    Join segments in order of time, as if their samples were concatenated.
+    """
+    segments = sorted(segments, key=lambda seg: seg.times[0])
+    transitions, times = [], []
+    offset = 0
+    for i, seg in enumerate(segments):
+        if i > 0 and seg.first_level != segments[i - 1].last_level:
+            # Level change at the boundary
+            transitions.append([offset])
+            times.append(seg.times[:1])
+        transitions.append(seg.transitions + offset)
+        times.append(seg.times[1:])
+        offset += seg.n_samples
+    return TTLSegment(
+        n_samples=offset,
+        first_level=segments[0].first_level,
+        transitions=np.concatenate(transitions).astype(np.int64),
+        times=np.concatenate([segments[0].times[:1]] + times),
+    )
+
+
+def decode_teensy_events(
+    segments: List[TTLSegment], fs: float, baud_rate: float
+) -> Dict[str, np.ndarray]:
+    """
+    Decode Teensy serial packets from a TTL signal, returning the event times per channel ID
+    (in order of first appearance).
+    """
+    if len(segments) == 0:
+        return {}
+    ttl = merge_ttl_segments(segments)
+    decoded_bytes, rel_times = decode_uart_from_transitions(
+        ttl.first_level, ttl.transitions, ttl.n_samples, fs, baud_rate
+    )
+    # Bytes are decoded at their start bit, which is a transition
+    abs_times = ttl.times[1:][np.searchsorted(ttl.transitions, rel_times)]
+    packets = serial_packet_arrays(decoded_bytes, abs_times)
+
+    valid = packets["valid"]
+    cf_ms = 0.36  # constant offset in ms
+    # subtract wait time plus constant factor (in samples)
+    offsets = np.rint(((packets["waitTime"][valid] + cf_ms) / 1000.0) * fs).astype(np.int64)
+    event_times = packets["detectionTime"][valid] - offsets
+
+    groups = LabelGroups(packets["channelID"][valid])
+    first_seen = np.argsort(groups.order[groups.offsets[:-1]])
+    cid_times = groups.split(event_times)
+    return {str(groups.labels[k]): cid_times[k] for k in first_seen}
@@ -3,7 +3,7 @@ New clustering & linking stage (collectively referred to as "labeling")
 '''
 
 from multiprocessing.connection import Pipe
-from typing import Tuple, Dict, Set, FrozenSet
+from typing import Tuple, Dict, Set, FrozenSet, List, Union
 from abc import abstractmethod
 import numpy as np
 import numpy.typing as npt
@@ -11,10 +11,11 @@ import scipy.sparse as sp
 import warnings
 
 from ephys2.lib.types import *
-from ephys2.lib.singletons import global_state
+from ephys2.lib.singletons import global_state, logger
 from ephys2.lib.cluster import *
 
 from ephys2.pipeline.transform.stages import STAGES as transform_stages
+from ephys2.pipeline.transform.base import LinearTransformStage
 from ephys2.pipeline.cluster.stages import STAGES as cluster_stages
 from ephys2.pipeline.link.stages import STAGES as link_stages
 
@@ -55,6 +56,12 @@ class LabelStage(ProcessingStage):
 				units = None,
 				description = 'Whether to link in feature space or in amplitude space'
 			),
+			'cluster_subsample': IntParameter(
+				start = 1,
+				stop = np.inf,
+				units = 'samples',
+				description = 'Maximum number of samples clustered per block; larger blocks are clustered on a stratified random subsample, and remaining samples are assigned to the nearest cluster (Mahalanobis). Set to inf to cluster every sample'
+			),
 			'n_channels': IntParameter(
 				start = 1,
 				stop = np.inf,
@@ -65,6 +72,7 @@ class LabelStage(ProcessingStage):
 
 	def initialize(self):
 		self.cfg['transform'].initialize()
+		self.feature_plans = dict() # Fused feature transform per waveform length
 		self.cfg['cluster'].initialize()
 		self.cfg['link'].initialize()
 
@@ -124,7 +132,7 @@ class LabelStage(ProcessingStage):
 
 		# Cluster 1st block
 		block1_y = self.feature_transform(block1)
-		block1_labels = self.cfg['cluster'].process(block1_y) 
+		block1_labels = self.cluster(block1_y)
 
 		# Offset to position in label space
 		block1_labels += labels_start
@@ -136,7 +144,7 @@ class LabelStage(ProcessingStage):
 		# Cluster 2nd block
 		assert block2.size > 0, 'Second block must have at least one element'
 		block2_y = self.feature_transform(block2)
-		block2_labels = self.cfg['cluster'].process(block2_y) 
+		block2_labels = self.cluster(block2_y)
 
 		# Offset to position in label space
 		block2_labels += labels_start + block1_labels.size 
@@ -151,6 +159,24 @@ class LabelStage(ProcessingStage):
 		labels = np.hstack((block1_labels, block2_labels))
 		return labels, linkage
 
+	def cluster(self, Y: npt.NDArray[np.float32]) -> Labeling:
+		'''
+		Cluster a block of features. Blocks larger than cluster_subsample are clustered on a subsample
+		stratified over time, and the remaining samples are classified by their nearest cluster centroid.
+		'''
+		N = Y.shape[0]
+		n = self.cfg['cluster_subsample']
+		if N <= n:
+			return self.cfg['cluster'].process(Y)
+		where = stratified_subsample(N, int(n), random_seed=0)
+		sub_labels = self.cfg['cluster'].process(Y[where])
+		labels = nearest_centroid_classify(Y[where], sub_labels, Y)
+		# Agreement of the classifier with the clustering on the subsample
+		agreement = np.mean(labels[where] == sub_labels)
+		logger.debug(f'Clustered {n} of {N} samples into {np.unique(sub_labels).size} clusters, reassignment agreement {agreement:.3f}')
+		labels[where] = sub_labels
+		return labels
+
 	def feature_transform(self, X: npt.NDArray[np.float32]) -> npt.NDArray[np.float32]:
 		'''
 		Apply the feature transform prior to clustering.
@@ -160,8 +186,36 @@ class LabelStage(ProcessingStage):
 		M = X.shape[1] // C
 		N = X.shape[0]
 		Y = X.reshape((N, C, M)).reshape((N * C, M)) # Reshape to individual waveforms
-		for stage in self.cfg['transform'].stages:
-			Y = stage.process(Y) # Apply transforms in order
+		for step in self.feature_plan(M):
+			if isinstance(step, np.ndarray):
+				Y = Y @ step # Fused linear transforms
+			else:
+				Y = step.process(Y) # Non-linear transform
 		M = Y.shape[1] # Account for possible dimension change
 		Y = Y.reshape((N, C, M)).reshape((N, C * M)) # Reshape back to concatenated form
-		return Y
\ No newline at end of file
+		return Y
+
+	def feature_plan(self, M: int) -> List[Union[npt.NDArray[np.float32], ProcessingStage]]:
+		'''
+		Feature transform for waveforms of length M, with each run of consecutive linear stages
+		precomposed into a single (float32) projection matrix. Cached per waveform length.
+		'''
+		M_in = M
+		if not (M_in in self.feature_plans):
+			plan = []
+			A = None
+			for stage in self.cfg['transform'].stages:
+				if isinstance(stage, LinearTransformStage):
+					A_stage = stage.operator(M)
+					A = A_stage if A is None else A @ A_stage
+					M = A_stage.shape[1]
+				else:
+					if not (A is None):
+						plan.append(A.astype(np.float32))
+						A = None
+					plan.append(stage)
+					M = stage.process(np.zeros((1, M), dtype=np.float32)).shape[1] # Output dimension
+			if not (A is None):
+				plan.append(A.astype(np.float32))
+			self.feature_plans[M_in] = plan
+		return self.feature_plans[M_in]
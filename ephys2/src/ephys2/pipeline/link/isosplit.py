@@ -2,13 +2,17 @@
 ISO-SPLIT based linking stage
 '''
 
+import os
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import numpy.typing as npt
 from scipy.spatial.distance import cdist
 from sklearn.decomposition import PCA
 
 from ephys2.lib.types import *
+from ephys2.lib.groupby import *
 from ephys2.lib.isosplit import *
+from ephys2.lib.singletons import global_state
 from ephys2.pipeline.cluster.isosplit import IsosplitStage as IsosplitClusteringStage
 
 class IsosplitStage(ProcessingStage):
@@ -28,59 +32,69 @@ class IsosplitStage(ProcessingStage):
 				stop = np.inf,
 				units = None,
 				description = 'Maximum number of times a cluster can be used in a link'
-			)
+			),
+			'prune_separation': FloatParameter(
+				start = 0,
+				stop = np.inf,
+				units = None,
+				description = 'Skip the link test for cluster pairs whose centroids are at least this many standard deviations of each cluster apart (along the axis joining them); 0 tests every pair'
+			),
 		}
 
+	def initialize(self):
+		self.executor = None # Thread pool for pair tests, reused across blocks
+		self.executor_threads = 0
+
 	def process(self, lc: LinkCandidates) -> EVIncidence:
 		# Get clusters
-		block1_clusters = np.unique(lc.block1_labels)
-		block2_clusters = np.unique(lc.block2_labels)
+		block1_groups = LabelGroups(lc.block1_labels)
+		block2_groups = LabelGroups(lc.block2_labels)
+		block1_clusters = block1_groups.labels
+		block2_clusters = block2_groups.labels
 
 		# Calculate centroids (ordered by block_i_clusters)
-		block1_centroids = np.array([lc.block1_features[lc.block1_labels == C].mean(axis=0) for C in block1_clusters], dtype=np.float32)
-		block2_centroids = np.array([lc.block2_features[lc.block2_labels == C].mean(axis=0) for C in block2_clusters], dtype=np.float32)
-
-		# Calculate pairwise distances
-		dists = cdist(block1_centroids, block2_centroids, metric='euclidean').ravel()
-		links = np.vstack((
-			np.repeat(block1_clusters, block2_clusters.size),
-			np.tile(block2_clusters, block1_clusters.size)
-		)).T
-
-		# Sort by distance
-		links = links[np.argsort(dists)]
-
-		# Form links
-		block1_used_nodes = dict()
-		block2_used_nodes = dict()
+		block1_centroids = block1_groups.mean(lc.block1_features).astype(np.float32)
+		block2_centroids = block2_groups.mean(lc.block2_features).astype(np.float32)
+
+		block1_members = block1_groups.split(lc.block1_features)
+		block2_members = block2_groups.split(lc.block2_features)
+
+		# Candidate links, sorted by centroid distance
+		dists = cdist(block1_centroids, block2_centroids, metric='euclidean')
+		order = np.argsort(dists.ravel())
+		pairs = np.vstack(np.unravel_index(order, dists.shape)).T
+		links = np.vstack((block1_clusters[pairs[:, 0]], block2_clusters[pairs[:, 1]])).T
+
+		# Optionally prune candidates which are likely to be split anyway
+		if self.cfg['prune_separation'] > 0:
+			separated = self.separated(block1_members, block2_members, block1_centroids, block2_centroids)[pairs[:, 0], pairs[:, 1]]
+			candidates = np.flatnonzero(~separated)
+		else:
+			candidates = np.arange(links.shape[0])
+
+		# Form links greedily by distance. The test of each pair depends only on its data, so the next
+		# eligible candidates are tested speculatively in parallel, and then accepted in order of distance.
+		max_uses = self.cfg['max_cluster_uses']
+		block1_uses = np.zeros(block1_clusters.size, dtype=np.int64)
+		block2_uses = np.zeros(block2_clusters.size, dtype=np.int64)
+		eligible = lambda i: max(block1_uses[pairs[i, 0]], block2_uses[pairs[i, 1]]) < max_uses
+		test = lambda i: self.test_link(block1_members[pairs[i, 0]], block2_members[pairs[i, 1]])
 		link_mask = np.full(links.shape[0], False, dtype=bool)
-		for i, (C1, C2) in enumerate(links):
-			C1_uses = block1_used_nodes.get(C1, 0)
-			C2_uses = block2_used_nodes.get(C2, 0)
-			if max(C1_uses, C2_uses) < self.cfg['max_cluster_uses']:
-				
-				# Test if the cluster made of the two sub-clusters would be split
-				super_cluster = np.concatenate((
-					lc.block1_features[lc.block1_labels == C1],
-					lc.block2_features[lc.block2_labels == C2]
-				))
-				labeling = isosplit5(
-					super_cluster,
-					n_components = self.cfg['n_components'],
-					isocut_threshold = self.cfg['isocut_threshold'],
-					min_cluster_size = self.cfg['min_cluster_size'],
-					K_init = self.cfg['K_init'],
-					refine_clusters = self.cfg['refine_clusters'],
-					max_iterations_per_pass = self.cfg['max_iterations_per_pass'],
-					random_seed = 0,
-					jitter = self.cfg['jitter']
-				)
-
-				# Add the link if not
-				if np.unique(labeling).size == 1:
+		n_threads = global_state.n_threads or os.cpu_count()
+		executor = self.thread_pool(n_threads)
+		pos = 0
+		while pos < candidates.size:
+			wave = []
+			while pos < candidates.size and len(wave) < n_threads:
+				if eligible(candidates[pos]): # Cluster uses only increase, so skipped candidates stay ineligible
+					wave.append(candidates[pos])
+				pos += 1
+			results = list(executor.map(test, wave)) if len(wave) > 1 else [test(i) for i in wave]
+			for i, linked in zip(wave, results):
+				if linked and eligible(i):
 					link_mask[i] = True
-					block1_used_nodes[C1] = C1_uses + 1
-					block2_used_nodes[C2] = C2_uses + 1
+					block1_uses[pairs[i, 0]] += 1
+					block2_uses[pairs[i, 1]] += 1
 
 		# Form incidence matrix
 		selected_links = links[link_mask]
@@ -90,4 +104,61 @@ class IsosplitStage(ProcessingStage):
 		linkage_data = np.full(n_links * 2, True)
 		linkage = CSRMatrix(linkage_data, linkage_indices, linkage_indptr, (n_links, lc.label_space))
 
-		return linkage
\ No newline at end of file
+		return linkage
+
+	def finalize(self):
+		if self.executor is not None:
+			self.executor.shutdown(wait=True)
+			self.executor = None
+
+	def thread_pool(self, n_threads: int) -> ThreadPoolExecutor:
+		'''
+		Thread pool of n_threads workers, created on first use and re-created only if n_threads changes.
+		'''
+		if self.executor is None or self.executor_threads != n_threads:
+			if self.executor is not None:
+				self.executor.shutdown(wait=True)
+			self.executor = ThreadPoolExecutor(n_threads, thread_name_prefix=f'ephys2-link-{self.rank}')
+			self.executor_threads = n_threads
+		return self.executor
+
+	def test_link(self, X1: npt.NDArray[np.float32], X2: npt.NDArray[np.float32]) -> bool:
+		'''
+		Test if the cluster made of the two sub-clusters would not be split.
+		'''
+		labeling = isosplit5(
+			np.concatenate((X1, X2)),
+			n_components = self.cfg['n_components'],
+			isocut_threshold = self.cfg['isocut_threshold'],
+			min_cluster_size = self.cfg['min_cluster_size'],
+			K_init = self.cfg['K_init'],
+			refine_clusters = self.cfg['refine_clusters'],
+			max_iterations_per_pass = self.cfg['max_iterations_per_pass'],
+			random_seed = 0,
+			jitter = self.cfg['jitter'],
+			n_threads = 1 # Pairs are tested in parallel
+		)
+		return np.unique(labeling).size == 1
+
+	def separated(self,
+			block1_members: List[npt.NDArray[np.float32]], 
+			block2_members: List[npt.NDArray[np.float32]],
+			block1_centroids: npt.NDArray[np.float32],
+			block2_centroids: npt.NDArray[np.float32]
+		) -> npt.NDArray[bool]:
+		'''
+		(K1, K2) mask of cluster pairs whose centroids are at least prune_separation standard deviations
+		of each cluster apart (along the axis joining them), which iso-split is expected to split.
+		This is a heuristic: it can reject a pair the full test would merge, so it is only used when enabled.
+		Clusters which are too small to be split are never pruned.
+		'''
+		diffs = block2_centroids[np.newaxis, :, :].astype(np.float64) - block1_centroids[:, np.newaxis, :]
+		dists = np.linalg.norm(diffs, axis=2)
+		axes = diffs / np.maximum(dists, np.finfo(np.float64).tiny)[:, :, np.newaxis]
+		# Standard deviations of each cluster's projection onto each axis
+		std1 = np.array([(X @ axes[k].T).std(axis=0) for k, X in enumerate(block1_members)]).reshape(dists.shape)
+		std2 = np.array([(X @ axes[:, l].T).std(axis=0) for l, X in enumerate(block2_members)]).reshape(dists.shape[::-1]).T
+		min_size = 2 * self.cfg['min_cluster_size']
+		large1 = np.array([X.shape[0] >= min_size for X in block1_members], dtype=bool)
+		large2 = np.array([X.shape[0] >= min_size for X in block2_members], dtype=bool)
+		return (dists > self.cfg['prune_separation'] * (std1 + std2)) & large1[:, np.newaxis] & large2[np.newaxis, :]
\ No newline at end of file
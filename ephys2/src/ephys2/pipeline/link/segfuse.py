@@ -4,17 +4,12 @@ Segmentation fusion-based linking stage
 
 import numpy as np
 import numpy.typing as npt
-import cvxpy as cp
-import scipy.sparse as sp
+from scipy.optimize import linear_sum_assignment
 
 from ephys2.lib.types import *
+from ephys2.lib.groupby import *
 from ephys2.lib.cluster import *
 
-try: 
-	import gurobipy
-except:
-	gurobipy = None
-
 class SegfuseStage(ProcessingStage):
 
 	@staticmethod
@@ -47,59 +42,25 @@ class SegfuseStage(ProcessingStage):
 			),
 		}
 
-	def initialize(self):
-		self.has_gurobi = cp.GUROBI in cp.installed_solvers()
-		if self.has_gurobi:
-			assert not (gurobipy is None), 'GUROBI is installed but gurobipy is not. Please check your environment.'
-			self.gurobi_env = gurobipy.Env(empty=True)
-			self.gurobi_env.setParam('OutputFlag', 0) # Suppress license info being printed to stdout
-			self.gurobi_env.setParam('NodefileStart', 0.5) # Start writing to nodefile at 0.5GB memory use
-			self.gurobi_env.setParam('Threads', 1) # Use only one thread
-			self.gurobi_env.start()
-
 	def process(self, lc: LinkCandidates) -> EVIncidence:
 		'''
 		Segmentation fusion-based linking step
 		'''
 		# Get clusters
-		block1_clusters = np.unique(lc.block1_labels)
-		block2_clusters = np.unique(lc.block2_labels)
+		block1_groups = LabelGroups(lc.block1_labels)
+		block2_groups = LabelGroups(lc.block2_labels)
+		block1_clusters = block1_groups.labels
+		block2_clusters = block2_groups.labels
 		
 		# Calculate centroids (ordered by block_i_clusters)
-		block1_centroids = np.array([lc.block1_features[lc.block1_labels == C].mean(axis=0) for C in block1_clusters], dtype=np.float32)
-		block2_centroids = np.array([lc.block2_features[lc.block2_labels == C].mean(axis=0) for C in block2_clusters], dtype=np.float32)
-
-		# Calculate link weights, stored in the format: (e_11, ..., e_1j, ..., e_i1, ..., e_ij)
-		link_format = np.vstack((
-			np.repeat(np.arange(block1_clusters.size), block2_clusters.size),
-			np.tile(np.arange(block2_clusters.size), block1_clusters.size)
-		))
-		link_weights = calc_link_weights(block1_centroids, block2_centroids, self.cfg['link_sig_s'], self.cfg['link_sig_k']).ravel()
-		
-		# Set up ILP
-		n_total_links = block1_clusters.size * block2_clusters.size
-		link_params = cp.Variable(link_weights.size, boolean=True)
-		objective = link_params @ (link_weights - self.cfg['link_threshold'])
-		A_data = np.ones(n_total_links)
-		A_cols = np.arange(n_total_links)
-		A_inbound = sp.coo_matrix((A_data, (link_format[0], A_cols)), shape=(block1_clusters.size, n_total_links)).tocsr()
-		b_inbound = np.ones(block1_clusters.size)
-		A_outbound = sp.coo_matrix((A_data, (link_format[1], A_cols)), shape=(block2_clusters.size, n_total_links)).tocsr()
-		b_outbound = np.ones(block2_clusters.size)
-		constraints = [
-			A_inbound @ link_params <= b_inbound, # Inbound constraints
-			A_outbound @ link_params <= b_outbound # Outbound constraints
-		]
-		problem = cp.Problem(cp.Maximize(objective), constraints)
+		block1_centroids = block1_groups.mean(lc.block1_features).astype(np.float32)
+		block2_centroids = block2_groups.mean(lc.block2_features).astype(np.float32)
 
-		# Solve ILP
-		if self.has_gurobi: # Use GUROBI solver if available (faster)
-			problem.solve(cp.GUROBI, env=self.gurobi_env) 
-		else:
-			problem.solve(cp.GLPK_MI)
+		# Calculate link weights & solve the assignment problem
+		link_weights = calc_link_weights(block1_centroids, block2_centroids, self.cfg['link_sig_s'], self.cfg['link_sig_k'])
+		solved_links = match_links(link_weights, self.cfg['link_threshold'])
 
 		# Recover links
-		solved_links = link_format[:, link_params.value.astype(bool)]
 		n_links = solved_links.shape[1]
 		block1_nodes = block1_clusters[solved_links[0]]
 		block2_nodes = block2_clusters[solved_links[1]]
@@ -110,6 +71,22 @@ class SegfuseStage(ProcessingStage):
 
 		return linkage
 
+def match_links(
+		link_weights: npt.NDArray[np.float32],
+		link_threshold: float
+	) -> npt.NDArray[np.int64]:
+	'''
+	Maximum-weight bipartite matching between clusters in consecutive blocks (rows & columns of link_weights),
+	in which each cluster is linked at most once and only edges weighted above the threshold are allowed.
+	Equivalent to the integer program maximizing sum_ij (w_ij - threshold) x_ij, solved natively as a linear assignment.
+	Returns the (2, n_links) matched row & column indices.
+	'''
+	gains = link_weights.astype(np.float64) - link_threshold
+	# Forbidden edges have zero gain, so an optimal full assignment restricted to positive gains is optimal
+	rows, cols = linear_sum_assignment(np.maximum(gains, 0), maximize=True)
+	keep = gains[rows, cols] > 0
+	return np.vstack((rows[keep], cols[keep])).astype(np.int64)
+
 def calc_link_weights(
 		centroids1: npt.NDArray[np.float32], 
 		centroids2: npt.NDArray[np.float32],
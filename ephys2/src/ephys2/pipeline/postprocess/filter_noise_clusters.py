@@ -7,13 +7,52 @@ To re-train the model:
 
 Note that this requires snippets to be 256 (4x64)-dimensional.
 """
+import os
 import pickle
+import functools
 import xgboost
 import numpy as np
 
 from ephys2.lib.types import *
+from ephys2.lib.groupby import LabelGroups
+from ephys2.lib.singletons import global_state
 from ephys2.data import get_path
 
+@functools.lru_cache(maxsize=None)
+def load_noise_classifier() -> Tuple[xgboost.XGBClassifier, Any]:
+  '''
+  Load the (model, pca) pair once per process; shared by all noise-filtering stages.
+  '''
+  with open(get_path("pca_xgb_classifier.p"), "rb") as file:
+    in_dict = pickle.load(file)
+  return in_dict["model"], in_dict["pca"]
+
+def predict_clean(model: xgboost.XGBClassifier, pca: Any, class_avgs: npt.NDArray[np.float32]) -> npt.NDArray[bool]:
+  '''
+  Classify a batch of class averages (K, 256) in one inference call; True for clean (non-noise) clusters.
+  '''
+  if class_avgs.shape[0] == 0:
+    return np.zeros(0, dtype=bool)
+  # Suppress outlying values to 0
+  class_avgs = np.nan_to_num(class_avgs, nan=0, posinf=0, neginf=0)
+  try:
+    model.get_booster().set_param('nthread', global_state.n_threads or os.cpu_count())
+  except (AttributeError, xgboost.core.XGBoostError):
+    pass # Models pickled by older XGBoost versions keep their own setting
+  return np.asarray(model.predict(pca.transform(class_avgs))).astype(bool)
+
+def batch_class_avgs(labels: List[npt.NDArray[np.int64]], data: List[npt.NDArray[np.float32]]) -> Tuple[List[LabelGroups], npt.NDArray, npt.NDArray[np.int64]]:
+  '''
+  Group each item's samples by label, and stack the class averages of all items into one feature matrix.
+  Returns the per-item groups, the stacked averages, and the offsets of each item's rows.
+  '''
+  groups = [LabelGroups(l) for l in labels]
+  avgs = [g.mean(x) for g, x in zip(groups, data)]
+  offsets = np.cumsum([0] + [g.size for g in groups])
+  if len(avgs) == 0:
+    return groups, np.zeros((0, 0), dtype=np.float32), offsets
+  return groups, np.concatenate(avgs, axis=0), offsets
+
 class FilterNoiseStage(ProcessingStage):
   '''
   This stage directly filters noisy clusters from data.
@@ -29,26 +68,19 @@ class FilterNoiseStage(ProcessingStage):
     self.load_model()
 
   def load_model(self):
-    with open(get_path("pca_xgb_classifier.p"), "rb") as file:
-      in_dict = pickle.load(file)
-      self.model = in_dict["model"]
-      self.pca = in_dict["pca"]
+    self.model, self.pca = load_noise_classifier()
 
-  def predict(self, class_avg: npt.NDArray[np.float32]) -> bool:
-    # Suppress outlying values to 0
-    class_avg = np.nan_to_num(class_avg, nan=0, posinf=0, neginf=0)
-    return self.model.predict(self.pca.transform(class_avg.reshape(1, -1)))
+  def predict(self, class_avgs: npt.NDArray[np.float32]) -> npt.NDArray[bool]:
+    return predict_clean(self.model, self.pca, class_avgs)
 
   def process(self, data: LVMultiBatch) -> LVMultiBatch:
-    for item_id, item in data.items.items():
-      label_mask = np.full(item.size, True)
-      labels = np.unique(item.labels)
-      for label in labels:
-        index = item.labels == label
-        class_avg = item.data[index].mean(axis=0)
-        if not self.predict(class_avg):
-          label_mask[index] = False
+    items = list(data.items.values())
+    # One inference call for all labels of all items
+    groups, class_avgs, offsets = batch_class_avgs([item.labels for item in items], [item.data for item in items])
+    keep = self.predict(class_avgs)
+    for i, item in enumerate(items):
+      label_mask = keep[offsets[i]:offsets[i+1]][groups[i].inverse]
       item.labels = item.labels[label_mask]
       item.time = item.time[label_mask]
       item.data = item.data[label_mask]
-    return data
\ No newline at end of file
+    return data
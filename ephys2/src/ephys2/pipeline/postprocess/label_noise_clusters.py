@@ -38,16 +38,18 @@ class LabelNoiseStage(ReductionStage):
 
   def process(self, data: LLVMultiBatch) -> LLVMultiBatch:
     # Record any excluded units
-    for item_id, item in data.items.items():
-
-      # Map labels into the linked domain
-      linked_labels = link_labels(item.labels, item.linkage)
-      for label in np.unique(linked_labels):
-        class_avg = item.data[linked_labels == label].mean(axis=0)
-        if not FilterNoiseStage.predict(self, class_avg):
-          # Record excluded unit to be written later during checkpointing stage
-          # print('Got excluded label for tetrode:', item_id, label)
-          self.add_exclusion(item_id, label)
+    item_ids = list(data.items.keys())
+    items = list(data.items.values())
+    # Map labels into the linked domain, and classify all labels of all items at once
+    groups, class_avgs, offsets = batch_class_avgs(
+      [link_labels(item.labels, item.linkage) for item in items], 
+      [item.data for item in items]
+    )
+    keep = FilterNoiseStage.predict(self, class_avgs)
+    for i, item_id in enumerate(item_ids):
+      # Record excluded units to be written later during checkpointing stage
+      for label in groups[i].labels[~keep[offsets[i]:offsets[i+1]]]:
+        self.add_exclusion(item_id, label)
 
     return data
 
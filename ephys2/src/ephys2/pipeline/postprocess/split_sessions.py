@@ -44,12 +44,13 @@ class SplitSessionsStage(ProcessingStage):
 				self.serializers.append(s)
 
 		self.n_splits = len(self.session_splits)
+		self.session_bounds = np.array([0] + list(self.session_splits), dtype=np.int64) # Session i is [bounds[i], bounds[i+1])
 
 	def make_serializer(self) -> H5Serializer:
 		return {
 			VMultiBatch: H5VMultiBatchSerializer,
 			LVMultiBatch: H5LVMultiBatchSerializer,
-		}[self.input_type()](
+		}[self._input_type](
 			full_check=False,
 			rank=self.rank,
 			n_workers=self.n_workers
@@ -61,11 +62,11 @@ class SplitSessionsStage(ProcessingStage):
 			subdata = [dict() for _ in range(self.n_splits)]
 			for item_id, item in data.items.items():
 				assert item.overlap == 0, 'Overlap not allowed in split_sessions'
-				for i, end in enumerate(self.session_splits):
-					start = 0 if i == 0 else self.session_splits[i-1]
-					mask = np.logical_and(item.time >= start, item.time < end)
-					assert not (item_id in subdata[i])
-					subdata[i][item_id] = item[mask]
+				assert np.all(item.time[1:] >= item.time[:-1]), 'Time must be sorted in split_sessions'
+				# Sessions are contiguous ranges of sorted time; split into slice views
+				bounds = np.searchsorted(item.time, self.session_bounds, side='left')
+				for i in range(self.n_splits):
+					subdata[i][item_id] = item[bounds[i]:bounds[i+1]]
 			# Write data
 			for i, subdatum in enumerate(subdata):
 				# Wrap in the proper constructor
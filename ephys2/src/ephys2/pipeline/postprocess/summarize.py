@@ -3,11 +3,14 @@ Processing stage for summarizing & downsampling clustered data
 '''
 import numpy as np
 import numpy.typing as npt
-import math
+import scipy.sparse as sp
 
 from ephys2.lib.types import *
+from ephys2.lib.array import mkshape
 from ephys2.lib.singletons import rng, global_state
 
+SUMMARIZE_CHUNK_SIZE = 2 ** 24 # Maximum number of padded elements sorted at once for medians
+
 class SummarizeStage(ProcessingStage):
 
 	@staticmethod
@@ -46,8 +49,6 @@ class SummarizeStage(ProcessingStage):
 
 	def process(self, data: LLVMultiBatch) -> SLLVMultiBatch:
 		items = dict()
-		R = self.cfg['downsample_ratio']
-		ND = self.cfg['isi_subsamples']
 
 		for item_id, item in data.items.items():
 			# Check consistency of the data dimensions
@@ -56,104 +57,160 @@ class SummarizeStage(ProcessingStage):
 			assert global_state.load_batch_size % B == 0, f'Load batch size must be a multiple of the block size: {B} used in clustering. Check your checkpoint / load stage.'
 			
 			# Compute summary statistics per-block
+			# Blocks never straddle batches, so each batch is summarized independently as it streams through.
 			O = item.overlap
 			item_time = item.time[O:] # Remove any overlap prior to summarization
 			item_data = item.data[O:]
 			item_labels = item.labels[O:]
 			N = item_time.size
-			M = item.ndim
-			summary = SLVBatch.empty(M, ND, R)
-			item_indices = global_state.load_index - global_state.load_start + O + np.arange(N, dtype=np.intp) # Get indices of the data in the original dataset
-
-			for k in range(math.ceil(N / B)):
-				window = slice(k*B, (k+1)*B)
-				btime = item_time[window]
-				bdata = item_data[window]
-				blabels = item_labels[window]
-				bindices = item_indices[window]
-
-				stime = []
-				sdata = []
-				slabels = []
-				svariance = []
-				sdifftime = []
-				sindices = []
-
-				for lb in np.unique(blabels):
-					lmask = blabels == lb
-					ltime = btime[lmask]
-					ldata = bdata[lmask]
-					lindices = bindices[lmask]
-					NL = ltime.size
-
-					for r in range(math.ceil(NL / R)):
-						rwindow = slice(r*R, (r+1)*R)
-						rtime = ltime[rwindow]
-						rdata = ldata[rwindow]
-						rindices = np.full(R, -1) # Convention is to store -1 for missing indices
-						rindices[:rtime.size] = lindices[rwindow]
-
-						stime.append(self.downsample_time(rtime))
-						sdata.append(self.downsample_data(rdata))
-						slabels.append(lb)
-						svariance.append(rdata.var(axis=0))
-						sdifftime.append(self.downsample_isi(rtime))
-						sindices.append(rindices) 
-
-				# Result is sorted by time
-				stime = np.array(stime, dtype=np.int64)
-				idx = np.argsort(stime)
-				slvb = SLVBatch(
-					time = stime[idx],
-					data = np.vstack(sdata)[idx],
-					labels = np.array(slabels, dtype=np.int64)[idx],
-					variance = np.vstack(svariance)[idx],
-					difftime = np.vstack(sdifftime)[idx],
-					indices = np.vstack(sindices)[idx],
-					overlap = 0
-				)
-
-				summary.append(slvb)
-
+			item_indices = global_state.load_index - global_state.load_start + O + np.arange(N, dtype=np.int64) # Get indices of the data in the original dataset
+			summary = self.summarize(item_time, item_data, item_labels, item_indices, B, item.ndim)
 			items[item_id] = SLLVBatch.from_llvb(item, summary)
 
 		return SLLVMultiBatch(items=items)
 
-	def downsample_data(self, data: npt.NDArray[np.float32]) -> npt.NDArray[np.float32]:
+	def summarize(self, 
+			time: npt.NDArray[np.int64], 
+			data: npt.NDArray[np.float32], 
+			labels: Labeling, 
+			indices: npt.NDArray[np.int64], 
+			B: int, 
+			M: int
+		) -> SLVBatch:
 		'''
-		This assumes data is NxM with N >= 1
+		Summarize each window of (up to) R consecutive samples of a label within a block.
+		All windows are found by one stable sort on (block, label), and summarized by segmented reductions.
+		Result is sorted by block, then by time.
+		'''
+		R = self.cfg['downsample_ratio']
+		ND = self.cfg['isi_subsamples']
+		N = time.size
+		if N == 0:
+			return SLVBatch.empty(M, ND, R)
+
+		# Segment the samples by (block, label, window)
+		blocks = np.arange(N, dtype=np.int64) // B
+		order = np.lexsort((labels, blocks)) # Samples of each (block, label) remain in time order
+		s_blocks = blocks[order]
+		s_labels = labels[order]
+		group_starts = np.flatnonzero(np.concatenate(([True], (s_blocks[1:] != s_blocks[:-1]) | (s_labels[1:] != s_labels[:-1]))))
+		rank = np.arange(N) - np.repeat(group_starts, np.diff(np.append(group_starts, N))) # Position within (block, label)
+		pos = rank % R # Position within window
+		starts = np.flatnonzero(pos == 0)
+		counts = np.diff(np.append(starts, N))
+		seg = np.cumsum(pos == 0) - 1 # Window of each sample
+		S = starts.size
+		s_time = time[order]
+
+		# Moments of the data, as products with the sparse window indicator matrix (much faster than np.add.reduceat along axis 0)
+		X = data.reshape((N, M))
+		n = counts[:, None].astype(X.dtype)
+		windows = sp.csr_matrix((np.ones(N, dtype=X.dtype), order, np.append(starts, N)), shape=(S, N))
+		seg_of = np.empty(N, dtype=np.int64) # Window of each sample, in the original order
+		seg_of[order] = seg
+		mean = (windows @ X) / n
+		sq_dev = X - mean[seg_of]
+		sq_dev *= sq_dev
+		svariance = (windows @ sq_dev) / n
+
+		stime = self.downsample_time(s_time, seg, starts, counts)
+		sdata = self.downsample_data(X, order, seg, pos, counts, mean)
+		sdifftime = self.downsample_isi(s_time, seg, pos, counts)
+		sindices = np.full((S, R), -1, dtype=np.int64) # Convention is to store -1 for missing indices
+		sindices[seg, pos] = indices[order]
+
+		# Result is sorted by time within each block
+		idx = np.lexsort((stime, s_blocks[starts]))
+		return SLVBatch(
+			time = stime[idx],
+			data = sdata[idx].reshape(mkshape(S, M)),
+			labels = s_labels[starts][idx],
+			variance = svariance[idx].astype(np.float32).reshape(mkshape(S, M)),
+			difftime = sdifftime[idx].reshape(mkshape(S, ND)),
+			indices = sindices[idx].reshape(mkshape(S, R)),
+			overlap = 0
+		)
+
+	def downsample_data(self, 
+			data: npt.NDArray[np.float32], 
+			order: npt.NDArray[np.int64], 
+			seg: npt.NDArray[np.int64], 
+			pos: npt.NDArray[np.int64], 
+			counts: npt.NDArray[np.int64],
+			mean: npt.NDArray[np.float32]
+		) -> npt.NDArray[np.float32]:
+		'''
+		Downsample (N, M) data into (S, M) per-segment values. Samples data[order] belong to segments seg,
+		at positions pos within their segment; counts and mean are the size and mean of every segment.
 		'''
 		method = self.cfg['downsample_data_method']
+		S = counts.size
+		M = data.shape[1]
 		if method == 'mean':
-			return np.mean(data, axis=0)
+			return mean.astype(np.float32)
 		elif method == 'median':
-			return np.median(data, axis=0)
+			# Sort segments padded to (S, M, R), in chunks of segments bounding the memory used
+			R = self.cfg['downsample_ratio']
+			result = np.empty((S, M), dtype=np.float32)
+			chunk = max(1, SUMMARIZE_CHUNK_SIZE // (M * R))
+			bounds = np.searchsorted(seg, np.arange(0, S + chunk, chunk))
+			for s0, (i0, i1) in zip(range(0, S, chunk), zip(bounds[:-1], bounds[1:])):
+				c = counts[s0:s0 + chunk]
+				padded = np.full((c.size, M, R), np.inf, dtype=np.float32)
+				padded[seg[i0:i1] - s0, :, pos[i0:i1]] = data[order[i0:i1]]
+				padded.sort(axis=2)
+				rows = np.arange(c.size)
+				result[s0:s0 + chunk] = (padded[rows, :, (c - 1) // 2] + padded[rows, :, c // 2]) / 2
+			return result
 		else:
 			raise ValueError(f'Unknown downsample_method: {method}')
 
-	def downsample_time(self, time: npt.NDArray[np.int64]) -> int:
+	def downsample_time(self, 
+			time: npt.NDArray[np.int64], 
+			seg: npt.NDArray[np.int64], 
+			starts: npt.NDArray[np.int64], 
+			counts: npt.NDArray[np.int64]
+		) -> npt.NDArray[np.int64]:
 		'''
-		This assumes len(time) is N with N >= 1
+		Downsample timestamps into per-segment values (see downsample_data()).
 		'''
 		method = self.cfg['downsample_time_method']
 		if method == 'mean':
-			return int(np.rint(np.mean(time)))
+			return np.rint(np.add.reduceat(time, starts) / counts).astype(np.int64)
 		elif method == 'median':
-			return np.median(time)
+			sorted_time = time[np.lexsort((time, seg))]
+			lo = sorted_time[starts + (counts - 1) // 2]
+			hi = sorted_time[starts + counts // 2]
+			return ((lo + hi) / 2).astype(np.int64)
 		else:
 			raise ValueError(f'Unknown downsample_method: {method}')
 
-	def downsample_isi(self, time: npt.NDArray[np.int64]) -> npt.NDArray[np.int64]:
+	def downsample_isi(self, 
+			time: npt.NDArray[np.int64], 
+			seg: npt.NDArray[np.int64], 
+			pos: npt.NDArray[np.int64], 
+			counts: npt.NDArray[np.int64]
+		) -> npt.NDArray[np.int64]:
 		'''
-		This assumes len(time) is N with N >= 1
-		If time is insufficiently large, isi is padded with -1 and intended to be filtered in postprocessing.
+		Per-segment inter-spike intervals, as an (S, isi_subsamples) array. 
+		Segments with more intervals are subsampled at random (without replacement); 
+		those with fewer are padded with -1, intended to be filtered in postprocessing.
 		'''
-		N = self.cfg['isi_subsamples']
-		isi = np.diff(time)
-		if isi.size > N:
-			return rng.choice(isi, size=N, replace=False)
-		elif isi.size < N:
-			return np.hstack((isi, np.full(N - isi.size, -1)))
-		return isi
-
-
+		ND = self.cfg['isi_subsamples']
+		S = counts.size
+		follows = pos[1:] > 0 # Interval to the previous sample in the same segment
+		isi = (time[1:] - time[:-1])[follows]
+		isi_seg = seg[1:][follows]
+		isi_rank = pos[1:][follows] - 1
+		sampled = (counts - 1 > ND)[isi_seg]
+		if sampled.any():
+			# Shuffle the intervals of subsampled segments
+			key = np.where(sampled, rng.random(isi.size), isi_rank)
+			order = np.lexsort((key, isi_seg))
+			isi = isi[order]
+			isi_starts = np.concatenate(([0], np.cumsum(counts - 1)[:-1]))
+			isi_rank = np.arange(isi.size) - isi_starts[isi_seg]
+		keep = isi_rank < ND
+		result = np.full((S, ND), -1, dtype=np.int64)
+		result[isi_seg[keep], isi_rank[keep]] = isi[keep]
+		return result
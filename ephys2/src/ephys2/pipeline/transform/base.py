@@ -2,9 +2,29 @@
 Base definitions for feature transform stages
 '''
 
+from abc import abstractmethod
+import numpy as np
+import numpy.typing as npt
+
 from ephys2.lib.types import *
 
 class TransformStage(ProcessingStage):
 
 	def type_map(self) -> Dict[type, type]:
 		return {VMultiBatch: VMultiBatch}
+
+class LinearTransformStage(ProcessingStage):
+	'''
+	Transform of (N x M) feature vectors which is linear for a fixed M,
+	so that consecutive linear stages can be precomposed into a single projection.
+	'''
+
+	def type_map(self) -> Dict[type, type]:
+		return {npt.NDArray[np.float32]: npt.NDArray[np.float32]}
+
+	@abstractmethod
+	def operator(self, M: int) -> npt.NDArray[np.float64]:
+		'''
+		(M x M') matrix A such that process(X) == X @ A.
+		'''
+		pass
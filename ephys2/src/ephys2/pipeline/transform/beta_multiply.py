@@ -5,17 +5,15 @@ import numpy as np
 import numpy.typing as npt
 
 from ephys2.lib.types import *
-from ephys2.lib.transforms import beta_weighted
+from ephys2.lib.transforms import beta_weighted, beta_weighted_operator
+from .base import LinearTransformStage
 
-class BetaMultiplyStage(ProcessingStage):
+class BetaMultiplyStage(LinearTransformStage):
 
     @staticmethod
     def name() -> str:
         return 'beta_multiply'
 
-    def type_map(self) -> Dict[type, type]:
-        return {npt.NDArray[np.float32]: npt.NDArray[np.float32]}
-
     @staticmethod
     def parameters() -> Parameters:
         return {
@@ -28,4 +26,7 @@ class BetaMultiplyStage(ProcessingStage):
         }
 
     def process(self, data: npt.NDArray[np.float32]) -> npt.NDArray[np.float32]:
-        return beta_weighted(data, self.cfg['beta'])
\ No newline at end of file
+        return beta_weighted(data, self.cfg['beta'])
+
+    def operator(self, M: int) -> npt.NDArray[np.float64]:
+        return beta_weighted_operator(M, self.cfg['beta'])
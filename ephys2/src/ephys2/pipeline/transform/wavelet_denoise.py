@@ -6,17 +6,15 @@ import numpy.typing as npt
 import pywt
 
 from ephys2.lib.types import *
-from ephys2.lib.transforms import truncated_dwt
+from ephys2.lib.transforms import truncated_dwt, truncated_dwt_operator
+from .base import LinearTransformStage
 
-class WaveletDenoiseStage(ProcessingStage):
+class WaveletDenoiseStage(LinearTransformStage):
 
     @staticmethod
     def name() -> str:
         return 'wavelet_denoise'
 
-    def type_map(self) -> Dict[type, type]:
-        return {npt.NDArray[np.float32]: npt.NDArray[np.float32]}
-
     @staticmethod
     def parameters() -> Parameters:
         return {
@@ -28,4 +26,7 @@ class WaveletDenoiseStage(ProcessingStage):
         }
 
     def process(self, data: npt.NDArray[np.float32]) -> npt.NDArray[np.float32]:
-        return truncated_dwt(data, self.cfg['wavelet'])
\ No newline at end of file
+        return truncated_dwt(data, self.cfg['wavelet'])
+
+    def operator(self, M: int) -> npt.NDArray[np.float64]:
+        return truncated_dwt_operator(M, self.cfg['wavelet'])
@@ -19,6 +19,7 @@ from ephys2.lib.mpi import MPI, mpi_try
 from ephys2.lib.utils import abs_path
 from ephys2.pipeline.eval import eval_cfg
 from ephys2.lib.singletons import logger, profiler, global_state
+from ephys2.lib.h5.llvbatch import H5LLVBatchSerializer
 
 
 def run_pipeline(filepath: str):
@@ -35,12 +36,23 @@ if __name__ == '__main__':
 	parser.add_argument('-v', '--verbose', help='Print debug statements', action='store_true', default=False)
 	parser.add_argument('-p', '--profile', help='Run with profiling enabled', action='store_true', default=False)
 	parser.add_argument('-d', '--debug', help='Run with deep checks enabled (slow)', action='store_true', default=False)
+	parser.add_argument('-f', '--force', help='Re-run all stages, ignoring up-to-date checkpoints', action='store_true', default=False)
+	parser.add_argument('--no-read-ahead', help='Disable reading the next batch in the background', action='store_true', default=False)
+	parser.add_argument('--write-queue', type=int, help='Number of batches queued for background checkpoint writes per process (0 to write synchronously)', default=global_state.write_queue_size)
+	parser.add_argument('--threads', type=int, help='Number of threads per process for multithreaded kernels (0 to use all cores)', default=global_state.n_threads)
+	parser.add_argument('--link-cache', type=int, help='Memory budget (in MB) for cached linkage matrices', default=None)
 	args = parser.parse_args()
 	varargs = vars(args)
 
 	logger.verbose = args.verbose
 	profiler.on = args.profile
 	global_state.debug = args.debug
+	global_state.use_cache = not args.force
+	global_state.read_ahead = not args.no_read_ahead
+	global_state.write_queue_size = args.write_queue
+	global_state.n_threads = args.threads
+	if args.link_cache is not None:
+		H5LLVBatchSerializer.memoized_links.max_bytes = args.link_cache * 2 ** 20
 
 	filepath = abs_path(varargs['cfg'])
 	if not os.path.exists(filepath):
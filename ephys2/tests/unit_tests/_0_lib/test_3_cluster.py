@@ -5,6 +5,7 @@ import numpy as np
 import pytest
 
 from ephys2.lib.cluster import *
+from ephys2 import _cpp
 
 def test_clustering_to_labeling():
 	N = 10
@@ -85,4 +86,50 @@ def test_link_labels_loopy():
 	assert np.allclose(exp_lb, link_labels_py(lb, linkage))
 	assert np.allclose(exp_lb, link_labels(lb, linkage))
 
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_link_label_map(seed):
+	# Union-find label map agrees with BFS over the graph
+	rng = np.random.default_rng(seed)
+	N = 200
+	pairs = [tuple(p) for p in rng.integers(0, N, size=(150, 2)) if p[0] != p[1]]
+	linkage = pairs_to_ev_graph(pairs, N)
+	lb = rng.integers(0, N, size=500)
+	exp_lb = link_labels_py(lb, linkage)
+	label_map = link_label_map(linkage)
+	assert label_map.shape == (N,)
+	assert np.array_equal(exp_lb, link_labels(lb, linkage))
+	assert np.array_equal(exp_lb, link_labels(lb, linkage, label_map))
+	for v in lb[:20]:
+		assert _cpp.find_connected_component(v, linkage.tuple()) == set(np.flatnonzero(label_map == label_map[v]))
 
+def test_link_label_map_out_of_range():
+	# Labels beyond the label map are unlinked, as in the native path
+	linkage = pairs_to_ev_graph([], 0)
+	lb = np.array([0, 3, 5])
+	label_map = link_label_map(linkage)
+	assert np.array_equal(link_labels(lb, linkage), lb)
+	assert np.array_equal(link_labels(lb, linkage, label_map), lb)
+	linkage = pairs_to_ev_graph([(1, 2)], 3)
+	lb = np.array([2, 0, 7, 1, 4])
+	assert np.array_equal(link_labels(lb, linkage, link_label_map(linkage)), link_labels(lb, linkage))
+
+
+
+@pytest.mark.parametrize('N, n', [(10, 10), (10, 3), (1000, 7)])
+def test_stratified_subsample(N, n):
+	where = stratified_subsample(N, n, random_seed=0)
+	assert where.size == n
+	assert np.all(np.diff(where) > 0) and where[0] >= 0 and where[-1] < N
+	# One sample per stratum
+	edges = np.arange(n + 1) * N // n
+	assert np.array_equal(np.searchsorted(edges, where, side='right') - 1, np.arange(n))
+
+def test_nearest_centroid_classify():
+	# Anisotropic clusters are separated by Mahalanobis, but not Euclidean, distance to the centroids
+	rng = np.random.default_rng(0)
+	scale = np.array([10, 0.1])
+	X = np.concatenate([rng.normal(size=(200, 2)) * scale, rng.normal(size=(200, 2)) * scale + [0, 1]])
+	labels = np.repeat(np.array([3, 5]), 200)
+	Y = np.array([[15, 0.1], [-15, 0.9]])
+	assert np.array_equal(nearest_centroid_classify(X, labels, Y), [3, 5])
+	assert np.mean(nearest_centroid_classify(X, labels, X, chunk_size=7) == labels) > 0.99
@@ -0,0 +1,37 @@
+'''
+Tests of per-label reductions
+'''
+
+import numpy as np
+import pytest
+
+from ephys2.lib.groupby import *
+
+@pytest.mark.parametrize('N', [0, 1, 100])
+@pytest.mark.parametrize('K', [1, 7])
+def test_group_stats(N, K):
+	rng = np.random.default_rng(0)
+	labels = rng.integers(-K, K, size=N) * 3
+	X = rng.normal(size=(N, 5)).astype(np.float32)
+	stats = group_stats(labels, X, median=True)
+	expected_labels = np.unique(labels)
+	assert np.array_equal(stats.labels, expected_labels)
+	assert stats.mean.shape == stats.var.shape == stats.median.shape == (expected_labels.size, 5)
+	for i, lb in enumerate(expected_labels):
+		x = X[labels == lb]
+		assert stats.count[i] == x.shape[0]
+		assert np.allclose(stats.sum[i], x.sum(axis=0), atol=1e-5)
+		assert np.allclose(stats.mean[i], x.mean(axis=0), atol=1e-5)
+		assert np.allclose(stats.var[i], x.var(axis=0), atol=1e-5)
+		assert np.allclose(stats.median[i], np.median(x, axis=0))
+
+def test_label_groups():
+	labels = np.array([3, 1, 3, 2, 1, 3])
+	groups = LabelGroups(labels)
+	assert np.array_equal(groups.labels, [1, 2, 3])
+	assert np.array_equal(groups.count(), [2, 1, 3])
+	assert np.array_equal(groups.labels[groups.inverse], labels)
+	# Samples keep their original order within each label
+	assert [list(ix) for ix in groups.indices()] == [[1, 4], [3], [0, 2, 5]]
+	assert [list(x) for x in groups.split(np.arange(6) * 10)] == [[10, 40], [30], [0, 20, 50]]
+	assert np.allclose(groups.mean(np.arange(6)), [2.5, 3, 7 / 3])
@@ -0,0 +1,115 @@
+'''
+Tests of UART decoding of auxiliary TTL inputs
+'''
+
+import numpy as np
+import pytest
+
+from ephys2.lib.intanutil.uart import *
+from ephys2.pipeline.input.intan.auxilliary import TTLSegment, decode_teensy_events
+
+def reference_decode_uart(binary_data, fs, baud_rate):
+	'''
+	Sequential scan (the original implementation)
+	'''
+	binary_int = binary_data.astype(int)
+	bit_samples = fs / baud_rate
+	decoded_bytes, byte_times = [], []
+	start_bit_queue = np.where(np.diff(binary_int) == -1)[0]
+	i = 0
+	while i < len(start_bit_queue):
+		idx = start_bit_queue[i]
+		if idx + 10 * bit_samples > len(binary_int):
+			break
+		start_idx = idx + 1
+		sb_idx = int(round(start_idx + 0.5 * bit_samples))
+		stop_idx = int(round(start_idx + 9.5 * bit_samples))
+		if binary_int[sb_idx] != 0 or binary_int[stop_idx] != 1:
+			i += 1
+			continue
+		data_bit_indices = []
+		cur = start_idx + bit_samples
+		while cur <= stop_idx - bit_samples + 1e-6:
+			data_bit_indices.append(int(round(cur)))
+			cur += bit_samples
+		if len(data_bit_indices) == 8:
+			decoded_bytes.append(sum(int(b) << b_i for b_i, b in enumerate(binary_int[data_bit_indices])))
+			byte_times.append(start_idx)
+			i += 1
+			while i < len(start_bit_queue) and start_bit_queue[i] <= stop_idx:
+				i += 1
+		else:
+			i += 1
+	return np.array(decoded_bytes, dtype=np.uint8), np.array(byte_times, dtype=int)
+
+def teensy_packet(channel_id: int, pulse_us: int, wait_us: int, corrupt: bool=False) -> bytes:
+	body = bytes([channel_id]) + pulse_us.to_bytes(4, 'little') + wait_us.to_bytes(4, 'little')
+	checksum = (sum(body[:5]) + int(corrupt)) % 256
+	return bytes([0xAA]) + body + bytes([checksum])
+
+def uart_ttl(data: bytes, bit_samples: int, rng: np.random.Generator, noise: float=0.) -> np.ndarray:
+	signal = [np.ones(37, dtype=int)]
+	for byte in data:
+		bits = [0] + [(byte >> j) & 1 for j in range(8)] + [1]
+		signal.append(np.repeat(bits, bit_samples))
+		signal.append(np.ones(rng.integers(0, 30), dtype=int))
+	signal = np.concatenate(signal)
+	flip = rng.random(signal.size) < noise
+	signal[flip] ^= 1
+	return signal
+
+@pytest.mark.parametrize('fs, baud_rate', [(30000, 3000), (30000, 2900), (20000, 7000)])
+@pytest.mark.parametrize('noise', [0., 0.01, 0.05])
+def test_decode_uart(fs, baud_rate, noise):
+	rng = np.random.default_rng(0)
+	data = bytes(rng.integers(0, 256, size=500).tolist())
+	signal = uart_ttl(data, int(round(fs / baud_rate)), rng, noise)
+	decoded, byte_times = decode_uart_from_ttl(signal, fs, baud_rate)
+	expected, expected_times = reference_decode_uart(signal, fs, baud_rate)
+	assert np.array_equal(decoded, expected)
+	assert np.array_equal(byte_times, expected_times)
+	if noise == 0 and baud_rate == 3000:
+		assert decoded.tobytes() == data
+
+def test_decode_uart_empty():
+	decoded, byte_times = decode_uart_from_ttl(np.array([], dtype=int), 30000, 3000)
+	assert decoded.size == byte_times.size == 0
+	decoded, byte_times = decode_uart_from_ttl(np.ones(1000, dtype=int), 30000, 3000)
+	assert decoded.size == byte_times.size == 0
+
+def test_decode_serial_packets():
+	# A marker inside a packet is not a packet start, and a truncated packet is dropped
+	data = b'\x01' + teensy_packet(3, 1500, 2000) + teensy_packet(0xAA, 10, 20, corrupt=True) + teensy_packet(5, 0, 70000)[:-1]
+	packets = decode_serial_packets(np.frombuffer(data, dtype=np.uint8), np.arange(len(data)) * 10)
+	assert packets == [
+		dict(startMarker=0xAA, channelID=3, detectionTime=10, waitTime=2.0, pulseWidth=1.5, valid=True),
+		dict(startMarker=0xAA, channelID=0xAA, detectionTime=120, waitTime=0.02, pulseWidth=0.01, valid=False),
+	]
+	assert decode_serial_packets(np.array([], dtype=np.uint8), np.array([], dtype=int)) == []
+
+@pytest.mark.parametrize('n_segments', [1, 2, 17])
+def test_decode_teensy_events(n_segments):
+	rng = np.random.default_rng(1)
+	fs, baud_rate = 30000, 3000
+	packets = [teensy_packet(int(c), 100, int(w), corrupt=bool(k % 7 == 3)) for k, (c, w) in enumerate(zip(rng.integers(0, 4, 40), rng.integers(0, 5000, 40)))]
+	signal = uart_ttl(b''.join(packets), 10, rng)
+	time = np.arange(signal.size) + 12345
+
+	# Expected: decode of the whole signal
+	decoded, byte_times = reference_decode_uart(signal, fs, baud_rate)
+	expected = dict()
+	for p in decode_serial_packets(decoded, time[byte_times]):
+		if p['valid']:
+			offset = int(round(((p['waitTime'] + 0.36) / 1000.0) * fs))
+			expected.setdefault(str(p['channelID']), []).append(p['detectionTime'] - offset)
+	assert sum(len(ts) for ts in expected.values()) == sum(k % 7 != 3 for k in range(40))
+
+	# Segments split anywhere (including mid-frame), in any order
+	bounds = np.concatenate(([0], np.sort(rng.choice(np.arange(1, signal.size), n_segments - 1, replace=False)), [signal.size]))
+	segments = [TTLSegment.from_ttl(signal[a:b], time[a:b]) for a, b in zip(bounds[:-1], bounds[1:])]
+	rng.shuffle(segments)
+	events = decode_teensy_events(segments, fs, baud_rate)
+	assert list(events.keys()) == list(expected.keys())
+	for cid in expected:
+		assert np.array_equal(events[cid], expected[cid])
+	assert decode_teensy_events([], fs, baud_rate) == {}
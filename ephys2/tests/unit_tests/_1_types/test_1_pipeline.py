@@ -0,0 +1,64 @@
+'''
+Tests of pipeline content hashing
+'''
+import copy
+import os
+import numpy as np
+
+from ephys2.lib.types import *
+from ephys2.lib.utils import ephys2_version
+import ephys2.lib.types.pipeline as pipeline_module
+from ephys2.pipeline.stages import ALL_STAGES
+from tests.utils import *
+
+CFG = [
+	{'test.input.integers': {'start': 0, 'stop': 10}},
+	'test.reduce.average',
+]
+
+def parse(cfg: list) -> Pipeline:
+	return Pipeline.parse(copy.deepcopy(cfg), ALL_STAGES, effectful=False)
+
+def test_cache_keys_deterministic():
+	keys1 = parse(CFG).cache_keys()
+	keys2 = parse(CFG).cache_keys()
+	assert keys1 == keys2
+	assert len(keys1) == 2
+	assert keys1[0] != keys1[1]
+
+def test_cache_keys_chained():
+	cfg = copy.deepcopy(CFG)
+	cfg[0]['test.input.integers']['stop'] = 11
+	keys1 = parse(CFG).cache_keys()
+	keys2 = parse(cfg).cache_keys()
+	# Changing an upstream stage invalidates all downstream stages
+	assert keys1[0] != keys2[0]
+	assert keys1[1] != keys2[1]
+
+def test_cache_keys_code_version():
+	# A source tree is identified by the hash of its code, so changing the code invalidates all stages
+	assert ephys2_version() != 'unknown'
+	keys1 = parse(CFG).cache_keys()
+	try:
+		pipeline_module.ephys2_version = lambda: 'changed'
+		keys2 = parse(CFG).cache_keys()
+	finally:
+		pipeline_module.ephys2_version = ephys2_version
+	assert keys1[0] != keys2[0] and keys1[1] != keys2[1]
+
+def test_fingerprint_input_file():
+	fpath = rel_path('data/fingerprint_test.txt')
+	try:
+		with open(fpath, 'w') as f:
+			f.write('a')
+		param = ROFileParameter(None, '')
+		fp1 = fingerprint_value(param, fpath)
+		assert fp1 == fingerprint_value(param, fpath)
+		with open(fpath, 'w') as f:
+			f.write('ab')
+		assert fp1 != fingerprint_value(param, fpath)
+		# Non-input parameters are fingerprinted by value only
+		assert fingerprint_value(RWFileParameter(None, ''), fpath) == fpath
+		assert fingerprint_value(IntParameter(None, '', 0, np.inf), np.inf) == 'inf'
+	finally:
+		remove_if_exists(fpath)
@@ -183,3 +183,32 @@ def test_e2e_full_links():
 
 
 
+
+'''
+Test label map
+'''
+
+def test_label_map():
+	path = rel_path('data/test_label_map.h5')
+	try:
+		linkage = pairs_to_ev_graph([(0, 4), (4, 2), (3, 5)], 6)
+		with h5py.File(path, 'w') as file:
+			li_dir = file.create_group('linkage')
+			li_dir.attrs['shape'] = linkage.shape
+			li_dir.create_dataset('data', data=linkage.data)
+			li_dir.create_dataset('indices', data=linkage.indices)
+			li_dir.create_dataset('indptr', data=linkage.indptr)
+		expected = np.array([0, 1, 0, 3, 0, 3])
+		with h5py.File(path, 'a') as file:
+			# Computed from the links
+			assert np.array_equal(H5LLVBatchSerializer.load_label_map(file), expected)
+			# Persisted next to the links
+			H5LLVBatchSerializer.save_label_map(file)
+			assert np.array_equal(file['label_map'][:], expected)
+			# Removed when the links change
+			H5LLVBatchSerializer.replace_links(file, pairs_to_ev_graph([(1, 5)], 6))
+			assert not ('label_map' in file)
+			assert np.array_equal(H5LLVBatchSerializer.load_label_map(file), [0, 1, 2, 3, 4, 1])
+	finally:
+		H5LLVBatchSerializer.memoized_links.clear()
+		remove_if_exists(path)
@@ -0,0 +1,88 @@
+'''
+Tests of HDF5 utilities
+'''
+
+import numpy as np
+import h5py
+import pytest
+
+from tests.utils import *
+
+from ephys2.lib.h5.utils import *
+
+@pytest.mark.repeat(5)
+@pytest.mark.parametrize('block_size', [1, 3, 16, None])
+def test_time_index_search(block_size):
+	outpath = rel_path('data/test_time_index.h5')
+	try:
+		N = np.random.randint(1, 200)
+		time = np.unique(np.random.randint(0, 1000, size=N))
+		queries = np.concatenate([time, np.random.randint(-10, 1010, size=50)])
+		with h5py.File(outpath, 'w') as file:
+			ds = file.create_dataset('time', data=time)
+			expected = [binary_search_interval(ds, q) for q in queries]
+			write_time_index(ds, block_size)
+			assert read_time_index(ds) is not None
+			assert file['time_index'].attrs['min'] == time[0]
+			assert file['time_index'].attrs['max'] == time[-1]
+			result = [binary_search_interval(ds, q) for q in queries]
+			assert result == expected
+	finally:
+		remove_if_exists(outpath)
+
+def test_time_index_stale():
+	outpath = rel_path('data/test_time_index.h5')
+	try:
+		with h5py.File(outpath, 'w') as file:
+			group = file.create_group('item')
+			ds = group.create_dataset('time', data=np.arange(10), maxshape=(None,))
+			write_time_indices(file)
+			assert 'time_index' in group
+			ds.resize((20,))
+			ds[10:] = np.arange(10, 20)
+			# Index no longer describes the dataset; fall back to binary search
+			assert read_time_index(ds) is None
+			assert binary_search_interval(ds, 15) == (15, 15)
+	finally:
+		remove_if_exists(outpath)
+
+@pytest.mark.repeat(5)
+@pytest.mark.parametrize('block_size', [1, 4, 16])
+def test_time_index_search_duplicates(block_size):
+	outpath = rel_path('data/test_time_index.h5')
+	try:
+		time = np.sort(np.random.randint(0, 30, size=np.random.randint(1, 200)))
+		queries = np.concatenate([time, np.random.randint(-5, 35, size=50)])
+		with h5py.File(outpath, 'w') as file:
+			ds = file.create_dataset('time', data=time)
+			expected = [binary_search_interval(ds, q) for q in queries]
+			write_time_index(ds, block_size)
+			assert [binary_search_interval(ds, q) for q in queries] == expected
+		assert [search_interval(time, q) for q in queries] == expected
+		for q, (lo, hi) in zip(queries, expected):
+			if q in time:
+				# First occurrence
+				assert lo == hi == np.flatnonzero(time == q)[0]
+			else:
+				assert time[lo] <= max(q, time[0]) and time[hi] >= min(q, time[-1]) and hi - lo <= 1
+	finally:
+		remove_if_exists(outpath)
+
+def test_time_index_search_repeated_block():
+	time = np.array([0, 0, 0, 0, 0, 0, 1, 1, 2, 2, 2, 2, 2])
+	outpath = rel_path('data/test_time_index.h5')
+	try:
+		with h5py.File(outpath, 'w') as file:
+			ds = file.create_dataset('time', data=time)
+			write_time_index(ds, 4)
+			assert binary_search_interval(ds, 0) == (0, 0)
+			assert binary_search_interval(ds, 1) == (6, 6)
+			assert binary_search_interval(ds, 2) == (8, 8)
+			assert binary_search_interval(ds, 3) == (12, 12)
+			assert binary_search_interval(ds, -1) == (0, 0)
+			# Rewritten in place with the same size: the index is stale
+			ds[:] = time + 1
+			assert read_time_index(ds) is None
+			assert binary_search_interval(ds, 1) == (0, 0)
+	finally:
+		remove_if_exists(outpath)
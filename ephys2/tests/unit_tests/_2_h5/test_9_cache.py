@@ -0,0 +1,108 @@
+'''
+Tests of HDF5 data caching
+'''
+
+import numpy as np
+import h5py
+import pytest
+
+from tests.utils import *
+
+from ephys2.lib.h5 import *
+from ephys2.lib.sparse import *
+from ephys2.lib.cluster import add_links
+
+def test_lru_budget():
+	cache = H5Cache(100)
+	cache.put(('f', 'a', 0), 'a', 40)
+	cache.put(('f', 'b', 0), 'b', 40)
+	assert cache.get(('f', 'a', 0)) == 'a' # 'b' is now least-recently used
+	cache.put(('f', 'c', 0), 'c', 40)
+	assert ('f', 'b', 0) not in cache
+	assert cache.get(('f', 'a', 0)) == 'a'
+	assert cache.nbytes == 80
+	cache.put(('f', 'd', 0), 'd', 200) # Larger than the budget
+	assert ('f', 'd', 0) not in cache
+	cache.max_bytes = 50
+	assert len(cache) == 1 and cache.nbytes == 40
+
+def test_invalidate():
+	cache = H5Cache(100)
+	cache.put(('/f1', 'a', 0), 'a', 1)
+	cache.put(('/f1', 'a', 1), 'a', 1)
+	cache.put(('/f1', 'b', 0), 'b', 1)
+	cache.put(('/f2', 'a', 0), 'a', 1)
+	cache.invalidate('/f1', 'a')
+	assert len(cache) == 2
+	cache.invalidate('/f1')
+	assert len(cache) == 1 and ('/f2', 'a', 0) in cache
+
+def test_load_replace_links():
+	outpath = rel_path('data/test_cache.h5')
+	try:
+		with h5py.File(outpath, 'w') as file:
+			file.attrs['generation'] = 'g0'
+			for item_id in ['0', '1']:
+				li_dir = file.create_group(item_id).create_group('linkage')
+				li_dir.attrs['shape'] = (0, 4)
+				li_dir.create_dataset('data', data=np.zeros(0, dtype=bool))
+				li_dir.create_dataset('indices', data=np.zeros(0, dtype=np.int64))
+				li_dir.create_dataset('indptr', data=np.zeros(1, dtype=np.int64))
+		cache = H5LLVBatchSerializer.memoized_links
+		cache.clear()
+		with h5py.File(outpath, 'a') as file:
+			links0 = H5LLVBatchSerializer.load_links(file['0'])
+			links1 = H5LLVBatchSerializer.load_links(file['1'])
+			assert H5LLVBatchSerializer.load_links(file['0']) is links0
+			assert len(cache) == 2
+			# Edits only invalidate the edited item
+			new_links = add_links(links0, [0, 1])
+			H5LLVBatchSerializer.replace_links(file['0'], new_links)
+			assert len(cache) == 2
+			assert H5LLVBatchSerializer.load_links(file['0']) is new_links
+			assert H5LLVBatchSerializer.load_links(file['1']) is links1
+		# Re-opening the file preserves cached entries
+		with h5py.File(outpath, 'r') as file:
+			assert H5LLVBatchSerializer.load_links(file['0']) is new_links
+		# Re-writing the file does not
+		with h5py.File(outpath, 'a') as file:
+			file.attrs['generation'] = 'g1'
+			assert H5LLVBatchSerializer.load_links(file['0']) is not new_links
+			assert H5LLVBatchSerializer.load_links(file['0']) == new_links
+	finally:
+		H5LLVBatchSerializer.memoized_links.clear()
+		remove_if_exists(outpath)
+
+def test_failed_split_preserves_links():
+	outpath = rel_path('data/test_cache.h5')
+	replace = H5CSRSerializer.replace
+	try:
+		with h5py.File(outpath, 'w') as file:
+			item = file.create_group('0')
+			item.attrs['block_size'] = 4
+			item.create_dataset('labels', data=np.array([0, 0, 1, 1, 4, 4, 5, 5], dtype=np.int64))
+			li_dir = item.create_group('linkage')
+			li_dir.attrs['shape'] = (1, 8)
+			li_dir.create_dataset('data', data=np.ones(2, dtype=bool))
+			li_dir.create_dataset('indices', data=np.array([1, 4], dtype=np.int64))
+			li_dir.create_dataset('indptr', data=np.array([0, 2], dtype=np.int64))
+		H5LLVBatchSerializer.memoized_links.clear()
+		with h5py.File(outpath, 'a') as file:
+			links = H5LLVBatchSerializer.load_links(file['0'])
+			expected = links.copy()
+			def fail(*args):
+				raise OSError('Failed write')
+			H5CSRSerializer.replace = fail
+			with pytest.raises(OSError):
+				H5LLVBatchSerializer.split_1d(file['0'], 4, 4)
+			# Neither the memoized links nor the caller's links were edited
+			assert links == expected
+			assert H5LLVBatchSerializer.load_links(file['0']) == expected
+			H5CSRSerializer.replace = replace
+			new_links, _ = H5LLVBatchSerializer.split_1d(file['0'], 4, 4, links)
+			assert links == expected and new_links != expected
+			assert H5LLVBatchSerializer.load_links(file['0']) is new_links
+	finally:
+		H5CSRSerializer.replace = replace
+		H5LLVBatchSerializer.memoized_links.clear()
+		remove_if_exists(outpath)
@@ -0,0 +1,50 @@
+'''
+Tests of batch loading
+'''
+
+import numpy as np
+import h5py
+import pytest
+
+from tests.utils import *
+
+from ephys2.lib.loader import *
+from ephys2.lib.singletons import global_state
+
+def write_vmultibatch(path: str, N: int):
+	with h5py.File(path, 'w') as file:
+		for item_id in ['0', '1']:
+			group = file.create_group(item_id)
+			group.create_dataset('time', data=np.arange(N, dtype=np.int64), chunks=(7,))
+			group.create_dataset('data', data=np.random.randn(N, 4).astype(np.float32), chunks=(7, 4))
+
+def load_all(path: str, rank: int, n_workers: int) -> List[VMultiBatch]:
+	loader = VMultiBatchLoader(rank, n_workers, 0, np.inf, 20, 3)
+	batches = []
+	while True:
+		with h5py.File(path, 'r') as file:
+			data = loader.load(file)
+		if data is None:
+			break
+		batches.append(data)
+	assert loader.read_ahead_executor is None and len(loader.read_ahead_files) == 0
+	return batches
+
+@pytest.mark.parametrize('n_workers', [1, 3])
+def test_read_ahead(n_workers):
+	path = rel_path('data/test_loader.h5')
+	try:
+		write_vmultibatch(path, 200)
+		for rank in range(n_workers):
+			global_state.read_ahead = False
+			expected = load_all(path, rank, n_workers)
+			global_state.read_ahead = True
+			result = load_all(path, rank, n_workers)
+			assert len(result) == len(expected) > 0
+			for x, y in zip(result, expected):
+				assert x == y
+		# Read-ahead handles are released, so the file can be re-written
+		write_vmultibatch(path, 10)
+	finally:
+		global_state.read_ahead = True
+		remove_if_exists(path)
@@ -0,0 +1,57 @@
+'''
+Tests of background writing of worker files
+'''
+
+import threading
+import pytest
+
+from ephys2.lib.h5 import *
+
+class MockSerializer:
+	rank = 0
+	filepath = 'mock.h5'
+
+	def __init__(self, fail_at: int=-1):
+		self.written = []
+		self.fail_at = fail_at
+		self.release = threading.Event()
+
+	def write(self, data):
+		self.release.wait()
+		if data == self.fail_at:
+			raise ValueError('Failed write')
+		self.written.append(data)
+
+def test_async_writer_order():
+	serializer = MockSerializer()
+	serializer.release.set()
+	writer = H5AsyncWriter(serializer, 2)
+	for i in range(100):
+		writer.write(i)
+	writer.close()
+	assert serializer.written == list(range(100))
+
+def test_async_writer_backpressure():
+	serializer = MockSerializer()
+	writer = H5AsyncWriter(serializer, 2)
+	for i in range(3): # One batch is held by the writer thread
+		writer.write(i)
+	blocked = threading.Thread(target=writer.write, args=(3,))
+	blocked.start()
+	blocked.join(timeout=0.2)
+	assert blocked.is_alive() # Queue is full
+	serializer.release.set()
+	blocked.join()
+	writer.close()
+	assert serializer.written == [0, 1, 2, 3]
+
+def test_async_writer_error():
+	serializer = MockSerializer(fail_at=1)
+	writer = H5AsyncWriter(serializer, 2) # One batch is held by the writer thread
+	writer.write(0)
+	writer.write(1)
+	writer.write(2)
+	serializer.release.set() # Fail only once all batches are queued
+	with pytest.raises(RuntimeError):
+		writer.close()
+	assert serializer.written == [0]
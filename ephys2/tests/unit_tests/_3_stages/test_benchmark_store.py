@@ -0,0 +1,135 @@
+'''
+Tests of the benchmark store
+'''
+import numpy as np
+import h5py
+import multiprocessing
+
+from tests.utils import *
+
+from ephys2.pipeline.benchmark.extrinsic import *
+from ephys2.pipeline.benchmark.intrinsic import *
+from ephys2.pipeline.benchmark.store import *
+
+def extrinsic_benchmark(method: str, dataset: str, accuracy: float) -> ExtrinsicBenchmark:
+	return ExtrinsicBenchmark(
+		method=method, dataset=dataset,
+		full_CM=[[1, 0], [0, 1]], matched_CM=[[1, 0], [0, 1]], pair_CM=[[1, 0], [0, 1]],
+		full_accuracy=accuracy, matched_accuracy=accuracy, precision=[1.0, 0.5], recall=[0.5, 1.0],
+		full_homogeneity=1, matched_homogeneity=1, full_completeness=1, matched_completeness=1,
+		adj_rand_index=1, false_positive_rate=0, false_negative_rate=0.1
+	)
+
+def test_benchmark_store():
+	path = rel_path('data/test_benchmark_store.h5')
+	remove_if_exists(path)
+	try:
+		store = BenchmarkStore(path)
+		benchmarks = [
+			extrinsic_benchmark('m1', 'd1', 0.5),
+			IntrinsicBenchmark(method='m1', dataset='d2', chgroups={}),
+			extrinsic_benchmark('m2', 'd1', 0.7),
+		]
+		for bm in benchmarks:
+			store.append(bm)
+		assert store.size == 3
+		assert store.categories('dataset') == ['d1', 'd2']
+		assert store.categories('tag') == ['ExtrinsicBenchmark', 'IntrinsicBenchmark']
+		assert store.select(dataset='d1').tolist() == [0, 2]
+		assert store.select(dataset='d1', method='m2').tolist() == [2]
+		assert store.select(dataset='d3').size == 0
+		metrics = store.metrics(np.arange(3))
+		assert np.allclose(metrics['full_accuracy'], [0.5, np.nan, 0.7], equal_nan=True)
+		expected = [type(bm).from_json(bm.to_json()) for bm in benchmarks]
+		assert store.load(store.select(tag='ExtrinsicBenchmark')) == [expected[0], expected[2]]
+		assert store.load([1]) == [expected[1]]
+	finally:
+		remove_if_exists(path)
+		remove_if_exists(path + '.lock')
+
+def test_benchmark_stage_appends():
+	path = rel_path('data/test_benchmark_store.h5')
+	remove_if_exists(path)
+	try:
+		stage = IntrinsicBenchmarksStage({'output_file': path, 'method_name': 'm', 'dataset_name': 'd'})
+		stage.initialize()
+		for _ in range(2):
+			stage.reduce()
+		store = BenchmarkStore(path)
+		assert store.size == 2
+		assert store.load(store.select(method='m')) == [IntrinsicBenchmark(method='m', dataset='d', chgroups={})] * 2
+	finally:
+		remove_if_exists(path)
+		remove_if_exists(path + '.lock')
+
+def test_is_benchmark_store():
+	path = rel_path('data/test_benchmark_store.h5')
+	remove_if_exists(path)
+	try:
+		assert not is_benchmark_store(rel_path('data/test_benchmark_store.json'))
+		assert is_benchmark_store(path) # New store
+		BenchmarkStore(path).append(extrinsic_benchmark('m1', 'd1', 0.5))
+		assert is_benchmark_store(path)
+		# JSON results under an .h5 name are still written as JSON
+		with open(path, 'w') as file:
+			file.write('{}')
+		assert not is_benchmark_store(path)
+		stage = IntrinsicBenchmarksStage({'output_file': path, 'method_name': 'm', 'dataset_name': 'd'})
+		stage.initialize()
+		stage.reduce()
+		with open(path, 'r') as file:
+			assert IntrinsicBenchmark.from_json(file.read()) == IntrinsicBenchmark(method='m', dataset='d', chgroups={})
+		# Other HDF5 files are not stores
+		with h5py.File(path, 'w') as file:
+			file.attrs['tag'] = 'LTMultiBatch'
+		assert not is_benchmark_store(path)
+	finally:
+		remove_if_exists(path)
+		remove_if_exists(path + '.lock')
+
+def test_benchmark_store_interrupted_append():
+	path = rel_path('data/test_benchmark_store.h5')
+	remove_if_exists(path)
+	try:
+		store = BenchmarkStore(path)
+		store.append(extrinsic_benchmark('m1', 'd1', 0.5))
+		# Simulate an append which wrote some columns, but not n_rows
+		with h5py.File(path, 'a') as file:
+			append_column(file['keys/dataset'], 'categories', 1, np.array(['d2'], dtype=object), STR_DTYPE, None)
+			append_column(file['keys/dataset'], 'codes', 1, np.array([1], dtype=np.int32), np.int32, -1)
+			append_column(file['metrics'], 'full_accuracy', 1, np.array([0.9]), np.float64, np.nan)
+		assert store.size == 1
+		assert store.categories('dataset') == ['d1']
+		assert store.select(dataset='d2').size == 0
+		store.append(extrinsic_benchmark('m2', 'd3', 0.7))
+		assert store.size == 2
+		assert store.categories('dataset') == ['d1', 'd3']
+		assert np.allclose(store.metrics(np.arange(2), ['full_accuracy'])['full_accuracy'], [0.5, 0.7])
+		assert [bm.dataset for bm in store.load(np.arange(2))] == ['d1', 'd3']
+	finally:
+		remove_if_exists(path)
+		remove_if_exists(path + '.lock')
+
+def append_many(path: str, method: str):
+	store = BenchmarkStore(path)
+	for i in range(10):
+		store.append(extrinsic_benchmark(method, f'd{i % 3}', i / 10))
+
+def test_benchmark_store_concurrent_appends():
+	path = rel_path('data/test_benchmark_store.h5')
+	remove_if_exists(path)
+	try:
+		ctx = multiprocessing.get_context('fork')
+		procs = [ctx.Process(target=append_many, args=(path, f'm{p}')) for p in range(4)]
+		for proc in procs:
+			proc.start()
+		for proc in procs:
+			proc.join()
+			assert proc.exitcode == 0
+		store = BenchmarkStore(path)
+		assert store.size == 40
+		for p in range(4):
+			assert store.select(method=f'm{p}').size == 10
+	finally:
+		remove_if_exists(path)
+		remove_if_exists(path + '.lock')
@@ -0,0 +1,100 @@
+'''
+Tests of extrinsic benchmarks
+'''
+import numpy as np
+import h5py
+
+from tests.utils import *
+
+from ephys2 import _cpp
+from ephys2.lib.types import *
+from ephys2.lib.h5.utils import binary_search_interval
+from ephys2.pipeline.benchmark.extrinsic import *
+
+def test_extrinsic_contingencies():
+	path = rel_path('data/test_extrinsic_gt.h5')
+	rng = np.random.default_rng(0)
+	N, K = 3000, 6
+	gt_time = np.sort(rng.choice(N * 50, size=N, replace=False)).astype(np.int64)
+	gt_labels = rng.integers(0, K, size=N)
+	# Estimate: jittered, partially relabeled & subsampled ground-truth, plus false positives
+	keep = rng.random(N) < 0.9
+	est_time = np.concatenate((gt_time[keep] + rng.integers(-2, 3, size=keep.sum()), rng.integers(0, N * 50, size=100)))
+	est_labels = np.concatenate(((gt_labels[keep] + (rng.random(keep.sum()) < 0.1)) % K, rng.integers(0, K, size=100)))
+	order = np.argsort(est_time, kind='stable')
+	est_time, est_labels = est_time[order], est_labels[order]
+	try:
+		with h5py.File(path, 'w') as file:
+			file.attrs['tag'] = 'LTMultiBatch'
+			for item_id in ['0', '1']:
+				file.create_dataset(f'{item_id}/time', data=gt_time)
+				file.create_dataset(f'{item_id}/labels', data=gt_labels)
+		stage = ExtrinsicBenchmarksStage({
+			'output_file': 'extrinsic.json',
+			'method_name': 'test',
+			'dataset_name': 'test',
+			'ground_truth_data': path,
+			'max_dt_ground_truth': 0.1,
+		})
+		stage.typecheck(LVMultiBatch)
+		stage.initialize()
+		max_dt_samples = math.ceil(0.1 * global_metadata['sampling_rate'] / 1000)
+		expected = {'0': dict(), '1': dict()}
+		bounds = np.linspace(0, est_time.size, 6).astype(int)
+		with h5py.File(path, 'r') as gt_file:
+			for start, stop in zip(bounds[:-1], bounds[1:]):
+				batch = LVMultiBatch(items={
+					item_id: LVBatch(time=est_time[start:stop], data=np.zeros((stop - start, 1), dtype=np.float32), labels=est_labels[start:stop], overlap=0)
+					for item_id in ['0', '1']
+				})
+				stage.process(batch)
+				# Reference: per-batch search of the file and sequence alignment
+				for item_id in ['0', '1']:
+					start_idx, _ = binary_search_interval(gt_file[item_id]['time'], est_time[start])
+					_, stop_idx = binary_search_interval(gt_file[item_id]['time'], est_time[stop - 1])
+					aligned = _cpp.align_sequences(
+						gt_time[start_idx:stop_idx], est_time[start:stop], 
+						gt_labels[start_idx:stop_idx], est_labels[start:stop], 
+						max_dt_samples, stage.fp_label
+					)
+					for (gt_lbl, est_lbl), count in zip(*np.unique(aligned, axis=0, return_counts=True)):
+						expected[item_id][(gt_lbl, est_lbl)] = expected[item_id].get((gt_lbl, est_lbl), 0) + count
+		assert stage.CTs == expected
+
+		merged = merge_contingency_tables(stage.CTs, {'1': {(0, 0): 1}, '2': {(1, 1): 2}})
+		assert merged['0'] == expected['0']
+		assert merged['1'][(0, 0)] == expected['1'].get((0, 0), 0) + 1
+		assert merged['2'] == {(1, 1): 2}
+		assert stage.CTs == expected # Inputs are not modified
+
+		benchmark = stage.run_benchmark()
+		assert 0.5 < benchmark.matched_accuracy < 1
+		assert 0 < benchmark.false_negative_rate < 0.2
+	finally:
+		remove_if_exists(path)
+
+def test_ground_truth_interval_duplicates():
+	path = rel_path('data/test_extrinsic_gt_dup.h5')
+	gt_time = np.array([0, 5, 5, 5, 9, 12, 12, 20], dtype=np.int64)
+	try:
+		with h5py.File(path, 'w') as file:
+			file.attrs['tag'] = 'LTMultiBatch'
+			file.create_dataset('0/time', data=gt_time)
+			file.create_dataset('0/labels', data=np.arange(gt_time.size))
+		stage = ExtrinsicBenchmarksStage({
+			'output_file': 'extrinsic.json',
+			'method_name': 'test',
+			'dataset_name': 'test',
+			'ground_truth_data': path,
+			'max_dt_ground_truth': 0.1,
+		})
+		stage.initialize()
+		with h5py.File(path, 'r') as gt_file:
+			for t0, t1 in [(5, 12), (4, 12), (5, 13), (-1, 5), (12, 30), (6, 8), (0, 20)]:
+				start_idx, _ = binary_search_interval(gt_file['0']['time'], t0)
+				_, stop_idx = binary_search_interval(gt_file['0']['time'], t1)
+				times, labels = stage.ground_truth_interval('0', np.array([t0, t1], dtype=np.int64))
+				assert np.array_equal(times, gt_time[start_idx:stop_idx])
+				assert np.array_equal(labels, np.arange(gt_time.size)[start_idx:stop_idx])
+	finally:
+		remove_if_exists(path)
@@ -0,0 +1,70 @@
+'''
+Tests of the feature transform & clustering steps of labeling
+'''
+import numpy as np
+import pytest
+
+from ephys2.lib.types import *
+from ephys2.pipeline.label import LabelStage
+
+def label_stage(transform: list, cluster_subsample=np.inf) -> LabelStage:
+	stage = validate_config_stage({
+		'transform': transform,
+		'cluster': {'isosplit': {
+			'n_components': 10,
+			'isocut_threshold': 0.9,
+			'min_cluster_size': 8,
+			'K_init': 200,
+			'refine_clusters': False,
+			'max_iterations_per_pass': 500,
+			'jitter': 0.001,
+		}},
+		'link': {'segmentation_fusion': {
+			'link_threshold': 0.0,
+			'link_sig_s': 0.005,
+			'link_sig_k': 0.03,
+		}},
+		'cluster_subsample': cluster_subsample,
+		'n_channels': 4,
+		'link_in_feature_space': False,
+	}, LabelStage)
+	stage.initialize()
+	return stage
+
+@pytest.mark.parametrize('transform', [
+	[],
+	[{'beta_multiply': {'beta': 3}}],
+	[{'wavelet_denoise': {'wavelet': 'sym2'}}],
+	[{'beta_multiply': {'beta': 3}}, {'wavelet_denoise': {'wavelet': 'db4'}}],
+	[{'wavelet_denoise': {'wavelet': 'haar'}}, {'beta_multiply': {'beta': 2}}, {'wavelet_denoise': {'wavelet': 'sym2'}}],
+])
+def test_fused_transform(transform):
+	stage = label_stage(transform)
+	X = np.random.randn(100, 4 * 31).astype(np.float32)
+	# Stage-by-stage reference
+	Y = X.reshape((400, 31))
+	for s in stage.cfg['transform'].stages:
+		Y = s.process(Y)
+	Y = Y.reshape((100, -1))
+	Y_fused = stage.feature_transform(X)
+	assert Y_fused.dtype == np.float32
+	assert Y_fused.shape == Y.shape
+	assert np.allclose(Y_fused, Y, atol=1e-4)
+	# Linear stages are precomposed into at most one matrix per waveform length
+	assert len(stage.feature_plan(31)) == min(1, len(transform))
+	assert stage.feature_plan(31) is stage.feature_plans[31]
+
+def test_subsample_clustering():
+	# Large blocks are clustered on a subsample, and the remaining samples assigned to their clusters
+	rng = np.random.default_rng(0)
+	centers = rng.normal(size=(3, 16)) * 20
+	truth = np.repeat(np.arange(3), 400)
+	X = (centers[truth] + rng.normal(size=(1200, 16))).astype(np.float32)
+	stage = label_stage([], cluster_subsample=300)
+	labels = stage.cluster(X)
+	assert labels.dtype == np.int64
+	assert np.array_equal(np.unique(labels), np.arange(3))
+	for k in range(3):
+		assert np.unique(labels[truth == k]).size == 1
+	# Small blocks are clustered in full
+	assert np.array_equal(stage.cluster(X[:300]), stage.cfg['cluster'].process(X[:300]))
@@ -0,0 +1,60 @@
+'''
+Tests of the finalize stage
+'''
+import numpy as np
+import h5py
+
+from tests.utils import *
+
+from ephys2.lib.types import *
+from ephys2.lib.graph import *
+from ephys2.lib.cluster import link_labels_py
+from ephys2.lib.singletons import global_state
+from ephys2.lib.h5.llvbatch import H5LLVBatchSerializer
+from ephys2.pipeline.finalize import FinalizeStage
+
+def test_finalize():
+	path = rel_path('data/test_finalize.h5')
+	rng = np.random.default_rng(0)
+	N = 500
+	pairs = [tuple(p) for p in rng.integers(0, N, size=(200, 2)) if p[0] != p[1]]
+	linkage = pairs_to_ev_graph(pairs, N)
+	labels = rng.integers(0, N, size=N)
+	excluded = rng.choice(np.unique(link_labels_py(labels, linkage)), size=20, replace=False)
+	try:
+		with h5py.File(path, 'w') as file:
+			for item_id in ['0', '1']:
+				li_dir = file.create_group(f'{item_id}/linkage')
+				li_dir.attrs['shape'] = linkage.shape
+				li_dir.create_dataset('data', data=linkage.data)
+				li_dir.create_dataset('indices', data=linkage.indices)
+				li_dir.create_dataset('indptr', data=linkage.indptr)
+			file['1'].create_dataset('excluded_units', data=excluded)
+		global_state.last_h5 = path
+		stage = FinalizeStage({})
+		stage.initialize()
+		batch = LLVMultiBatch(items={
+			item_id: LLVBatch(
+				time=np.arange(N, dtype=np.int64),
+				data=rng.normal(size=(N, 3)).astype(np.float32),
+				labels=labels.copy(),
+				linkage=linkage,
+				overlap=0,
+				block_size=N,
+				full_links=True
+			) for item_id in ['0', '1']
+		})
+		inputs = {item_id: (item.time.copy(), item.data.copy()) for item_id, item in batch.items.items()}
+		result = stage.process(batch)
+		linked = link_labels_py(labels, linkage)
+		for item_id, mask in [('0', np.full(N, True)), ('1', ~np.isin(linked, excluded))]:
+			time, data = inputs[item_id]
+			item = result.items[item_id]
+			assert np.array_equal(item.time, time[mask])
+			assert np.array_equal(item.data, data[mask])
+			assert np.array_equal(item.labels, linked[mask])
+		assert result.items['1'].size < N
+	finally:
+		global_state.last_h5 = None
+		H5LLVBatchSerializer.memoized_links.clear()
+		remove_if_exists(path)
@@ -0,0 +1,68 @@
+'''
+Tests of intrinsic benchmarks
+'''
+import numpy as np
+import pytest
+
+from ephys2.lib.types import *
+from ephys2.lib.metrics import *
+from ephys2.lib.transforms import beta_truncated_dwt
+from ephys2.lib.singletons import global_metadata
+from ephys2.pipeline.benchmark.intrinsic import *
+
+def intrinsic_stage(wavelet: str='sym2', beta: float=3) -> IntrinsicBenchmarksStage:
+	stage = IntrinsicBenchmarksStage({
+		'output_file': 'intrinsic.json',
+		'method_name': 'test',
+		'dataset_name': 'test',
+		'refractory_period': 2,
+		'amplitude_cutoff': 50,
+		'n_components': 4,
+		'wavelet': wavelet,
+		'beta': beta,
+		'n_channels': 4,
+		'knn': 10,
+		'max_unit_samples': 50,
+	})
+	stage.initialize()
+	return stage
+
+@pytest.mark.parametrize('wavelet, beta', [('none', 1), ('sym2', 1), ('none', 3), ('db4', 2)])
+def test_feature_operator(wavelet, beta):
+	stage = intrinsic_stage(wavelet, beta)
+	X = np.random.randn(50, 4 * 32).astype(np.float32)
+	Y = beta_truncated_dwt(X.reshape((200, 32)), None if wavelet == 'none' else wavelet, beta).reshape((50, -1))
+	assert np.allclose(X.reshape((200, 32)) @ stage.feature_operator(32), Y.reshape((200, -1)), atol=1e-4)
+
+def test_intrinsic_metrics():
+	rng = np.random.default_rng(0)
+	stage = intrinsic_stage()
+	N, K = 2000, 5
+	labels = rng.integers(0, K, size=N)
+	centers = rng.normal(size=(K, 4 * 32)) * 100
+	data = (centers[labels] + rng.normal(size=(N, 4 * 32))).astype(np.float32)
+	time = np.sort(rng.choice(N * 100, size=N, replace=False)).astype(np.int64)
+	fs = global_metadata['sampling_rate']
+	for _ in range(2):
+		stage.process(LVMultiBatch(items={'0': LVBatch(time=time, data=data, labels=labels, overlap=0)}))
+	chgroup = stage.chgroups['0']
+	assert chgroup['n_blocks'] == 2 and chgroup['n_units'] == [K, K]
+	for label in range(K):
+		mask = labels == label
+		unit = chgroup['units'][label]
+		assert unit.n_blocks_present == 2
+		assert unit.n_samples == 2 * mask.sum()
+		assert unit.n_isi_violations == 2 * n_isi_violations(time[mask], fs, 2)
+		assert unit.n_amp_violations == 2 * n_amp_violations(data[mask], 50)
+		assert np.allclose(unit.firing_rate, firing_rate(time[mask], fs))
+		peak, snr = avg_peak_amplitude_and_snr(data[mask])
+		assert np.allclose(unit.peak, peak) and np.allclose(unit.snr, snr)
+		# Well-separated units are isolated
+		assert np.allclose(unit.nn_isolation, 1)
+
+	merged = UnitStats()
+	merged.merge(chgroup['units'][0])
+	merged.merge(chgroup['units'][0])
+	assert merged.n_samples == 2 * chgroup['units'][0].n_samples
+	assert len(merged.snr) == 4
+	assert merged.benchmark(4).presence_ratio == 1
@@ -19,4 +19,28 @@ def xtest_identical():
 		X, random_seed=0, min_cluster_size=1
 	)
 	labels.sort()
-	assert np.allclose(labels, np.array([1,1,2,2,3]))
\ No newline at end of file
+	assert np.allclose(labels, np.array([1,1,2,2,3]))
+
+def test_pca_branch():
+	rng = np.random.default_rng(0)
+	centers = rng.normal(size=(12, 20)) * 10
+	X = np.concatenate([rng.normal(size=(200, 20)) + c for c in centers]).astype(np.float32)
+	truth = np.repeat(np.arange(12), 200)
+	labels = isosplit5_pca_branch(X, random_seed=0, n_threads=1)
+	# Recovers well-separated clusters
+	assert np.unique(labels).size == 12
+	for k in range(12):
+		assert np.unique(labels[truth == k]).size == 1
+	# Independent of the number of threads
+	for n_threads in [2, 0]:
+		assert np.array_equal(labels, isosplit5_pca_branch(X, random_seed=0, n_threads=n_threads))
+
+def test_threads():
+	# Parallel statistics and pair comparisons do not change labels
+	rng = np.random.default_rng(1)
+	centers = rng.normal(size=(10, 6)) * 4
+	X = np.concatenate([rng.normal(size=(300, 6)) + c for c in centers]).astype(np.float32)
+	for refine_clusters in [False, True]:
+		labels = isosplit5(X.copy(), random_seed=0, refine_clusters=refine_clusters, n_threads=1)
+		for n_threads in [2, 0]:
+			assert np.array_equal(labels, isosplit5(X.copy(), random_seed=0, refine_clusters=refine_clusters, n_threads=n_threads))
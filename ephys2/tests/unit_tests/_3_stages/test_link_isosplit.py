@@ -0,0 +1,92 @@
+'''
+Unit tests of iso-split based linking
+'''
+
+import numpy as np
+import pytest
+
+from ephys2.lib.cluster import LinkCandidates
+from ephys2.lib.singletons import global_state
+from ephys2.pipeline.link.isosplit import *
+
+def make_stage(max_cluster_uses: int, prune_separation: float = 0) -> IsosplitStage:
+	stage = IsosplitStage({
+		'n_components': 4,
+		'isocut_threshold': 1.0,
+		'min_cluster_size': 8,
+		'K_init': 50,
+		'refine_clusters': False,
+		'max_iterations_per_pass': 500,
+		'jitter': 0,
+		'max_cluster_uses': max_cluster_uses,
+		'prune_separation': prune_separation,
+	})
+	stage.initialize()
+	return stage
+
+def sequential_links(stage: IsosplitStage, lc: LinkCandidates) -> np.ndarray:
+	'''
+	Reference implementation: test every candidate in order of centroid distance, without pruning
+	'''
+	c1, c2 = np.unique(lc.block1_labels), np.unique(lc.block2_labels)
+	m1 = np.array([lc.block1_features[lc.block1_labels == c].mean(axis=0) for c in c1])
+	m2 = np.array([lc.block2_features[lc.block2_labels == c].mean(axis=0) for c in c2])
+	links = np.vstack((np.repeat(c1, c2.size), np.tile(c2, c1.size))).T
+	links = links[np.argsort(cdist(m1, m2).ravel())]
+	uses = dict()
+	result = []
+	for C1, C2 in links:
+		if max(uses.get((1, C1), 0), uses.get((2, C2), 0)) < stage.cfg['max_cluster_uses']:
+			if stage.test_link(lc.block1_features[lc.block1_labels == C1], lc.block2_features[lc.block2_labels == C2]):
+				result.append((C1, C2))
+				uses[(1, C1)] = uses.get((1, C1), 0) + 1
+				uses[(2, C2)] = uses.get((2, C2), 0) + 1
+	return np.array(result, dtype=np.int64).reshape(-1, 2)
+
+@pytest.mark.parametrize('max_cluster_uses', [1, 2])
+def test_link_isosplit(max_cluster_uses):
+	rng = np.random.default_rng(0)
+	centers = rng.normal(size=(6, 4)) * 6
+	def block(offset: int):
+		labels = rng.integers(0, 6, size=600)
+		features = (centers[labels] + rng.normal(size=(600, 4))).astype(np.float32)
+		return labels + offset, features
+	labels1, features1 = block(0)
+	labels2, features2 = block(6)
+	lc = LinkCandidates(labels1, labels2, features1, features2, 12)
+	stage = make_stage(max_cluster_uses)
+	expected = sequential_links(stage, lc)
+	assert expected.shape[0] > 0
+	try:
+		for n_threads in [1, 3]:
+			global_state.n_threads = n_threads
+			linkage = stage.process(lc)
+			assert np.array_equal(linkage.indices.reshape(-1, 2), expected)
+			# The thread pool is reused across blocks
+			executor = stage.executor
+			stage.process(lc)
+			assert stage.executor is executor
+	finally:
+		global_state.n_threads = 1
+		stage.finalize()
+
+def test_link_isosplit_pruning():
+	rng = np.random.default_rng(1)
+	centers = np.array([[0, 0, 0, 0], [40, 0, 0, 0]])
+	def block(offset: int):
+		labels = rng.integers(0, 2, size=400)
+		features = (centers[labels] + rng.normal(size=(400, 4))).astype(np.float32)
+		return labels + offset, features
+	labels1, features1 = block(0)
+	labels2, features2 = block(2)
+	lc = LinkCandidates(labels1, labels2, features1, features2, 4)
+	stage = make_stage(1, prune_separation=5)
+	separated = stage.separated(
+		LabelGroups(labels1).split(features1), LabelGroups(labels2).split(features2),
+		LabelGroups(labels1).mean(features1), LabelGroups(labels2).mean(features2)
+	)
+	# Only the distant pairs are pruned
+	assert np.array_equal(separated, np.array([[False, True], [True, False]]))
+	linkage = stage.process(lc)
+	assert np.array_equal(linkage.indices.reshape(-1, 2), sequential_links(make_stage(1), lc))
+	stage.finalize()
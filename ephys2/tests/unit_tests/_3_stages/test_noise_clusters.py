@@ -0,0 +1,51 @@
+'''
+Tests of the noise-cluster filtering stages
+'''
+import numpy as np
+
+from ephys2.lib.types import *
+from ephys2.pipeline.postprocess.filter_noise_clusters import FilterNoiseStage
+
+class MockPCA:
+	def transform(self, X):
+		return X[:, :2]
+
+class MockModel:
+	'''
+	Classifies clusters with positive mean first coordinate as clean; counts inference calls.
+	'''
+	def __init__(self):
+		self.calls = 0
+
+	def predict(self, X):
+		self.calls += 1
+		return (X[:, 0] > 0).astype(np.int64)
+
+def test_filter_noise_batched():
+	rng = np.random.default_rng(0)
+	stage = FilterNoiseStage({})
+	stage.model, stage.pca = MockModel(), MockPCA()
+	N, K = 400, 30
+	items = dict()
+	for item_id in ['0', '1', '2']:
+		labels = rng.integers(0, K, size=N)
+		centers = rng.normal(size=(K, 4)) * 10
+		items[item_id] = LVBatch(
+			time=np.arange(N, dtype=np.int64),
+			data=(centers[labels] + rng.normal(size=(N, 4))).astype(np.float32),
+			labels=labels,
+			overlap=0
+		)
+	expected = dict()
+	for item_id, item in items.items():
+		means = np.stack([item.data[item.labels == l].mean(axis=0) for l in range(K)])
+		mask = means[item.labels, 0] > 0
+		expected[item_id] = (item.time[mask], item.data[mask], item.labels[mask])
+	result = stage.process(LVMultiBatch(items=items))
+	assert stage.model.calls == 1
+	for item_id, (time, data, labels) in expected.items():
+		item = result.items[item_id]
+		assert 0 < item.size < N
+		assert np.array_equal(item.time, time)
+		assert np.array_equal(item.data, data)
+		assert np.array_equal(item.labels, labels)
@@ -0,0 +1,35 @@
+'''
+Unit tests of segmentation fusion linking
+'''
+
+import itertools
+import numpy as np
+import pytest
+
+from ephys2.pipeline.link.segfuse import *
+
+def brute_force_links(W: np.ndarray, threshold: float) -> float:
+	'''
+	Optimal objective of the linking integer program by enumeration
+	'''
+	n1, n2 = W.shape
+	best = 0
+	for k in range(1, min(n1, n2) + 1):
+		for rows in itertools.combinations(range(n1), k):
+			for cols in itertools.permutations(range(n2), k):
+				best = max(best, sum(W[r, c] - threshold for r, c in zip(rows, cols)))
+	return best
+
+@pytest.mark.parametrize('shape', [(1, 1), (3, 3), (2, 5), (5, 2), (4, 4)])
+@pytest.mark.parametrize('threshold', [0, 0.3, 0.7, 1])
+def test_match_links(shape, threshold):
+	rng = np.random.default_rng(0)
+	for _ in range(10):
+		W = rng.uniform(size=shape)
+		links = match_links(W, threshold)
+		assert links.shape[0] == 2
+		# Each cluster is linked at most once, along edges above the threshold
+		assert np.unique(links[0]).size == np.unique(links[1]).size == links.shape[1]
+		assert np.all(W[links[0], links[1]] > threshold)
+		# Optimal
+		assert np.isclose((W[links[0], links[1]] - threshold).sum(), brute_force_links(W, threshold))
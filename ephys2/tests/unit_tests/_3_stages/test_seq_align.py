@@ -6,7 +6,7 @@ import pytest
 import random
 
 from ephys2.lib.types import random_labeling
-from ephys2.lib.seq_align import seq_align
+from ephys2.lib.seq_align import seq_align, pair, pair_times
 from ephys2 import _cpp
 
 def random_times(N, min_dt: int=1, max_dt: int=1000):
@@ -44,3 +44,34 @@ def test_seq_align():
 	res2 = _cpp.align_sequences(t1, t2, v1, v2, max_dist, fill_val)
 
 	assert np.allclose(res1, res2)
+
+@pytest.mark.repeat(5)
+def test_pair_times():
+	N1 = random.randint(0, 100)
+	N2 = random.randint(0, 100)
+	t1 = random_times(N1, max_dt=20)
+	t2 = random_times(N2, max_dt=20)
+	max_dist = random.randint(1, 10)
+
+	idxs1, idxs2, unmatched1, unmatched2 = pair_times(t1, t2, max_dist)
+	exp1, exp2 = pair(t1, t2, max_dist)
+	assert np.array_equal(idxs1, exp1) and np.array_equal(idxs2, exp2)
+	assert idxs1.dtype == idxs2.dtype == np.int64
+	assert np.all(np.abs(t1[idxs1] - t2[idxs2]) <= max_dist)
+	assert unmatched1.sum() == N1 - idxs1.size and not unmatched1[idxs1].any()
+	assert unmatched2.sum() == N2 - idxs2.size and not unmatched2[idxs2].any()
+
+@pytest.mark.parametrize('t1, t2, max_dist, exp1, exp2', [
+	([5], [4, 5], 2, [0], [1]), # Coincident neighbor
+	([5], [0, 6], 10, [0], [1]), # Nearer neighbor
+	([4, 5], [5], 2, [1], [0]),
+	([0, 6], [5], 10, [1], [0]),
+	([5], [3, 7], 10, [0], [0]), # Ties to the earlier
+	([3, 7], [5], 10, [0], [0]),
+	([0, 10, 11], [1, 12], 5, [0, 2], [0, 1]),
+])
+def test_pair_times_nearest(t1, t2, max_dist, exp1, exp2):
+	t1, t2 = np.array(t1, dtype=np.int64), np.array(t2, dtype=np.int64)
+	idxs1, idxs2, _, _ = pair_times(t1, t2, max_dist)
+	assert idxs1.tolist() == exp1 and idxs2.tolist() == exp2
+	assert pair(t1, t2, max_dist) == (exp1, exp2)
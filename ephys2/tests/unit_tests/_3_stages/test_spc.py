@@ -48,3 +48,48 @@ def test_dfs_paths():
 		frozenset([id(a), id(g)])
 	])
 	assert got_paths == exp_paths
+
+@pytest.mark.parametrize('metric', TREE_METRICS)
+@pytest.mark.parametrize('Knn', [1, 3, 11])
+def test_neighbor_graph(metric, Knn):
+	# The sparse neighbor graph yields the same clustering as the dense distance matrix
+	X = np.concatenate([np.random.randn(30, 4), np.random.randn(30, 4) + 5])
+	dists = cdist(X, X, metric=metric)
+	graph = neighbor_graph(X, Knn, True, metric)
+	rows = np.repeat(np.arange(X.shape[0]), np.diff(graph.indptr))
+	assert np.allclose(graph.data, dists[rows, graph.indices])
+	temps1, clusters1 = ephys2._cpp.super_paramagnetic_clustering(dists, 0.01, 0.2, 0.02, 50, Knn, True, 0)
+	temps2, clusters2 = ephys2._cpp.super_paramagnetic_clustering_sparse(graph.indptr, graph.indices, graph.data, 0.01, 0.2, 0.02, 50, 0)
+	assert np.allclose(temps1, temps2)
+	assert np.array_equal(clusters1, clusters2)
+
+@pytest.mark.parametrize('seed', [0, 1])
+def test_parallel_temperatures(seed):
+	# Seeded results do not depend on the number of threads
+	X = np.concatenate([np.random.randn(100, 4), np.random.randn(100, 4) + 5])
+	temps1, clusters1 = run_spc(X, 0.01, 0.2, 20, 50, 11, random_seed=seed, n_threads=1)
+	for n_threads in [2, 3, 0]:
+		temps2, clusters2 = run_spc(X, 0.01, 0.2, 20, 50, 11, random_seed=seed, n_threads=n_threads)
+		assert np.array_equal(temps1, temps2)
+		assert np.array_equal(clusters1, clusters2)
+	# Clusterings are nested across increasing temperatures
+	for lo, hi in zip(clusters1[:-1], clusters1[1:]):
+		for c in np.unique(hi):
+			assert np.unique(lo[hi == c]).size == 1
+
+def test_tree_statistics():
+	# Nodes carry the sufficient statistics of their samples, also after merging
+	X = np.concatenate([np.random.randn(100, 4), np.random.randn(100, 4) + 5])
+	temps, labelings = run_spc(X, 0.01, 0.2, 20, 50, 11, random_seed=0, n_threads=1)
+	tree = SPCTree.construct(labelings)
+	tree.summarize(X)
+	for node in tree.dfs():
+		assert node.count == node.cluster.size
+		assert np.allclose(node.mean(), X[node.cluster].mean(axis=0))
+	parent = next(node for node in tree.dfs() if len(node.children) > 1)
+	a, b = parent.children[0], parent.children[1]
+	a.merge(b)
+	assert np.allclose(a.mean(), X[a.cluster].mean(axis=0))
+	# Collapsed clusters partition the samples
+	clustering = collapse_labelings_to_clustering(X, labelings, 0.05)
+	assert np.array_equal(np.sort(np.concatenate(clustering)), np.arange(X.shape[0]))
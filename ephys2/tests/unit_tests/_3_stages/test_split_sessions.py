@@ -0,0 +1,42 @@
+'''
+Tests of the session-splitting stage
+'''
+import numpy as np
+
+from ephys2.lib.types import *
+from ephys2.pipeline.postprocess.split_sessions import SplitSessionsStage
+
+class MockSerializer:
+	def __init__(self):
+		self.written = []
+
+	def write(self, data):
+		self.written.append(data)
+
+def test_split_sessions():
+	rng = np.random.default_rng(0)
+	splits = [100, 100, 250, 600, 1000]
+	stage = SplitSessionsStage({'name': 'test'})
+	stage.session_splits = splits
+	stage.n_splits = len(splits)
+	stage.session_bounds = np.array([0] + splits, dtype=np.int64)
+	stage.serializers = [MockSerializer() for _ in splits]
+	items = dict()
+	for item_id in ['0', '1']:
+		time = np.sort(rng.integers(-50, 1200, size=500))
+		items[item_id] = LVBatch(
+			time=time,
+			data=rng.normal(size=(time.size, 3)).astype(np.float32),
+			labels=rng.integers(0, 10, size=time.size),
+			overlap=0
+		)
+	stage.process(LVMultiBatch(items=items))
+	for i, (start, end) in enumerate(zip([0] + splits[:-1], splits)):
+		written = stage.serializers[i].written
+		assert len(written) == 1 and isinstance(written[0], LVMultiBatch)
+		for item_id, item in items.items():
+			mask = (item.time >= start) & (item.time < end)
+			chunk = written[0].items[item_id]
+			assert np.array_equal(chunk.time, item.time[mask])
+			assert np.array_equal(chunk.data, item.data[mask])
+			assert np.array_equal(chunk.labels, item.labels[mask])
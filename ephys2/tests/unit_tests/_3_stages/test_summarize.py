@@ -0,0 +1,69 @@
+'''
+Tests of the summarize stage
+'''
+import numpy as np
+import pytest
+
+from ephys2.lib.types import *
+from ephys2.lib.singletons import global_state
+from ephys2.pipeline.postprocess.summarize import SummarizeStage
+
+def summarize_reference(time, data, labels, B, R):
+	'''
+	Windows of R consecutive samples of each label within each block, sorted by block & time.
+	'''
+	rows = []
+	for k in range(0, time.size, B):
+		block = []
+		for lb in np.unique(labels[k:k+B]):
+			where = k + np.flatnonzero(labels[k:k+B] == lb)
+			for r in range(0, where.size, R):
+				w = where[r:r+R]
+				block.append((int(np.median(time[w])), lb, np.median(data[w], axis=0), data[w].var(axis=0), np.diff(time[w]), w))
+		rows.extend(sorted(block, key=lambda row: row[0]))
+	return rows
+
+LOAD_STATE = ['load_overlap', 'load_batch_size', 'load_index', 'load_start']
+
+@pytest.mark.parametrize('M, R, ND', [(4, 10, 3), (1, 7, 100), (3, 5, 1)])
+def test_summarize(M, R, ND):
+	rng = np.random.default_rng(0)
+	N, B = 1000, 250
+	time = np.sort(rng.choice(10 ** 9, size=N, replace=False)).astype(np.int64)
+	data = rng.normal(size=(N, M) if M > 1 else N).astype(np.float32)
+	labels = rng.integers(0, 6, size=N).astype(np.int64)
+	load_state = {attr: getattr(global_state, attr) for attr in LOAD_STATE}
+	try:
+		for attr in LOAD_STATE:
+			setattr(global_state, attr, 0)
+		stage = SummarizeStage({
+			'downsample_ratio': R,
+			'downsample_data_method': 'median',
+			'downsample_time_method': 'median',
+			'isi_subsamples': ND,
+		})
+		result = stage.process(LLVMultiBatch(items={
+			'0': LLVBatch(time=time, data=data, labels=labels, linkage=None, overlap=0, block_size=B, full_links=False)
+		})).items['0'].summary
+
+		expected = summarize_reference(time, data, labels, B, R)
+		assert result.time.shape == (len(expected),)
+		assert result.data.shape == result.variance.shape == mkshape(len(expected), M)
+		assert result.difftime.shape == mkshape(len(expected), ND)
+		assert result.indices.shape == mkshape(len(expected), R)
+		for i, (t, lb, median, var, isi, where) in enumerate(expected):
+			assert result.time[i] == t
+			assert result.labels[i] == lb
+			assert np.allclose(result.data[i], median)
+			assert np.allclose(result.variance[i], var, atol=1e-5)
+			indices = result.indices.reshape(-1, R)[i]
+			assert np.array_equal(indices[:where.size], where) and np.all(indices[where.size:] == -1)
+			difftime = result.difftime.reshape(-1, ND)[i]
+			if isi.size <= ND:
+				assert np.array_equal(difftime[:isi.size], isi) and np.all(difftime[isi.size:] == -1)
+			else:
+				# Subsampled without replacement
+				assert np.all(np.isin(difftime, isi)) and np.unique(difftime).size == ND
+	finally:
+		for attr, value in load_state.items():
+			setattr(global_state, attr, value)